@@ -0,0 +1,55 @@
+"""
+Runs the benchmark suite from the project root:
+
+    python -m benchmarks [--group functions] [--save NAME] [--compare NAME]
+
+Results report latency percentiles and throughput for each case. --save stores the results as a
+named baseline in benchmarks/results, and --compare exits with a non-zero status if any case's
+median latency is more than --tolerance slower than the named baseline.
+"""
+# Standard imports
+import argparse
+import sys
+
+# local imports
+from benchmarks import cases  # noqa: F401 registers the cases
+from benchmarks.harness import CASES, compare_results, format_table, load_results, run_case, save_results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="DKA calculator benchmark suite")
+    parser.add_argument("--group", action="append", help="Only run this group of cases (repeatable)")
+    parser.add_argument("--iterations", type=int, default=2000, help="Timed calls per case (default 2000)")
+    parser.add_argument("--warmup", type=int, default=200, help="Untimed calls per case before timing (default 200)")
+    parser.add_argument("--save", metavar="NAME", help="Save the results as a named baseline")
+    parser.add_argument("--compare", metavar="NAME", help="Compare the results with a named baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed median slowdown against the baseline (default 0.2)")
+    arguments = parser.parse_args(argv)
+
+    selected = [case for case in CASES if arguments.group is None or case["group"] in arguments.group]
+
+    results = []
+    for case in selected:
+        try:
+            results.append(run_case(case, iterations=arguments.iterations, warmup=arguments.warmup))
+        except ImportError as error:
+            print(f"Skipping {case['group']}/{case['name']}: {error}", file=sys.stderr)
+
+    print(format_table(results))
+
+    if arguments.save:
+        print(f"Saved baseline to {save_results(results, arguments.save)}")
+
+    if arguments.compare:
+        regressions = compare_results(results, load_results(arguments.compare), tolerance=arguments.tolerance)
+        if regressions:
+            print(f"Regressions against baseline {arguments.compare}:")
+            print("\n".join(regressions))
+            return 1
+        print(f"No regressions against baseline {arguments.compare}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Benchmark cases for the calculation functions, the route handler and the HTTP endpoint
+"""
+# Standard imports
+from datetime import date
+
+# local imports
+from benchmarks.harness import benchmark
+from dka_calculator import dka_calculator
+
+EXAMPLE_REQUEST = {
+    "birth_date": "2015-04-12",
+    "resuscitation_start_date_time": "2022-02-06",
+    "sex": "female",
+    "weight": 23,
+    "pH": 6.86,
+    "shocked": True,
+    "insulin_infusion_rate": 0.05
+}
+
+# Scalar calculation functions
+@benchmark("functions")
+def age_to_nearest_year():
+    birth_date = date(2015, 4, 12)
+    observation_date = date(2022, 2, 6)
+    return lambda: dka_calculator.age_to_nearest_year(birth_date=birth_date, observation_date=observation_date)
+
+@benchmark("functions")
+def derive_weight():
+    return lambda: dka_calculator.derive_weight(age=7, sex="female")
+
+@benchmark("functions")
+def deficit_percentage():
+    return lambda: dka_calculator.deficit_percentage(pH=6.86)
+
+@benchmark("functions")
+def deficit_volume():
+    return lambda: dka_calculator.deficit_volume(percentage_deficit=10, weight=23)
+
+@benchmark("functions")
+def crystalloid_bolus():
+    return lambda: dka_calculator.crystalloid_bolus(weight=23, volume_per_kilogram=10)
+
+@benchmark("functions")
+def holliday_segar_volume():
+    return lambda: dka_calculator.holliday_segar_volume(weight=23)
+
+@benchmark("functions")
+def holliday_segar_advice():
+    return lambda: dka_calculator.holliday_segar_advice(weight=23)
+
+@benchmark("functions")
+def calculated_insulin_rate():
+    return lambda: dka_calculator.calculated_insulin_rate(weight=23, insulin_per_kg=0.05)
+
+@benchmark("functions")
+def calculate_plan():
+    return lambda: dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+
+@benchmark("functions")
+def calculate_plan_explained():
+    plan = dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+    return plan.explained_outputs
+
+@benchmark("functions")
+def limit_breaches():
+    plan = dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+    return plan.limit_breaches
+
+@benchmark("functions")
+def hourly_schedule_window():
+    plan = dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+    return lambda: list(dka_calculator.hourly_schedule(plan=plan, start_hour=12, end_hour=24))
+
+@benchmark("functions")
+def revise_plan_pH():
+    plan = dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+    return lambda: dka_calculator.revise_plan(plan, pH=7.15)
+
+# Response serialisation, validated against the response model or encoded directly
+def _serialisation_call(response_mode: str, fast: bool):
+    from routes.dka_calculations import render_validated_dka_plan
+    from utilities.serialisation import encode_json
+
+    plan = dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+    content = plan.outputs() if response_mode == "compact" else plan.explained_outputs()
+    if fast:
+        return lambda: encode_json(content)
+    return lambda: render_validated_dka_plan(plan=content, response_mode=response_mode)
+
+@benchmark("serialisation")
+def full_validated():
+    return _serialisation_call(response_mode="full", fast=False)
+
+@benchmark("serialisation")
+def full_fast():
+    return _serialisation_call(response_mode="full", fast=True)
+
+@benchmark("serialisation")
+def compact_validated():
+    return _serialisation_call(response_mode="compact", fast=False)
+
+@benchmark("serialisation")
+def compact_fast():
+    return _serialisation_call(response_mode="compact", fast=True)
+
+def _compact_plan():
+    return dka_calculator.calculate_plan(
+        birth_date=date(2015, 4, 12),
+        observation_date=date(2022, 2, 6),
+        sex="female",
+        pH=6.86,
+        shocked=True,
+        insulin_infusion_rate=0.05,
+        weight=23
+    )
+
+@benchmark("serialisation")
+def compact_msgpack():
+    import msgpack  # noqa: F401 skips the case if msgpack is not installed
+    from utilities.serialisation import encode_msgpack
+
+    content = _compact_plan().outputs()
+    return lambda: encode_msgpack(content)
+
+@benchmark("serialisation")
+def plan_record():
+    from utilities.serialisation import encode_plan_record
+
+    content = _compact_plan().outputs()
+    return lambda: encode_plan_record(outputs=content, severity=2, limit_level=0)
+
+# Route handler called directly
+def _handler_call(response_mode: str, cached: bool):
+    from routes.dka_calculations import dka_calculation_response
+    from schemas.dka_request_schema import ChildStatusRequestParameters
+    from utilities.calculation_cache import calculation_cache
+
+    child_request_parameters = ChildStatusRequestParameters(**EXAMPLE_REQUEST)
+
+    async def call():
+        if not cached:
+            calculation_cache.clear()
+        return await dka_calculation_response(
+            child_request_parameters=child_request_parameters,
+            response_mode=response_mode,
+            accept=None
+        )
+    return call
+
+@benchmark("handler")
+def full_uncached():
+    return _handler_call(response_mode="full", cached=False)
+
+@benchmark("handler")
+def full_cached():
+    return _handler_call(response_mode="full", cached=True)
+
+@benchmark("handler")
+def compact_uncached():
+    return _handler_call(response_mode="compact", cached=False)
+
+@benchmark("handler")
+def scenario_sweep():
+    from routes.dka_calculations import dka_scenario_sweep_response
+    from schemas.dka_request_schema import DKAScenarioSweepRequest
+
+    # 121 weights x 9 pH values x 2 x 2 = 4356 combinations
+    sweep = DKAScenarioSweepRequest(
+        patient=EXAMPLE_REQUEST,
+        weights={"start": 20, "stop": 80, "step": 0.5},
+        pH={"start": 6.6, "stop": 7.4, "step": 0.1},
+        shocked=[True, False],
+        insulin_infusion_rates=[0.05, 0.1]
+    )
+
+    async def call():
+        return await dka_scenario_sweep_response(sweep=sweep)
+    return call
+
+# HTTP endpoint called in process through the ASGI app, with no network
+def _http_call(path: str, cached: bool):
+    import httpx
+
+    from main import app
+    from utilities.calculation_cache import calculation_cache
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark")
+
+    async def call():
+        if not cached:
+            calculation_cache.clear()
+        response = await client.post(path, json=EXAMPLE_REQUEST)
+        response.raise_for_status()
+    return call
+
+@benchmark("http")
+def post_calculation_uncached():
+    return _http_call(path="/dka/calculation", cached=False)
+
+@benchmark("http")
+def post_calculation_cached():
+    return _http_call(path="/dka/calculation", cached=True)
+
+@benchmark("http")
+def post_calculation_compact_uncached():
+    return _http_call(path="/dka/calculation?response_mode=compact", cached=False)
@@ -0,0 +1,133 @@
+"""
+Benchmark harness
+"""
+# Standard imports
+import asyncio
+import inspect
+import json
+from pathlib import Path
+import time
+
+RESULTS_DIRECTORY = Path(__file__).parent / "results"
+
+# the registry of benchmark cases, in the order they are declared
+CASES = []
+
+
+def benchmark(group: str, name: str = None):
+    """
+    Registers a benchmark case. The decorated function is a factory which does any setup
+    and returns the zero argument function (or coroutine function) to be timed.
+    """
+    def register(factory):
+        CASES.append({"group": group, "name": name or factory.__name__, "factory": factory})
+        return factory
+    return register
+
+
+def measure(function, iterations: int, warmup: int) -> list:
+    """
+    Returns the duration of each call in nanoseconds
+    """
+    for _ in range(warmup):
+        function()
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(iterations):
+        start = clock()
+        function()
+        timings.append(clock() - start)
+    return timings
+
+
+def measure_async(coroutine_function, iterations: int, warmup: int) -> list:
+    """
+    Returns the duration of each awaited call in nanoseconds, run on a single event loop
+    """
+    async def run():
+        for _ in range(warmup):
+            await coroutine_function()
+        timings = []
+        clock = time.perf_counter_ns
+        for _ in range(iterations):
+            start = clock()
+            await coroutine_function()
+            timings.append(clock() - start)
+        return timings
+    return asyncio.run(run())
+
+
+def percentile(sorted_timings: list, fraction: float) -> float:
+    """
+    Nearest rank percentile of an already sorted list
+    """
+    index = min(len(sorted_timings) - 1, max(0, round(fraction * len(sorted_timings)) - 1))
+    return sorted_timings[index]
+
+
+def summarise(group: str, name: str, timings: list) -> dict:
+    """
+    Returns latency percentiles in microseconds and throughput in calls per second
+    """
+    ordered = sorted(timings)
+    total = sum(ordered)
+    return {
+        "group": group,
+        "name": name,
+        "iterations": len(ordered),
+        "mean_us": total / len(ordered) / 1000,
+        "p50_us": percentile(ordered, 0.50) / 1000,
+        "p90_us": percentile(ordered, 0.90) / 1000,
+        "p99_us": percentile(ordered, 0.99) / 1000,
+        "ops_per_second": len(ordered) / (total / 1e9) if total else float("inf"),
+    }
+
+
+def run_case(case: dict, iterations: int, warmup: int) -> dict:
+    function = case["factory"]()
+    if inspect.iscoroutinefunction(function):
+        timings = measure_async(function, iterations=iterations, warmup=warmup)
+    else:
+        timings = measure(function, iterations=iterations, warmup=warmup)
+    return summarise(group=case["group"], name=case["name"], timings=timings)
+
+
+def save_results(results: list, baseline: str) -> Path:
+    RESULTS_DIRECTORY.mkdir(exist_ok=True)
+    path = RESULTS_DIRECTORY / f"{baseline}.json"
+    path.write_text(json.dumps(results, indent=4))
+    return path
+
+
+def load_results(baseline: str) -> list:
+    return json.loads((RESULTS_DIRECTORY / f"{baseline}.json").read_text())
+
+
+def compare_results(results: list, baseline_results: list, tolerance: float) -> list:
+    """
+    Returns a description of every case whose median latency is more than
+    tolerance (as a fraction) slower than the same case in the baseline
+    """
+    baseline_by_case = {(result["group"], result["name"]): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_by_case.get((result["group"], result["name"]))
+        if baseline_result is None:
+            continue
+        change = result["p50_us"] / baseline_result["p50_us"] - 1
+        if change > tolerance:
+            regressions.append(
+                f"{result['group']}/{result['name']}: p50 {baseline_result['p50_us']:.2f}us -> {result['p50_us']:.2f}us (+{change:.0%})"
+            )
+    return regressions
+
+
+def format_table(results: list) -> str:
+    lines = [f"{'benchmark':<48}{'mean us':>11}{'p50 us':>11}{'p90 us':>11}{'p99 us':>11}{'ops/s':>13}"]
+    for result in results:
+        lines.append(
+            f"{result['group'] + '/' + result['name']:<48}"
+            f"{result['mean_us']:>11.2f}{result['p50_us']:>11.2f}{result['p90_us']:>11.2f}{result['p99_us']:>11.2f}"
+            f"{result['ops_per_second']:>13,.0f}"
+        )
+    return "\n".join(lines)
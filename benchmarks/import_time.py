@@ -0,0 +1,72 @@
+"""
+Import time budget for cold starts, run from the project root:
+
+    python -m benchmarks.import_time [--budget-ms 1000] [--runs 5]
+
+Imports the app in fresh interpreters with python -X importtime and exits with a non-zero status
+if the fastest cumulative import time of main exceeds the budget, or if any module which should
+only be imported on first use (such as numpy) is imported at startup.
+"""
+# Standard imports
+import argparse
+import subprocess
+import sys
+
+# modules only needed by the batch and vectorised paths, which must not slow down startup
+DEFERRED_MODULES = ("numpy",)
+
+
+def import_time_us(module: str) -> tuple:
+    """
+    Returns the cumulative import time of the module in microseconds and the set of modules imported
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    cumulative = None
+    imported = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative_us.isdigit():
+            # the header line
+            continue
+        imported.add(name)
+        if name == module:
+            cumulative = int(cumulative_us)
+    return cumulative, imported
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.import_time", description="Import time budget check")
+    parser.add_argument("--module", default="main", help="Module to import (default main)")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="Maximum cumulative import time in milliseconds (default 1000)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to try; the fastest is compared with the budget (default 5)")
+    arguments = parser.parse_args(argv)
+
+    timings = []
+    imported = set()
+    for _ in range(arguments.runs):
+        cumulative, imported = import_time_us(arguments.module)
+        timings.append(cumulative / 1000)
+
+    fastest = min(timings)
+    print(f"import {arguments.module}: fastest {fastest:.1f}ms, slowest {max(timings):.1f}ms over {arguments.runs} runs (budget {arguments.budget_ms:.0f}ms)")
+
+    failed = False
+    eagerly_imported = [module for module in DEFERRED_MODULES if module in imported]
+    if eagerly_imported:
+        print(f"Imported at startup but should be deferred: {', '.join(eagerly_imported)}")
+        failed = True
+    if fastest > arguments.budget_ms:
+        print("Import time is over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Load test against a running server, run from the project root:
+
+    python -m benchmarks.load [--url http://127.0.0.1:8000] [--concurrency 64] [--duration 10]
+
+--start-server launches the production profile (python -m server) on --port first and stops it
+afterwards, so the same command can be repeated on any machine. Each of the --concurrency clients
+posts calculation requests back to back over its own keep-alive connection for --duration
+seconds, after --warmup seconds which are not recorded. --vary gives each request a different
+weight so that the calculation cache does not answer them all.
+"""
+# Standard imports
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+# local imports
+from benchmarks.cases import EXAMPLE_REQUEST
+from benchmarks.harness import percentile
+
+
+async def client(http_client, url: str, vary: bool, deadline: float, recording_from: float, timings: list, errors: list):
+    clock = time.perf_counter
+    while True:
+        started = clock()
+        if started >= deadline:
+            return
+        payload = EXAMPLE_REQUEST
+        if vary:
+            payload = dict(EXAMPLE_REQUEST, weight=round(random.uniform(5, 75), 1))
+        try:
+            response = await http_client.post(url, json=payload)
+            failed = response.status_code != 200
+        except Exception as error:
+            failed = True
+            response = error
+        finished = clock()
+        if started < recording_from:
+            continue
+        if failed:
+            errors.append(response)
+        else:
+            timings.append(finished - started)
+
+
+async def run_load(url: str, concurrency: int, duration: float, warmup: float, vary: bool) -> dict:
+    import httpx
+
+    timings = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as http_client:
+        started = time.perf_counter()
+        recording_from = started + warmup
+        deadline = recording_from + duration
+        await asyncio.gather(*(
+            client(http_client, url, vary, deadline, recording_from, timings, errors)
+            for _ in range(concurrency)
+        ))
+
+    ordered = sorted(timings)
+    return {
+        "requests": len(ordered),
+        "errors": len(errors),
+        "requests_per_second": len(ordered) / duration,
+        "p50_ms": percentile(ordered, 0.50) * 1000 if ordered else float("nan"),
+        "p90_ms": percentile(ordered, 0.90) * 1000 if ordered else float("nan"),
+        "p99_ms": percentile(ordered, 0.99) * 1000 if ordered else float("nan"),
+    }
+
+
+def start_server(port: int, workers: int = None) -> subprocess.Popen:
+    """
+    Starts the production profile and waits until it answers requests
+    """
+    import httpx
+
+    environment = dict(os.environ, DKA_HOST="127.0.0.1", DKA_PORT=str(port))
+    if workers:
+        environment["DKA_WORKERS"] = str(workers)
+    # the request logs would otherwise be interleaved with the results
+    server = subprocess.Popen([sys.executable, "-m", "server"], env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise Exception(f"The server exited with status {server.returncode} before it started.")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/dka/calculation/cache", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise Exception("The server did not start within 30 seconds.")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="DKA calculator load test")
+    parser.add_argument("--url", help="Server base URL (default http://127.0.0.1:PORT)")
+    parser.add_argument("--path", default="/dka/calculation", help="Endpoint to post to (default /dka/calculation)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent clients (default 64)")
+    parser.add_argument("--duration", type=float, default=10, help="Recorded seconds (default 10)")
+    parser.add_argument("--warmup", type=float, default=2, help="Unrecorded seconds before recording (default 2)")
+    parser.add_argument("--vary", action="store_true", help="Vary the weight in each request so that most miss the calculation cache")
+    parser.add_argument("--start-server", action="store_true", help="Start python -m server for the test and stop it afterwards")
+    parser.add_argument("--port", type=int, default=8000, help="Port for --start-server and the default URL (default 8000)")
+    parser.add_argument("--workers", type=int, help="Workers for --start-server (default: one per CPU)")
+    arguments = parser.parse_args(argv)
+
+    base_url = arguments.url or f"http://127.0.0.1:{arguments.port}"
+    server = start_server(arguments.port, arguments.workers) if arguments.start_server else None
+    try:
+        result = asyncio.run(run_load(
+            url=base_url + arguments.path,
+            concurrency=arguments.concurrency,
+            duration=arguments.duration,
+            warmup=arguments.warmup,
+            vary=arguments.vary
+        ))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(
+        f"{arguments.path}: {result['requests']:,} requests, {result['errors']:,} errors, "
+        f"{result['requests_per_second']:,.0f} requests/s, "
+        f"p50 {result['p50_ms']:.2f}ms, p90 {result['p90_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms "
+        f"({arguments.concurrency} clients, {arguments.duration:g}s)"
+    )
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
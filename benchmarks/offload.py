@@ -0,0 +1,123 @@
+"""
+Compares calculating inline on the event loop with offloading to the pool, under concurrent load,
+run from the project root:
+
+    python -m benchmarks.offload [--concurrency 32] [--requests 2000] [--batch-clients 1] [--batch-size 500]
+
+Requests are sent in process through the ASGI app, with no network, by --concurrency clients at once.
+Each request varies the weight so that it misses the calculation cache. An in process request only
+gives way to other tasks when it awaits the pool, so each client yields to the event loop before
+each request, taking turns as connections to a server would, and the time spent waiting for its
+turn is included in its latency. Two scenarios are run, each
+with the inline and the pooled policy:
+
+- calculation: single calculations only, with DKA_OFFLOAD_CALCULATIONS off and on
+- mixed: single calculations alongside --batch-clients clients posting compact batches of --batch-size
+  items, with the batches run inline and offloaded; the latencies reported are those of the single calculations
+"""
+# Standard imports
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+# local imports
+from benchmarks.cases import EXAMPLE_REQUEST
+from benchmarks.harness import percentile
+
+
+async def calculation_client(client, remaining: list, timings: list, errors: list):
+    clock = time.perf_counter
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        payload = dict(EXAMPLE_REQUEST, weight=round(random.uniform(5, 75), 1))
+        started = clock()
+        # the request waits its turn on the event loop, as it would arriving at a server
+        await asyncio.sleep(0)
+        response = await client.post("/dka/calculation", json=payload)
+        if response.status_code == 200:
+            timings.append(clock() - started)
+        else:
+            errors.append(response.status_code)
+
+
+async def batch_client(client, batch_size: int, running: list):
+    presentations = [dict(EXAMPLE_REQUEST, weight=round(random.uniform(5, 75), 1)) for _ in range(batch_size)]
+    while running[0]:
+        await asyncio.sleep(0)
+        await client.post("/dka/calculations:batch?response_mode=compact", json=presentations)
+
+
+async def run_scenario(concurrency: int, requests: int, batch_clients: int, batch_size: int) -> dict:
+    import httpx
+
+    from main import app
+
+    timings = []
+    errors = []
+    remaining = [requests]
+    running = [True]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        batches = [asyncio.ensure_future(batch_client(client, batch_size, running)) for _ in range(batch_clients)]
+        started = time.perf_counter()
+        await asyncio.gather(*(calculation_client(client, remaining, timings, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        running[0] = False
+        await asyncio.gather(*batches)
+
+    ordered = sorted(timings)
+    return {
+        "requests": len(ordered),
+        "errors": len(errors),
+        "requests_per_second": len(ordered) / elapsed,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.offload", description="Inline and pooled calculation under concurrent load")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent calculation clients (default 32)")
+    parser.add_argument("--requests", type=int, default=2000, help="Calculation requests per run (default 2000)")
+    parser.add_argument("--batch-clients", type=int, default=1, help="Concurrent batch clients in the mixed scenario (default 1)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Items in each batch in the mixed scenario (default 500)")
+    arguments = parser.parse_args(argv)
+
+    from utilities import offload
+    from utilities.calculation_cache import calculation_cache
+
+    if offload.executor() is None:
+        print("DKA_OFFLOAD_POOL is none, so there is no pool to compare with.", file=sys.stderr)
+        return 1
+
+    # (scenario, policy, offload single calculations, batch items from which batches are offloaded, batch clients)
+    runs = [
+        ("calculation", "inline", False, offload.offload_batch_items, 0),
+        ("calculation", "pooled", True, offload.offload_batch_items, 0),
+        ("mixed", "inline", False, arguments.batch_size + 1, arguments.batch_clients),
+        ("mixed", "pooled", False, arguments.batch_size, arguments.batch_clients),
+    ]
+    print(f"{'scenario':<14}{'policy':<10}{'requests/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    try:
+        for scenario, policy, offload_calculations, offload_batch_items, batch_clients in runs:
+            offload.offload_calculations = offload_calculations
+            offload.offload_batch_items = offload_batch_items
+            calculation_cache.clear()
+            result = asyncio.run(run_scenario(
+                concurrency=arguments.concurrency,
+                requests=arguments.requests,
+                batch_clients=batch_clients,
+                batch_size=arguments.batch_size
+            ))
+            print(
+                f"{scenario:<14}{policy:<10}{result['requests_per_second']:>12,.0f}"
+                f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['errors']:>8,}"
+            )
+    finally:
+        offload.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
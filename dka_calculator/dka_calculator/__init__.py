@@ -1,4 +1,16 @@
 from .age_calculations import age_to_nearest_year
-from .fluid import deficit_percentage, deficit_volume, crystalloid_bolus, holliday_segar_volume, pH_ranges, holliday_segar_advice
-from .weight_calculations import derive_weight
-from .insulin import calculated_insulin_rate
\ No newline at end of file
+from .fluid import dka_severity, deficit_percentage, deficit_volume, crystalloid_bolus, holliday_segar_volume, pH_ranges, holliday_segar_advice
+from .weight_calculations import derive_weight, derive_weights
+from .insulin import calculated_insulin_rate
+from .guidelines import DEFAULT_GUIDELINE_VERSION, GUIDELINE_VERSIONS, Guideline, ImplausibleMeasurement, get_guideline
+from .limits import LimitExceeded, check_limits, limit_level, limit_levels
+from .plan import DKAPlan, calculate_plan
+from .schedule import SCHEDULE_HOURS, hourly_schedule
+from .revision import REVISABLE_INPUTS, dependent_stages, plan_diff, revise_plan
+import importlib
+
+def __getattr__(name):
+    # the vectorised engine needs numpy, so it is only imported when first used
+    if name == "vectorised":
+        return importlib.import_module(f"{__name__}.vectorised")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,266 @@
+"""
+This file contains the dka-calc command line interface.
+`dka-calc bulk` runs the calculation over a CSV or Parquet file of presentations, one per row,
+and writes the inputs with the calculated values appended as CSV or Parquet.
+The file is read and calculated in chunks using the vectorised engine, optionally across a pool
+of worker processes, so memory use depends on the chunk size rather than the size of the file.
+Input columns are birth_date, resuscitation_start_date_time, sex, pH, shocked, and optionally
+weight, insulin_infusion_rate and bicarbonate. Missing weights are derived from age and sex, missing insulin
+rates default to 0.05 Units/kg/hour. Rows which cannot be calculated have empty outputs: those with missing
+or unparseable dates or numbers, and, as the API refuses them, those with a measurement outside the range
+the API accepts or a birth date after the resuscitation date. As in the API, rows with an output above its safety
+limit error ceiling also have empty outputs; calculated_limit_level gives the level of every calculated
+row (0 within limits, 1 warning, 2 error).
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import math
+from pathlib import Path
+import sys
+
+from .guidelines import DEFAULT_GUIDELINE_VERSION, GUIDELINE_VERSIONS
+from .plan import BICARBONATE_RANGE, PH_RANGE, WEIGHT_RANGE
+
+OUTPUT_COLUMNS = (
+    "age",
+    "weight",
+    "deficit_percentage",
+    "deficit_volume",
+    "bolus_volume",
+    "deficit_volume_less_bolus_volume",
+    "daily_maintenance_volume",
+    "maintenance_rate",
+    "starting_fluid_rate",
+    "insulin_infusion_rate",
+)
+OUTPUT_PREFIX = "calculated_"
+LIMIT_LEVEL_COLUMN = OUTPUT_PREFIX + "limit_level"
+DEFAULT_INSULIN_INFUSION_RATE = 0.05
+# the insulin rates the API accepts, in Units/kg/hour
+MAXIMUM_INSULIN_INFUSION_RATE = 1
+
+def _file_format(path: str, file_format: str) -> str:
+    if file_format is not None:
+        return file_format
+    return "parquet" if Path(path).suffix.lower() in (".parquet", ".pq") else "csv"
+
+def _import_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet support requires pyarrow: pip install bsped-dka-calculator[parquet]")
+    return pyarrow, pyarrow.parquet
+
+# Reading
+def read_chunks(path: str, file_format: str, chunk_size: int):
+    """
+    Yields the input file as dictionaries of column lists, chunk_size rows at a time
+    """
+    if file_format == "parquet":
+        _, parquet = _import_parquet()
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pydict()
+        return
+
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        columns = {name: [] for name in reader.fieldnames}
+        rows = 0
+        for row in reader:
+            for name in columns:
+                columns[name].append(row[name])
+            rows += 1
+            if rows == chunk_size:
+                yield columns
+                columns = {name: [] for name in reader.fieldnames}
+                rows = 0
+        if rows:
+            yield columns
+
+# Calculation
+def _float_or_nan(value) -> float:
+    # unparseable values fail their row rather than the whole run
+    if value is None or value == "":
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def _missing(value) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+def _measurements(values, bounds: tuple) -> tuple:
+    """
+    Returns the values as a float array with NaN where they are missing, and a mask of the rows
+    whose value is given but unparseable or outside the bounds, the minimum included and the maximum not
+    """
+    import numpy as np
+
+    minimum, maximum = bounds
+    measurements = np.array([_float_or_nan(value) for value in values], dtype=np.float64)
+    given = np.array([not _missing(value) for value in values], dtype=bool)
+    with np.errstate(invalid="ignore"):
+        rejected = given & ~((measurements >= minimum) & (measurements < maximum))
+    return measurements, rejected
+
+def _insulin_infusion_rate(value) -> float:
+    if value is None or value == "":
+        return DEFAULT_INSULIN_INFUSION_RATE
+    rate = _float_or_nan(value)
+    if not 0 < rate <= MAXIMUM_INSULIN_INFUSION_RATE:
+        return math.nan
+    return rate
+
+def _boolean(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "t", "yes", "y", "1")
+    return bool(value)
+
+def calculate_chunk(columns: dict, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> dict:
+    """
+    Returns the chunk's input columns with the calculated columns appended
+    """
+    import numpy as np
+
+    from .limits import limit_level
+    from .vectorised import calculate
+
+    rows = len(columns["birth_date"])
+    # a missing weight or bicarbonate is left out, as in the API, but one outside the accepted range fails the row
+    pH, rejected = _measurements(columns["pH"], PH_RANGE)
+    weights, rejected_weights = _measurements(columns.get("weight", [None] * rows), WEIGHT_RANGE)
+    bicarbonate, rejected_bicarbonate = _measurements(columns.get("bicarbonate", [None] * rows), BICARBONATE_RANGE)
+    rejected |= rejected_weights | rejected_bicarbonate
+
+    with np.errstate(invalid="ignore"):
+        # dates are parsed row by row where needed, with missing and unparseable dates as NaT, see vectorised.to_dates
+        outputs = calculate(
+            birth_dates=columns["birth_date"],
+            observation_dates=columns["resuscitation_start_date_time"],
+            sexes=columns["sex"],
+            pH=pH,
+            shocked=[_boolean(value) for value in columns["shocked"]],
+            insulin_infusion_rates=[_insulin_infusion_rate(value) for value in columns.get("insulin_infusion_rate", [None] * rows)],
+            weights=weights,
+            guideline_version=guideline_version,
+            bicarbonate=bicarbonate
+        )
+
+    # rows which fail on any output fail on every output
+    failed = rejected | (outputs["age"] < 0)
+    for name in OUTPUT_COLUMNS:
+        failed |= np.isnan(outputs[name])
+    limit_levels = limit_level(outputs=outputs, guideline_version=guideline_version)
+    # rows the API would refuse have no outputs, but keep their limit level
+    refused = failed | (limit_levels == 2)
+
+    calculated = dict(columns)
+    for name in OUTPUT_COLUMNS:
+        calculated[OUTPUT_PREFIX + name] = [None if row_refused else value for value, row_refused in zip(outputs[name].tolist(), refused)]
+    calculated[LIMIT_LEVEL_COLUMN] = [None if row_failed else level for level, row_failed in zip(limit_levels.tolist(), failed)]
+    return calculated
+
+# Writing
+class ChunkWriter:
+    """
+    Writes calculated chunks to a CSV or Parquet file
+    """
+
+    def __init__(self, path: str, file_format: str):
+        self.path = path
+        self.file_format = file_format
+        self._file = None
+        self._writer = None
+
+    def write(self, columns: dict):
+        if self.file_format == "parquet":
+            pyarrow, parquet = _import_parquet()
+            table = pyarrow.Table.from_pydict(columns)
+            if self._writer is None:
+                self._writer = parquet.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+            return
+
+        if self._writer is None:
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(columns.keys())
+        self._writer.writerows(zip(*columns.values()))
+
+    def close(self):
+        if self.file_format == "parquet" and self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+def bulk(input_path: str, output_path: str, input_format: str = None, output_format: str = None, chunk_size: int = 100000, workers: int = 1, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> int:
+    """
+    Calculates every row of the input file and writes the results in the same order.
+    Returns the number of rows written.
+    With more than one worker, no more than two chunks per worker are held in flight.
+    """
+    chunks = read_chunks(
+        path=input_path,
+        file_format=_file_format(input_path, input_format),
+        chunk_size=chunk_size
+    )
+    writer = ChunkWriter(path=output_path, file_format=_file_format(output_path, output_format))
+    rows = 0
+    try:
+        if workers <= 1:
+            for chunk in chunks:
+                calculated = calculate_chunk(chunk, guideline_version)
+                writer.write(calculated)
+                rows += len(calculated["birth_date"])
+            return rows
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(calculate_chunk, chunk, guideline_version))
+                if len(in_flight) >= workers * 2:
+                    calculated = in_flight.popleft().result()
+                    writer.write(calculated)
+                    rows += len(calculated["birth_date"])
+            while in_flight:
+                calculated = in_flight.popleft().result()
+                writer.write(calculated)
+                rows += len(calculated["birth_date"])
+        return rows
+    finally:
+        writer.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="dka-calc", description="BSPED DKA calculator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bulk_parser = subparsers.add_parser("bulk", help="Calculate every presentation in a CSV or Parquet file")
+    bulk_parser.add_argument("input", help="CSV or Parquet file of presentations")
+    bulk_parser.add_argument("output", help="CSV or Parquet file to write the results to")
+    bulk_parser.add_argument("--input-format", choices=("csv", "parquet"), help="Defaults to the input file extension")
+    bulk_parser.add_argument("--output-format", choices=("csv", "parquet"), help="Defaults to the output file extension")
+    bulk_parser.add_argument("--chunk-size", type=int, default=100000, help="Rows calculated at a time (default 100000)")
+    bulk_parser.add_argument("--workers", type=int, default=1, help="Worker processes (default 1)")
+    bulk_parser.add_argument("--guideline-version", choices=GUIDELINE_VERSIONS, default=DEFAULT_GUIDELINE_VERSION, help=f"Guideline version (default {DEFAULT_GUIDELINE_VERSION})")
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "bulk":
+        rows = bulk(
+            input_path=arguments.input,
+            output_path=arguments.output,
+            input_format=arguments.input_format,
+            output_format=arguments.output_format,
+            chunk_size=arguments.chunk_size,
+            workers=arguments.workers,
+            guideline_version=arguments.guideline_version
+        )
+        print(f"Calculated {rows} rows into {arguments.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
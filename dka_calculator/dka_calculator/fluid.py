@@ -3,8 +3,11 @@ This file contains the functions for calculating:
 1. fluid deficit
 2. fluid maintenance
 3. fluid bolus
+The pH bands, weight caps and per-kg factors are those of the guideline version, see guidelines.py
 """
 
+from .guidelines import DEFAULT_GUIDELINE_VERSION, get_guideline
+
 # Boluses
 def crystalloid_bolus(
     weight: float, 
@@ -27,108 +30,73 @@ def crystalloid_bolus(
 
 # Maintenance
 def holliday_segar_volume(
-    weight: float
+    weight: float,
+    guideline_version: str = DEFAULT_GUIDELINE_VERSION
     ):
     """
-    This returns the maintenance rate for fluids based on weight.
-    It uses the Holliday-Segar equation and returns a rate in ml/hr
+    This returns the daily maintenance volume for fluids based on weight.
+    It uses the Holliday-Segar equation and returns a volume in ml
+    The weight is capped as the guideline specifies (75 kg in v1)
     """
 
-    if weight is None:
-        raise Exception("No weight supplied")
-
-    if weight > 75:
-        # note that the upper limit for this equation is 75 kg
-        weight = 75
-
-    if weight > 20:
-        return 1500 + ((weight-20) * 20)
-    elif weight > 10:
-        return 1000 + ((weight-10) * 50)
-    else:
-        return weight * 100
+    return get_guideline(guideline_version).maintenance_volume(weight)
 
 def holliday_segar_rate(
-    weight: float
+    weight: float,
+    guideline_version: str = DEFAULT_GUIDELINE_VERSION
     )-> float:
     """
     This returns the maintenance rate for fluids based on weight.
     It uses the Holliday-Segar equation and returns a rate in ml/hr
     """
     
-    total_volume = holliday_segar_volume(weight)
+    total_volume = holliday_segar_volume(weight, guideline_version=guideline_version)
     return total_volume/24
 
 def holliday_segar_advice(
-        weight: float
+        weight: float,
+        guideline_version: str = DEFAULT_GUIDELINE_VERSION
     ):
     """
     This returns values for the advice strings
     """
-    if weight is None:
-        raise Exception("No weight supplied")
-
-    formula = "[100mL/kg for 0-10kg] + [50mL/kg for 10-20kg] + [20mL/kg for >20kg]"
-
-    if weight > 75:
-        # note that the upper limit for this equation is 75 kg
-        weight = 75
-        advice = "Weight has been capped at 75kg."
-        formula = "Weight is capped at 75kg."
-    if weight > 20:
-        volume = 1500 + ((weight-20) * 20)
-        advice = f"(([{weight}kg] - 20kg) x 20mL) + 1500mL = {volume}mL"
-    elif weight > 10:
-        volume = 1000 + ((weight-10) * 50)
-        advice = f"(([{weight}kg] - 10kg) x 50mL) + 1000mL = {volume}mL"
-    else:
-        volume = weight * 100
-        advice = f"([{weight}kg] x 100mL) = {volume}mL"
-    return {
-        "volume": volume,
-        "advice": advice,
-        "formula": formula
-    }
+    return get_guideline(guideline_version).maintenance_advice(weight)
 
 # deficit
-def deficit_percentage(pH: float)->float:
+def dka_severity(pH: float, bicarbonate: float = None, guideline_version: str = DEFAULT_GUIDELINE_VERSION)->str:
     """
-    Return percentage deficit based on pH
+    Return the severity of the DKA: the severity of the pH, or of the bicarbonate
+    if it is supplied and more severe, from the bands of the guideline
     """
 
     if pH is None:
-        raise Exception("No volume/kg supplied")
-    if pH <= 6.5:
-        raise Exception(f"A pH of {pH} is very low. Please check accuracy.")
-    
-    if pH < 7.1:
-        percentage_deficit = 10
-    elif pH < 7.2:
-        percentage_deficit = 5
-    else:
-        percentage_deficit = 0
-    
-    return percentage_deficit
+        raise Exception("No pH supplied")
+
+    guideline = get_guideline(guideline_version)
+    return guideline.severity_names[guideline.severity(pH, bicarbonate)]
+
+def deficit_percentage(pH: float, bicarbonate: float = None, guideline_version: str = DEFAULT_GUIDELINE_VERSION)->float:
+    """
+    Return percentage deficit based on pH, or on bicarbonate if it is supplied and more severe,
+    from the bands of the guideline
+    """
 
-def pH_ranges(pH: float)->str:
-    if pH<=7.1:
-        return "less than 7.1"
-    elif pH <= 7.2:
-        return "7.1 to 7.2"
-    elif pH <=7.4:
-        return "7.2 to 7.4"
-    else:
-        return ">7.4"
+    if pH is None:
+        raise Exception("No pH supplied")
+
+    return get_guideline(guideline_version).deficit_percentage(pH, bicarbonate)
+
+def pH_ranges(pH: float, guideline_version: str = DEFAULT_GUIDELINE_VERSION)->str:
+    """
+    Return a description of the guideline pH band the pH is in
+    """
+    return get_guideline(guideline_version).pH_range(pH)
 
-def deficit_volume(percentage_deficit: float, weight: float):
+def deficit_volume(percentage_deficit: float, weight: float, guideline_version: str = DEFAULT_GUIDELINE_VERSION):
     """
     Return volume deficit based on and weight (kg)
     """
-    if weight is None or weight < 0:
-        raise Exception("No valid weight supplied")
-    if percentage_deficit is None or percentage_deficit < 0:
-        raise Exception("No valid percentage deficit value supplied")
-    return percentage_deficit * weight * 10
+    return get_guideline(guideline_version).deficit_volume(percentage_deficit=percentage_deficit, weight=weight)
 
 def forty_eight_hour_total_fluid_replacement(
     bolus_total: float,
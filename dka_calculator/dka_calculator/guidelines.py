@@ -0,0 +1,333 @@
+"""
+This file contains the guideline rule engine.
+Each guideline version is defined in data/guidelines/<version>.json: the severity levels and the
+deficit percentage of each, the pH and bicarbonate bands which grade severity, the weight caps for
+each stage of the calculation, the weights and insulin rate the safety limits are set at and the per-kg factors. The definitions are read once at import and
+compiled into sorted threshold tuples, so grading a value is a bisection over the thresholds, and the
+same thresholds grade whole arrays with numpy.searchsorted.
+The calculation functions take a guideline version, so the version can be chosen per request.
+"""
+
+from bisect import bisect_left, bisect_right
+import json
+from pathlib import Path
+
+GUIDELINES_DIRECTORY = Path(__file__).parent / "data" / "guidelines"
+DEFAULT_GUIDELINE_VERSION = "v1"
+WEIGHT_CAPPED_STAGES = ("deficit", "bolus", "maintenance", "insulin")
+
+class ImplausibleMeasurement(Exception):
+    """
+    Raised when a measurement is at or below the guideline's minimum for it, so is more likely an error than a reading
+    """
+
+class Bands:
+    """
+    The bands of one measurement, compiled from a guideline definition.
+    A value below thresholds[i], and not below any earlier threshold, is in band i.
+    A value at or above every threshold is in the last band.
+    """
+
+    __slots__ = ("measurement", "thresholds", "band_severities", "minimum")
+
+    def __init__(self, measurement: str, definition: dict, severity_names: tuple):
+        bands = definition["bands"]
+        thresholds = tuple(band["below"] for band in bands[:-1])
+        if not bands or "below" in bands[-1]:
+            raise Exception(f"The last {measurement} band must have no upper threshold.")
+        if any(lower >= upper for lower, upper in zip(thresholds, thresholds[1:])):
+            raise Exception(f"The {measurement} bands must be in ascending order of their thresholds.")
+        for band in bands:
+            if band["severity"] not in severity_names:
+                raise Exception(f"The {measurement} band severity {band['severity']} is not a severity of the guideline.")
+
+        self.measurement = measurement
+        self.thresholds = thresholds
+        # the rank of each band's severity, where higher ranks are more severe
+        self.band_severities = tuple(severity_names.index(band["severity"]) for band in bands)
+        self.minimum = definition.get("minimum")
+
+    def band(self, value: float) -> int:
+        """
+        Returns the index of the band the value is in
+        """
+        if value is None:
+            raise Exception(f"No {self.measurement} supplied")
+        if self.minimum is not None and value <= self.minimum:
+            raise ImplausibleMeasurement(f"A {self.measurement} of {value} is very low. Please check accuracy.")
+        return bisect_right(self.thresholds, value)
+
+    def severity(self, value: float) -> int:
+        """
+        Returns the severity rank of the value
+        """
+        return self.band_severities[self.band(value)]
+
+    def severities(self, values):
+        """
+        Returns the severity ranks of an array of values as a numpy array.
+        Missing values, and values at or below the minimum, return -1.
+        """
+        import numpy as np
+
+        values = np.asarray(values, dtype=np.float64)
+        ranks = np.asarray(self.band_severities, dtype=np.int64)[
+            np.searchsorted(np.asarray(self.thresholds, dtype=np.float64), values, side="right")
+        ]
+        valid = ~np.isnan(values)
+        if self.minimum is not None:
+            valid &= values > self.minimum
+        return np.where(valid, ranks, -1)
+
+    def label(self, band: int) -> str:
+        """
+        Returns a description of the range of values in a band
+        """
+        if band == 0:
+            return f"less than {self.thresholds[0]}"
+        if band == len(self.thresholds):
+            return f"{self.thresholds[-1]} and above"
+        return f"{self.thresholds[band - 1]} to {self.thresholds[band]}"
+
+class Guideline:
+    """
+    A guideline version compiled from its definition
+    """
+
+    __slots__ = (
+        "version",
+        "description",
+        "severity_names",
+        "deficit_percentages",
+        "pH",
+        "bicarbonate",
+        "weight_caps",
+        "limit_weights",
+        "maximum_insulin_per_kg",
+        "deficit_ml_per_kg_per_percent",
+        "bolus_ml_per_kg",
+        "maintenance_thresholds",
+        "maintenance_band_starts",
+        "maintenance_band_volumes",
+        "maintenance_ml_per_kg",
+    )
+
+    def __init__(self, definition: dict):
+        self.version = definition["version"]
+        self.description = definition.get("description", "")
+
+        # severities are listed from least to most severe, and referred to by their rank in this list
+        self.severity_names = tuple(severity["name"] for severity in definition["severities"])
+        self.deficit_percentages = tuple(severity["deficit_percentage"] for severity in definition["severities"])
+        self.pH = Bands("pH", definition["pH"], self.severity_names)
+        self.bicarbonate = Bands("bicarbonate", definition["bicarbonate"], self.severity_names)
+
+        self.weight_caps = {stage: definition["weight_caps"].get(stage) for stage in WEIGHT_CAPPED_STAGES}
+        # outputs above those for a patient of the warning weight are flagged, and above those
+        # for a patient of the error weight are refused, see limits.py
+        self.limit_weights = {level: definition["limits"][f"{level}_weight"] for level in ("warning", "error")}
+        # and insulin above the rate for those weights at this many Units/kg/hour
+        self.maximum_insulin_per_kg = definition["limits"]["maximum_insulin_units_per_kg_per_hour"]
+        self.deficit_ml_per_kg_per_percent = definition["deficit_ml_per_kg_per_percent"]
+        self.bolus_ml_per_kg = definition["bolus_ml_per_kg"]
+
+        # the maintenance bands are compiled into the weight each band starts at and the volume
+        # accumulated below it, so the daily volume is one bisection, one multiply and one add
+        maintenance_bands = definition["maintenance"]["bands"]
+        if not maintenance_bands or "up_to" in maintenance_bands[-1]:
+            raise Exception("The last maintenance band must have no upper weight.")
+        self.maintenance_thresholds = tuple(band["up_to"] for band in maintenance_bands[:-1])
+        if any(lower >= upper for lower, upper in zip(self.maintenance_thresholds, self.maintenance_thresholds[1:])):
+            raise Exception("The maintenance bands must be in ascending order of weight.")
+        self.maintenance_ml_per_kg = tuple(band["ml_per_kg"] for band in maintenance_bands)
+        self.maintenance_band_starts = (0,) + self.maintenance_thresholds
+        volumes = [0]
+        for start, end, ml_per_kg in zip(self.maintenance_band_starts, self.maintenance_thresholds, self.maintenance_ml_per_kg):
+            volumes.append(volumes[-1] + (end - start) * ml_per_kg)
+        self.maintenance_band_volumes = tuple(volumes)
+
+    def __repr__(self):
+        return f"Guideline(version={self.version!r})"
+
+    # Severity and deficit
+    def severity(self, pH: float, bicarbonate: float = None) -> int:
+        """
+        Returns the severity rank of the pH, or of the bicarbonate if it is supplied and more severe
+        """
+        rank = self.pH.severity(pH)
+        if bicarbonate is not None:
+            rank = max(rank, self.bicarbonate.severity(bicarbonate))
+        return rank
+
+    def severities(self, pH, bicarbonate=None):
+        """
+        Returns the combined severity ranks of arrays of pH and bicarbonate values as a numpy array.
+        Missing bicarbonate values are graded on pH alone. Missing pH values, and pH values
+        at or below the minimum, return -1.
+        """
+        import numpy as np
+
+        ranks = self.pH.severities(pH)
+        if bicarbonate is not None:
+            ranks = np.where(ranks >= 0, np.maximum(ranks, self.bicarbonate.severities(bicarbonate)), -1)
+        return ranks
+
+    def deficit_percentage(self, pH: float, bicarbonate: float = None):
+        """
+        Returns the percentage deficit for the combined severity of the pH and bicarbonate
+        """
+        return self.deficit_percentages[self.severity(pH, bicarbonate)]
+
+    def deficit_percentages_of(self, pH, bicarbonate=None):
+        """
+        Returns the percentage deficits for arrays of pH and bicarbonate values as a numpy array.
+        Missing pH values, and pH values at or below the minimum, return NaN.
+        """
+        import numpy as np
+
+        ranks = self.severities(pH, bicarbonate)
+        percentages = np.asarray(self.deficit_percentages, dtype=np.float64)[np.maximum(ranks, 0)]
+        return np.where(ranks >= 0, percentages, np.nan)
+
+    def pH_range(self, pH: float) -> str:
+        """
+        Returns a description of the band the pH is in
+        """
+        return self.pH.label(self.pH.band(pH))
+
+    def bicarbonate_range(self, bicarbonate: float) -> str:
+        """
+        Returns a description of the band the bicarbonate is in
+        """
+        return self.bicarbonate.label(self.bicarbonate.band(bicarbonate))
+
+    def deficit_percentage_formula(self, bicarbonate: bool = False) -> str:
+        """
+        Returns the pH bands and their deficit percentages, and the bicarbonate bands if bicarbonate was supplied
+        """
+        formula = "pH range " + self._bands_formula(self.pH)
+        if bicarbonate:
+            formula += ", or if more severe bicarbonate range " + self._bands_formula(self.bicarbonate)
+        return formula
+
+    def _bands_formula(self, bands: Bands) -> str:
+        return " or ".join(
+            f"[{bands.label(band)} = {self.deficit_percentages[severity]}%]"
+            for band, severity in enumerate(bands.band_severities)
+        )
+
+    def deficit_volume(self, percentage_deficit: float, weight: float):
+        """
+        Returns the deficit volume in mL for the percentage deficit and weight (kg)
+        """
+        if weight is None or weight < 0:
+            raise Exception("No valid weight supplied")
+        if percentage_deficit is None or percentage_deficit < 0:
+            raise Exception("No valid percentage deficit value supplied")
+        return percentage_deficit * self.cap_weight(weight, "deficit") * self.deficit_ml_per_kg_per_percent
+
+    # Weight caps
+    def cap_weight(self, weight: float, stage: str):
+        """
+        Returns the weight used for a stage of the calculation, which is capped if the guideline caps it
+        """
+        cap = self.weight_caps[stage]
+        if cap is not None and weight > cap:
+            return cap
+        return weight
+
+    def cap_weights(self, weights, stage: str):
+        import numpy as np
+
+        weights = np.asarray(weights, dtype=np.float64)
+        cap = self.weight_caps[stage]
+        if cap is None:
+            return weights
+        return np.minimum(weights, cap)
+
+    # Maintenance
+    def maintenance_volume(self, weight: float):
+        """
+        Returns the daily maintenance volume in mL for the weight (kg)
+        """
+        if weight is None:
+            raise Exception("No weight supplied")
+        weight = self.cap_weight(weight, "maintenance")
+        band = bisect_left(self.maintenance_thresholds, weight)
+        return self.maintenance_band_volumes[band] + ((weight - self.maintenance_band_starts[band]) * self.maintenance_ml_per_kg[band])
+
+    def maintenance_volumes(self, weights):
+        """
+        Returns the daily maintenance volumes in mL for an array of weights (kg) as a numpy array
+        """
+        import numpy as np
+
+        weights = self.cap_weights(weights, "maintenance")
+        bands = np.searchsorted(np.asarray(self.maintenance_thresholds, dtype=np.float64), weights, side="left")
+        starts = np.asarray(self.maintenance_band_starts, dtype=np.float64)[bands]
+        volumes = np.asarray(self.maintenance_band_volumes, dtype=np.float64)[bands]
+        ml_per_kg = np.asarray(self.maintenance_ml_per_kg, dtype=np.float64)[bands]
+        return volumes + ((weights - starts) * ml_per_kg)
+
+    def maintenance_advice(self, weight: float) -> dict:
+        """
+        Returns the daily maintenance volume with its working and formula strings
+        """
+        if weight is None:
+            raise Exception("No weight supplied")
+
+        formula = " + ".join(
+            f"[{ml_per_kg}mL/kg for {self._maintenance_band_range(band)}]"
+            for band, ml_per_kg in enumerate(self.maintenance_ml_per_kg)
+        )
+        cap = self.weight_caps["maintenance"]
+        if cap is not None and weight > cap:
+            weight = cap
+            formula = f"Weight is capped at {cap}kg."
+
+        volume = self.maintenance_volume(weight)
+        band = bisect_left(self.maintenance_thresholds, weight)
+        start = self.maintenance_band_starts[band]
+        ml_per_kg = self.maintenance_ml_per_kg[band]
+        if band == 0:
+            advice = f"([{weight}kg] x {ml_per_kg}mL) = {volume}mL"
+        else:
+            advice = f"(([{weight}kg] - {start}kg) x {ml_per_kg}mL) + {self.maintenance_band_volumes[band]}mL = {volume}mL"
+        return {
+            "volume": volume,
+            "advice": advice,
+            "formula": formula
+        }
+
+    def _maintenance_band_range(self, band: int) -> str:
+        if band == len(self.maintenance_thresholds):
+            return f">{self.maintenance_band_starts[band]}kg"
+        return f"{self.maintenance_band_starts[band]}-{self.maintenance_thresholds[band]}kg"
+
+def load_guidelines(directory: Path = GUIDELINES_DIRECTORY) -> dict:
+    """
+    Returns the compiled guidelines defined in the directory, by version
+    """
+    guidelines = {}
+    for path in sorted(directory.glob("*.json")):
+        guideline = Guideline(json.loads(path.read_text(encoding="utf-8")))
+        if guideline.version in guidelines:
+            raise Exception(f"Guideline version {guideline.version} is defined more than once.")
+        guidelines[guideline.version] = guideline
+    if DEFAULT_GUIDELINE_VERSION not in guidelines:
+        raise Exception(f"{directory} does not define the default guideline version {DEFAULT_GUIDELINE_VERSION}.")
+    return guidelines
+
+GUIDELINES = load_guidelines()
+GUIDELINE_VERSIONS = tuple(GUIDELINES)
+
+def get_guideline(version: str = None) -> Guideline:
+    """
+    Returns the compiled guideline for the version, or the default guideline if no version is given
+    """
+    if version is None:
+        version = DEFAULT_GUIDELINE_VERSION
+    try:
+        return GUIDELINES[version]
+    except KeyError:
+        raise Exception(f"Unknown guideline version {version}. Available versions are {', '.join(GUIDELINE_VERSIONS)}.")
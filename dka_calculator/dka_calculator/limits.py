@@ -0,0 +1,135 @@
+"""
+This file contains the safety limits engine.
+Each limited output has a warning ceiling and an error ceiling: the value the guideline calculates
+for a patient of its warning weight or error weight with the most severe DKA, given insulin at the
+guideline's maximum Units/kg/hour. The ceilings are precomputed once per guideline version at import,
+so checking a plan is a handful of comparisons, and the same ceilings check whole arrays of outputs
+as vectorised masks.
+"""
+
+from .guidelines import DEFAULT_GUIDELINE_VERSION, GUIDELINES, Guideline, get_guideline
+
+LIMITED_OUTPUTS = ("deficit_volume", "bolus_volume", "daily_maintenance_volume", "insulin_infusion_rate")
+# in order of severity, so that a level's number in the vectorised masks is its index + 1
+LEVELS = ("warning", "error")
+
+OUTPUT_DESCRIPTIONS = {
+    "deficit_volume": ("deficit volume", "mL"),
+    "bolus_volume": ("bolus volume", "mL"),
+    "daily_maintenance_volume": ("daily maintenance volume", "mL"),
+    "insulin_infusion_rate": ("insulin infusion rate", " Units/hour"),
+}
+
+class LimitExceeded(Exception):
+    """
+    Raised when a calculated output is above its error ceiling. The breaches are in .breaches
+    """
+
+    def __init__(self, breaches: list):
+        self.breaches = breaches
+        super().__init__(" ".join(breach["message"] for breach in breaches))
+
+    def __reduce__(self):
+        # rebuilt from the breaches, so that it can be raised across a process pool
+        return (LimitExceeded, (self.breaches,))
+
+class Ceilings:
+    """
+    The warning and error ceilings of one guideline version
+    """
+
+    __slots__ = ("guideline", "most_severe_deficit_percentage", "ceilings")
+
+    def __init__(self, guideline: Guideline):
+        self.guideline = guideline
+        self.most_severe_deficit_percentage = max(guideline.deficit_percentages)
+        # ceilings[output] is a (warning, error) tuple
+        self.ceilings = {
+            output: tuple(self._ceiling(output, guideline.limit_weights[level]) for level in LEVELS)
+            for output in LIMITED_OUTPUTS
+        }
+
+    def _ceiling(self, output: str, weight: float):
+        guideline = self.guideline
+        if output == "deficit_volume":
+            return guideline.deficit_volume(percentage_deficit=self.most_severe_deficit_percentage, weight=weight)
+        if output == "bolus_volume":
+            return guideline.cap_weight(weight, "bolus") * guideline.bolus_ml_per_kg
+        if output == "insulin_infusion_rate":
+            # the same for every rate requested, so that an excessive rate is caught
+            return guideline.cap_weight(weight, "insulin") * guideline.maximum_insulin_per_kg
+        return guideline.maintenance_volume(weight)
+
+    def output_ceilings(self, output: str) -> tuple:
+        """
+        Returns the (warning, error) ceilings of the output
+        """
+        return self.ceilings[output]
+
+    def limit_text(self, output: str) -> str:
+        """
+        Returns the warning ceiling of the output as text for the explained outputs
+        """
+        ceiling = self.ceilings[output][0]
+        if output == "deficit_volume":
+            return f"{ceiling}mL (for {self.most_severe_deficit_percentage}% deficit)"
+        if output == "bolus_volume":
+            return f"{ceiling}mL"
+        if output == "insulin_infusion_rate":
+            return f"{ceiling} Units/hour (for {self.guideline.maximum_insulin_per_kg} Units/kg/hour)"
+        return f"{ceiling}"
+
+CEILINGS = {version: Ceilings(guideline) for version, guideline in GUIDELINES.items()}
+
+def get_ceilings(guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> Ceilings:
+    # get_guideline raises for unknown versions
+    return CEILINGS[get_guideline(guideline_version).version]
+
+def check_limits(outputs: dict, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> list:
+    """
+    Compares the outputs with their ceilings and returns a breach for each output above its warning
+    ceiling, at the most severe level breached, in the order of LIMITED_OUTPUTS
+    """
+    ceilings = get_ceilings(guideline_version)
+    breaches = []
+    for output in LIMITED_OUTPUTS:
+        value = outputs[output]
+        output_ceilings = ceilings.output_ceilings(output)
+        if not value > output_ceilings[0]:
+            continue
+        level = 1 if value > output_ceilings[1] else 0
+        description, units = OUTPUT_DESCRIPTIONS[output]
+        breaches.append({
+            "output": output,
+            "level": LEVELS[level],
+            "value": float(value),
+            "ceiling": float(output_ceilings[level]),
+            "message": f"The {description} of {value}{units} is above the {LEVELS[level]} limit of {output_ceilings[level]}{units}."
+        })
+    return breaches
+
+def limit_levels(outputs: dict, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> dict:
+    """
+    Compares arrays of outputs with their ceilings and returns a mask for each limited output present:
+    0 within limits, 1 above the warning ceiling and 2 above the error ceiling.
+    """
+    import numpy as np
+
+    ceilings = get_ceilings(guideline_version)
+    masks = {}
+    for output in LIMITED_OUTPUTS:
+        if output not in outputs:
+            continue
+        values = np.asarray(outputs[output], dtype=np.float64)
+        warning, error = ceilings.output_ceilings(output)
+        masks[output] = (values > warning).astype(np.int8) + (values > error).astype(np.int8)
+    return masks
+
+def limit_level(outputs: dict, guideline_version: str = DEFAULT_GUIDELINE_VERSION):
+    """
+    Returns the most severe limit level of each element across all of the limited outputs present,
+    as a numpy array of 0 within limits, 1 warning and 2 error
+    """
+    import numpy as np
+
+    return np.maximum.reduce(list(limit_levels(outputs, guideline_version).values()))
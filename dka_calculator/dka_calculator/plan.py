@@ -0,0 +1,280 @@
+"""
+This file contains the calculation of a complete DKA management plan:
+1. age and weight
+2. fluid deficit and bolus
+3. fluid maintenance and starting rate
+4. insulin
+It depends only on the functions in this package, so the API, the command line interface,
+batch jobs and worker services can all run the same calculation in process.
+"""
+from datetime import date
+from time import perf_counter_ns
+from typing import Literal, Optional
+
+from .age_calculations import age_to_nearest_year
+from .fluid import crystalloid_bolus
+from .guidelines import DEFAULT_GUIDELINE_VERSION, get_guideline
+from .insulin import calculated_insulin_rate
+from .limits import check_limits, get_ceilings
+from .weight_calculations import derive_weight
+
+# the accepted ranges of the measurements, shared by the API's request schemas and the command line
+# interface: the minimum is included and the maximum is not
+WEIGHT_RANGE = (0.5, 220)
+PH_RANGE = (6.0, 8.0)
+BICARBONATE_RANGE = (0, 35)
+
+class DKAPlan:
+    """
+    The inputs and calculated values of a DKA management plan.
+    The working and formula strings are only built when explained_outputs() is called.
+    """
+
+    __slots__ = (
+        "guideline",
+        "age",
+        "weight",
+        "pH",
+        "bicarbonate",
+        "severity",
+        "shocked",
+        "insulin_per_kg",
+        "deficit_percentage",
+        "deficit_volume",
+        "bolus_volume",
+        "deficit_volume_less_bolus_volume",
+        "daily_maintenance_volume",
+        "maintenance_rate",
+        "deficit_replacement_rate",
+        "starting_fluid_rate",
+        "insulin_infusion_rate",
+    )
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values[name])
+
+    def __repr__(self):
+        return f"DKAPlan({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    def values(self) -> dict:
+        """
+        Returns the inputs and calculated values as plain data, with the guideline as its version,
+        from which from_values() rebuilds the plan without recalculating it
+        """
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values["guideline"] = self.guideline.version
+        return values
+
+    @classmethod
+    def from_values(cls, values: dict) -> "DKAPlan":
+        """
+        Returns the plan whose values() these are
+        """
+        return cls(**dict(values, guideline=get_guideline(values["guideline"])))
+
+    def outputs(self) -> dict:
+        """
+        Returns the calculated values only, as floats
+        """
+        return {
+            "deficit_percentage": float(self.deficit_percentage),
+            "deficit_volume": float(self.deficit_volume),
+            "bolus_volume": float(self.bolus_volume),
+            "deficit_volume_less_bolus_volume": float(self.deficit_volume_less_bolus_volume),
+            "daily_maintenance_volume": float(self.daily_maintenance_volume),
+            "maintenance_rate": float(self.maintenance_rate),
+            "starting_fluid_rate": float(self.starting_fluid_rate),
+            "insulin_infusion_rate": float(self.insulin_infusion_rate)
+        }
+
+    def limit_breaches(self) -> list:
+        """
+        Returns the outputs which are above their warning or error ceilings, see limits.py
+        """
+        return check_limits(outputs=self.outputs(), guideline_version=self.guideline.version)
+
+    def explained_outputs(self) -> dict:
+        """
+        Returns the calculated values, as floats, with their working and formulae
+        """
+        if self.shocked:
+            deficit_volume_less_bolus_volume_working = f"[{self.deficit_volume}ml]-[{self.bolus_volume}ml] = {self.deficit_volume_less_bolus_volume}ml"
+        else:
+            deficit_volume_less_bolus_volume_working = "No subtraction has been made for fluid boluses as the child or young person has not been reported as shocked."
+
+        guideline = self.guideline
+        ceilings = get_ceilings(guideline.version)
+        maintenance_strings = guideline.maintenance_advice(weight=self.weight)
+        deficit_weight = guideline.cap_weight(self.weight, "deficit")
+        bolus_weight = guideline.cap_weight(self.weight, "bolus")
+
+        if self.bicarbonate is None:
+            deficit_percentage_working = f"[pH {self.pH}] is in range {guideline.pH_range(self.pH)} ==> {self.deficit_percentage}%"
+        else:
+            deficit_percentage_working = (
+                f"[pH {self.pH}] is in range {guideline.pH_range(self.pH)} and "
+                f"[bicarbonate {self.bicarbonate}mmol/L] is in range {guideline.bicarbonate_range(self.bicarbonate)}, "
+                f"the more severe is {self.severity} ==> {self.deficit_percentage}%"
+            )
+
+        return {
+            "deficit_percentage":{
+                "deficit_percentage_output": float(self.deficit_percentage),
+                "deficit_percentage_working": deficit_percentage_working,
+                "deficit_percentage_formula": guideline.deficit_percentage_formula(bicarbonate=self.bicarbonate is not None)
+            },
+            "deficit_volume":{
+                "deficit_volume_output": float(self.deficit_volume),
+                "deficit_volume_working": f"[{self.deficit_percentage}%] x [{deficit_weight}kg] x {guideline.deficit_ml_per_kg_per_percent} = {self.deficit_volume}mL",
+                "deficit_volume_formula": f"[Deficit percentage] x [Patient weight (kg)] x {guideline.deficit_ml_per_kg_per_percent}",
+                "deficit_volume_limit": ceilings.limit_text("deficit_volume")
+            },
+            "bolus_volume":{
+                "bolus_volume_output": float(self.bolus_volume),
+                "bolus_volume_working": f"[{guideline.bolus_ml_per_kg}mL/kg] x [{bolus_weight}kg] = {self.bolus_volume}mL",
+                "bolus_volume_formula": f"[{guideline.bolus_ml_per_kg}mL/kg] x [Patient weight (kg)]",
+                "bolus_volume_limit": ceilings.limit_text("bolus_volume")
+            },
+            "deficit_volume_less_bolus_volume":{
+                "deficit_volume_less_bolus_volume_output": float(self.deficit_volume_less_bolus_volume),
+                "deficit_volume_less_bolus_volume_working": deficit_volume_less_bolus_volume_working,
+                "deficit_volume_less_bolus_volume_formula": f"[Deficit volume] - [{guideline.bolus_ml_per_kg}mL/kg bolus (only for non-shocked patients)]"
+            },
+            "daily_maintenance_volume":{
+                "daily_maintenance_volume_output": float(self.daily_maintenance_volume),
+                "daily_maintenance_volume_working": maintenance_strings["advice"],
+                "daily_maintenance_volume_formula": maintenance_strings["formula"],
+                "daily_maintenance_volume_limit": ceilings.limit_text("daily_maintenance_volume")
+            },
+            "maintenance_rate":{
+                "maintenance_rate_output": float(self.maintenance_rate),
+                "maintenance_rate_working": "[Daily maintenance volume] ÷ [24 hours]",
+                "maintenance_rate_formula": f"[{self.daily_maintenance_volume}mL] ÷ [24 hours] = {self.maintenance_rate}mL/hour"
+            },
+            "starting_fluid_rate":{
+                "starting_fluid_rate_output": float(self.starting_fluid_rate),
+                "starting_fluid_rate_working": f"[{self.deficit_replacement_rate}mL/hour] + [{self.maintenance_rate}mL/hour] = 112.9mL/hour",
+                "starting_fluid_rate_formula": "[Deficit replacement rate] + [Maintenance rate]"
+            },
+            "insulin_infusion_rate":{
+                "insulin_infusion_rate_output": float(self.insulin_infusion_rate),
+                "insulin_infusion_rate_working": f"{self.insulin_infusion_rate} Units/hour (for {self.insulin_per_kg} Units/kg/hour)",
+                "insulin_infusion_rate_formula": "[Insulin rate (Units/kg/hour)] x [Patient weight]",
+                "insulin_infusion_rate_limit": ceilings.limit_text("insulin_infusion_rate")
+            }
+        }
+
+def calculate_plan(
+    birth_date: date,
+    observation_date: date,
+    sex: Literal['male', 'female'],
+    pH: float,
+    shocked: bool = False,
+    insulin_infusion_rate: float = 0.05,
+    weight: Optional[float] = None,
+    stage_timings: Optional[dict] = None,
+    guideline_version: str = DEFAULT_GUIDELINE_VERSION,
+    bicarbonate: Optional[float] = None
+) -> DKAPlan:
+    """
+    Returns the DKA management plan for a single presentation.
+    The severity bands, weight caps and per-kg factors are those of the guideline version.
+    The deficit is graded on the pH, or on the bicarbonate if it is provided and more severe.
+    If the weight is not provided, one is derived from the age and the sex.
+    If a stage_timings dictionary is passed, the nanoseconds spent in each stage
+    (age, weight, deficit, bolus, maintenance and insulin) are recorded in it.
+    """
+    guideline = get_guideline(guideline_version)
+    timed = stage_timings is not None
+    if timed:
+        started = perf_counter_ns()
+
+    # calculate the age
+    try:
+        age = age_to_nearest_year(
+            birth_date=birth_date,
+            observation_date=observation_date
+        )
+    except Exception:
+        raise Exception('Unable to calculate age from dates provided')
+    if timed:
+        started = _record_stage(stage_timings, "age", started)
+
+    # if the weight is not provided, calculate one from the age and the sex
+    if weight is None:
+        if sex is None:
+            raise Exception("Weight cannot be derived without knowing the sex of the child or young person.")
+        weight = derive_weight(
+            age=age,
+            sex=sex
+        )
+    if timed:
+        started = _record_stage(stage_timings, "weight", started)
+
+    # derive the deficit based on the more severe of the pH and bicarbonate, and the deficit volume from the percentage deficit
+    severity = guideline.severity(pH=pH, bicarbonate=bicarbonate)
+    child_deficit_percentage = guideline.deficit_percentages[severity]
+    child_deficit_volume = guideline.deficit_volume(
+        percentage_deficit=child_deficit_percentage,
+        weight=weight
+    )
+    if timed:
+        started = _record_stage(stage_timings, "deficit", started)
+
+    # calculate the bolus sizes based on weight
+    child_bolus_volume = crystalloid_bolus(
+        weight=guideline.cap_weight(weight, "bolus"),
+        volume_per_kilogram=guideline.bolus_ml_per_kg
+    )
+
+    # subtract the bolus from the total deficit if shocked, and replace the deficit over 48 hours
+    if shocked:
+        child_deficit_volume_less_bolus_volume = child_deficit_volume - child_bolus_volume
+        deficit_replacement_rate = child_deficit_volume_less_bolus_volume / 48
+    else:
+        child_deficit_volume_less_bolus_volume = 0
+        deficit_replacement_rate = child_deficit_volume / 48
+    if timed:
+        started = _record_stage(stage_timings, "bolus", started)
+
+    # calculate the maintenance fluid volume and hourly rate
+    daily_maintenance_volume = guideline.maintenance_volume(weight=weight)
+    child_maintenance_rate = daily_maintenance_volume / 24
+    if timed:
+        started = _record_stage(stage_timings, "maintenance", started)
+
+    insulin_infusion_rate_output = calculated_insulin_rate(
+        weight=guideline.cap_weight(weight, "insulin"),
+        insulin_per_kg=insulin_infusion_rate
+    )
+    if timed:
+        _record_stage(stage_timings, "insulin", started)
+
+    return DKAPlan(
+        guideline=guideline,
+        age=age,
+        weight=weight,
+        pH=pH,
+        bicarbonate=bicarbonate,
+        severity=guideline.severity_names[severity],
+        shocked=shocked,
+        insulin_per_kg=insulin_infusion_rate,
+        deficit_percentage=child_deficit_percentage,
+        deficit_volume=child_deficit_volume,
+        bolus_volume=child_bolus_volume,
+        deficit_volume_less_bolus_volume=child_deficit_volume_less_bolus_volume,
+        daily_maintenance_volume=daily_maintenance_volume,
+        maintenance_rate=child_maintenance_rate,
+        deficit_replacement_rate=deficit_replacement_rate,
+        starting_fluid_rate=deficit_replacement_rate + child_maintenance_rate,
+        insulin_infusion_rate=insulin_infusion_rate_output
+    )
+
+def _record_stage(stage_timings: dict, stage: str, started: int) -> int:
+    """
+    Records the time since started against the stage and returns the time now
+    """
+    now = perf_counter_ns()
+    stage_timings[stage] = now - started
+    return now
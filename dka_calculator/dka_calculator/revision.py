@@ -0,0 +1,124 @@
+"""
+This file contains the revision of a DKA management plan when observations are updated during treatment.
+Each stage of the plan lists the inputs and earlier stages it depends on, so a revision only
+recalculates the stages downstream of the inputs which changed: a new pH regrades the severity and
+the deficit, a corrected weight recalculates every volume and rate. The age, and the dates it is
+calculated from, are never revisited.
+"""
+from functools import lru_cache
+from operator import attrgetter
+from typing import Optional
+
+from .fluid import crystalloid_bolus
+from .insulin import calculated_insulin_rate
+from .plan import DKAPlan
+
+# the inputs which can be revised, with the plan attribute each is held in
+REVISABLE_INPUTS = {
+    "weight": "weight",
+    "pH": "pH",
+    "bicarbonate": "bicarbonate",
+    "shocked": "shocked",
+    "insulin_infusion_rate": "insulin_per_kg",
+}
+
+# the inputs and stages each stage depends on, in the order the stages are calculated
+STAGE_DEPENDENCIES = {
+    "severity": ("pH", "bicarbonate"),
+    "deficit": ("severity", "weight"),
+    "bolus": ("weight",),
+    "maintenance": ("weight",),
+    "fluid_rates": ("deficit", "bolus", "maintenance", "shocked"),
+    "insulin": ("weight", "insulin_infusion_rate"),
+}
+
+_plan_values = attrgetter(*DKAPlan.__slots__)
+
+def dependent_stages(changed_inputs) -> tuple:
+    """
+    Returns the stages which must be recalculated when these inputs change, in calculation order
+    """
+    return _dependent_stages(frozenset(changed_inputs))
+
+@lru_cache(maxsize=None)
+def _dependent_stages(changed_inputs: frozenset) -> tuple:
+    # there are only 2^5 sets of revisable inputs, so each is worked out once
+    changed = set(changed_inputs)
+    stages = []
+    for stage, dependencies in STAGE_DEPENDENCIES.items():
+        if changed.intersection(dependencies):
+            changed.add(stage)
+            stages.append(stage)
+    return tuple(stages)
+
+def revise_plan(plan: DKAPlan, recalculated_stages: Optional[list] = None, **changes) -> DKAPlan:
+    """
+    Returns a new plan with the changed inputs, recalculating only the stages which depend on them.
+    The inputs which can be changed are those in REVISABLE_INPUTS; changing the dates, sex or guideline
+    version needs a new plan from calculate_plan. Inputs given their current value are not changes.
+    If a recalculated_stages list is passed, the stages recalculated are appended to it.
+    """
+    unknown = set(changes).difference(REVISABLE_INPUTS)
+    if unknown:
+        raise Exception(f"{', '.join(sorted(unknown))} cannot be revised; calculate a new plan instead.")
+    if changes.get("weight", plan.weight) is None:
+        raise Exception("The weight cannot be removed from a plan; calculate a new plan instead.")
+
+    revised = DKAPlan.__new__(DKAPlan)
+    for name, value in zip(DKAPlan.__slots__, _plan_values(plan)):
+        setattr(revised, name, value)
+    changed_inputs = []
+    for name, value in changes.items():
+        attribute = REVISABLE_INPUTS[name]
+        if value != getattr(plan, attribute):
+            setattr(revised, attribute, value)
+            changed_inputs.append(name)
+
+    guideline = plan.guideline
+    for stage in dependent_stages(changed_inputs):
+        if stage == "severity":
+            severity = guideline.severity(pH=revised.pH, bicarbonate=revised.bicarbonate)
+            revised.severity = guideline.severity_names[severity]
+            revised.deficit_percentage = guideline.deficit_percentages[severity]
+        elif stage == "deficit":
+            revised.deficit_volume = guideline.deficit_volume(
+                percentage_deficit=revised.deficit_percentage,
+                weight=revised.weight
+            )
+        elif stage == "bolus":
+            revised.bolus_volume = crystalloid_bolus(
+                weight=guideline.cap_weight(revised.weight, "bolus"),
+                volume_per_kilogram=guideline.bolus_ml_per_kg
+            )
+        elif stage == "maintenance":
+            revised.daily_maintenance_volume = guideline.maintenance_volume(weight=revised.weight)
+            revised.maintenance_rate = revised.daily_maintenance_volume / 24
+        elif stage == "fluid_rates":
+            # as in calculate_plan, the bolus is only subtracted from the deficit if shocked
+            if revised.shocked:
+                revised.deficit_volume_less_bolus_volume = revised.deficit_volume - revised.bolus_volume
+                revised.deficit_replacement_rate = revised.deficit_volume_less_bolus_volume / 48
+            else:
+                revised.deficit_volume_less_bolus_volume = 0
+                revised.deficit_replacement_rate = revised.deficit_volume / 48
+            revised.starting_fluid_rate = revised.deficit_replacement_rate + revised.maintenance_rate
+        elif stage == "insulin":
+            revised.insulin_infusion_rate = calculated_insulin_rate(
+                weight=guideline.cap_weight(revised.weight, "insulin"),
+                insulin_per_kg=revised.insulin_per_kg
+            )
+        if recalculated_stages is not None:
+            recalculated_stages.append(stage)
+
+    return revised
+
+def plan_diff(previous: DKAPlan, revised: DKAPlan) -> dict:
+    """
+    Returns the calculated values which differ between two plans, as {output: {"previous", "revised"}}
+    """
+    previous_outputs = previous.outputs()
+    diff = {}
+    for output, value in revised.outputs().items():
+        if value != previous_outputs[output]:
+            diff[output] = {"previous": previous_outputs[output], "revised": value}
+    return diff
@@ -0,0 +1,42 @@
+"""
+This file contains the hour by hour infusion schedule of a DKA management plan.
+The deficit is replaced evenly over 48 hours alongside maintenance fluid, and insulin runs at
+a fixed rate, so the values for any hour can be calculated directly from the plan without
+calculating the hours before it. The schedule is a generator over a window of hours, so
+callers asking for upcoming hours only pay for the hours they ask for.
+"""
+from typing import Iterator
+
+from .plan import DKAPlan
+
+SCHEDULE_HOURS = 48
+
+def hourly_schedule(plan: DKAPlan, start_hour: int = 0, end_hour: int = SCHEDULE_HOURS) -> Iterator[dict]:
+    """
+    Yields the infusion for each hour from start_hour up to, but not including, end_hour,
+    where hour 0 is the first hour of treatment. The cumulative volumes and the deficit
+    remaining are those at the end of the hour.
+    Hours outside the 48 hour schedule are not yielded.
+    """
+    start_hour = max(start_hour, 0)
+    end_hour = min(end_hour, SCHEDULE_HOURS)
+
+    fluid_rate = float(plan.starting_fluid_rate)
+    maintenance_rate = float(plan.maintenance_rate)
+    deficit_replacement_rate = float(plan.deficit_replacement_rate)
+    insulin_infusion_rate = float(plan.insulin_infusion_rate)
+
+    for hour in range(start_hour, end_hour):
+        hours_given = hour + 1
+        yield {
+            "hour": hour,
+            "fluid_rate": fluid_rate,
+            "maintenance_rate": maintenance_rate,
+            "deficit_replacement_rate": deficit_replacement_rate,
+            "cumulative_fluid_volume": fluid_rate * hours_given,
+            "cumulative_maintenance_volume": maintenance_rate * hours_given,
+            # calculated from the hours left, so that it is exactly 0 at the end of the schedule
+            "deficit_remaining": deficit_replacement_rate * (SCHEDULE_HOURS - hours_given),
+            "insulin_infusion_rate": insulin_infusion_rate,
+            "cumulative_insulin": insulin_infusion_rate * hours_given,
+        }
@@ -0,0 +1,50 @@
+"""
+Checks that the bulk command line interface refuses the rows the API would refuse.
+"""
+
+import pytest
+
+from ..cli import LIMIT_LEVEL_COLUMN, OUTPUT_PREFIX, calculate_chunk
+
+PRESENTATION = {
+    "birth_date": "2015-04-12",
+    "resuscitation_start_date_time": "2022-02-06",
+    "sex": "female",
+    "pH": "6.86",
+    "shocked": "true",
+    "weight": "23",
+    "insulin_infusion_rate": "0.05",
+    "bicarbonate": "",
+}
+
+def calculate_rows(*changes) -> list:
+    rows = [dict(PRESENTATION, **change) for change in changes]
+    calculated = calculate_chunk({name: [row[name] for row in rows] for name in PRESENTATION})
+    return [{name: values[index] for name, values in calculated.items()} for index in range(len(rows))]
+
+def test_valid_rows_are_calculated():
+    calculated, derived = calculate_rows({}, {"weight": ""})
+    assert calculated[OUTPUT_PREFIX + "weight"] == 23
+    assert calculated[OUTPUT_PREFIX + "deficit_percentage"] == 10
+    assert calculated[LIMIT_LEVEL_COLUMN] == 0
+    assert derived[OUTPUT_PREFIX + "weight"] == 22
+
+@pytest.mark.parametrize("change", [
+    {"pH": "9.5"},
+    {"pH": "5.9"},
+    {"weight": "0.01"},
+    {"weight": "220"},
+    {"weight": "heavy"},
+    {"bicarbonate": "35"},
+    {"bicarbonate": "-1"},
+    {"insulin_infusion_rate": "0"},
+    {"insulin_infusion_rate": "1.5"},
+    {"birth_date": "2023-01-01"},
+    {"birth_date": "12/04/2015"},
+    {"birth_date": ""},
+])
+def test_rows_the_api_refuses_have_no_outputs(change):
+    valid, refused = calculate_rows({}, change)
+    assert valid[OUTPUT_PREFIX + "starting_fluid_rate"] is not None
+    assert all(refused[OUTPUT_PREFIX + name] is None for name in ("age", "weight", "deficit_volume", "insulin_infusion_rate"))
+    assert refused[LIMIT_LEVEL_COLUMN] is None
@@ -0,0 +1,80 @@
+"""
+Checks the safety limits engine: the ceilings of each guideline version, the warning and error
+levels, and that the insulin ceiling does not move with the rate requested.
+"""
+
+from datetime import date
+
+import numpy as np
+import pytest
+
+from ..guidelines import GUIDELINE_VERSIONS
+from ..limits import CEILINGS, LIMITED_OUTPUTS, check_limits, get_ceilings, limit_level, limit_levels
+from ..plan import calculate_plan
+
+PRESENTATION = {
+    "birth_date": date(2015, 4, 12),
+    "observation_date": date(2022, 2, 6),
+    "sex": "female",
+    "pH": 6.86,
+    "shocked": True,
+    "weight": 23,
+}
+
+def plan_for(**changes):
+    return calculate_plan(**dict(PRESENTATION, **changes))
+
+def test_v1_ceilings():
+    # the values for a 75kg warning weight and a 150kg error weight with a 10% deficit, at 0.1 Units/kg/hour
+    assert get_ceilings("v1").ceilings == {
+        "deficit_volume": (7500, 15000),
+        "bolus_volume": (750, 1500),
+        "daily_maintenance_volume": (2600, 2600),
+        "insulin_infusion_rate": (7.5, 15.0),
+    }
+
+@pytest.mark.parametrize("guideline_version", GUIDELINE_VERSIONS)
+def test_every_guideline_has_ordered_ceilings(guideline_version):
+    ceilings = CEILINGS[guideline_version]
+    for output in LIMITED_OUTPUTS:
+        warning, error = ceilings.output_ceilings(output)
+        assert 0 < warning <= error
+
+def test_unknown_guideline_version_raises():
+    with pytest.raises(Exception, match="Unknown guideline version"):
+        get_ceilings("v0")
+
+@pytest.mark.parametrize("insulin_infusion_rate, level", [(0.05, None), (0.1, None), (0.5, "warning"), (1, "error")])
+def test_insulin_ceiling_does_not_move_with_the_requested_rate(insulin_infusion_rate, level):
+    # 23kg at 1 Unit/kg/hour is 23 Units/hour, above the 15 Units/hour error ceiling
+    breaches = plan_for(insulin_infusion_rate=insulin_infusion_rate).limit_breaches()
+    assert [breach["level"] for breach in breaches] == ([] if level is None else [level])
+    if level is not None:
+        assert breaches[0]["output"] == "insulin_infusion_rate"
+
+def test_breaches_are_at_the_most_severe_level():
+    outputs = dict(plan_for().outputs(), deficit_volume=8000, bolus_volume=1600)
+    breaches = check_limits(outputs, "v1")
+    assert [(breach["output"], breach["level"], breach["ceiling"]) for breach in breaches] == [
+        ("deficit_volume", "warning", 7500),
+        ("bolus_volume", "error", 1500),
+    ]
+    assert breaches[1]["message"] == "The bolus volume of 1600mL is above the error limit of 1500mL."
+
+def test_values_at_a_ceiling_are_within_it():
+    outputs = dict(plan_for().outputs(), deficit_volume=7500, insulin_infusion_rate=15)
+    assert [breach["level"] for breach in check_limits(outputs, "v1")] == ["warning"]
+
+@pytest.mark.parametrize("guideline_version", GUIDELINE_VERSIONS)
+def test_vectorised_levels_match_check_limits(guideline_version):
+    ceilings = CEILINGS[guideline_version]
+    # values just below, at and above each ceiling
+    values = sorted({value + offset for output in LIMITED_OUTPUTS for value in ceilings.output_ceilings(output) for offset in (-1, 0, 1)})
+    outputs = {output: np.array(values) for output in LIMITED_OUTPUTS}
+    levels = limit_levels(outputs, guideline_version)
+    for index, value in enumerate(values):
+        for output in LIMITED_OUTPUTS:
+            breaches = check_limits(dict.fromkeys(LIMITED_OUTPUTS, 0) | {output: value}, guideline_version)
+            expected = {None: 0, "warning": 1, "error": 2}[breaches[0]["level"] if breaches else None]
+            assert levels[output][index] == expected, f"{output} of {value}"
+    assert limit_level(outputs, guideline_version).tolist() == np.maximum.reduce(list(levels.values())).tolist()
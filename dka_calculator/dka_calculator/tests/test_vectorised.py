@@ -0,0 +1,94 @@
+"""
+Checks that the vectorised engine produces the same numbers as the scalar calculation, and NaN
+wherever the scalar calculation raises, on random presentations.
+"""
+
+import datetime
+import math
+
+import numpy as np
+import pytest
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from ..guidelines import GUIDELINE_VERSIONS
+from ..plan import calculate_plan
+from ..vectorised import age_to_nearest_year, calculate
+
+CALCULATED = ("age", "weight", "deficit_percentage", "deficit_volume", "bolus_volume",
+    "deficit_volume_less_bolus_volume", "daily_maintenance_volume", "maintenance_rate",
+    "starting_fluid_rate", "insulin_infusion_rate")
+
+# wide enough to give negative ages and ages past the end of the reference weight table
+dates = st.dates(min_value=datetime.date(1990, 1, 1), max_value=datetime.date(2030, 12, 31))
+
+# the band thresholds and minimums are drawn often, since that is where the two engines could disagree
+pH_values = st.one_of(st.floats(min_value=6.0, max_value=7.99), st.sampled_from((6.2, 6.5, 7.1, 7.2)))
+bicarbonate_values = st.one_of(st.none(), st.floats(min_value=0, max_value=34.9), st.sampled_from((5.0, 10.0)))
+
+presentations = st.fixed_dictionaries({
+    "birth_date": dates,
+    "observation_date": dates,
+    "sex": st.sampled_from(("male", "female")),
+    "weight": st.one_of(st.none(), st.floats(min_value=0.5, max_value=219.9)),
+    "pH": pH_values,
+    "bicarbonate": bicarbonate_values,
+    "shocked": st.booleans(),
+    "insulin_infusion_rate": st.floats(min_value=0.01, max_value=0.2),
+})
+
+def scalar_outputs(presentation: dict, guideline_version: str):
+    """
+    Returns the scalar calculation's values for the presentation, or None if it raises
+    """
+    try:
+        plan = calculate_plan(guideline_version=guideline_version, **presentation)
+    except Exception:
+        return None
+    return dict(plan.outputs(), age=plan.age, weight=plan.weight)
+
+def nan_if_none(value) -> float:
+    return math.nan if value is None else value
+
+@settings(max_examples=200, deadline=None)
+@given(st.lists(presentations, min_size=1, max_size=20), st.sampled_from(GUIDELINE_VERSIONS))
+def test_vectorised_matches_scalar(cohort, guideline_version):
+    outputs = calculate(
+        birth_dates=[presentation["birth_date"] for presentation in cohort],
+        observation_dates=[presentation["observation_date"] for presentation in cohort],
+        sexes=[presentation["sex"] for presentation in cohort],
+        pH=[presentation["pH"] for presentation in cohort],
+        shocked=[presentation["shocked"] for presentation in cohort],
+        insulin_infusion_rates=[presentation["insulin_infusion_rate"] for presentation in cohort],
+        weights=[nan_if_none(presentation["weight"]) for presentation in cohort],
+        guideline_version=guideline_version,
+        bicarbonate=[nan_if_none(presentation["bicarbonate"]) for presentation in cohort]
+    )
+
+    for index, presentation in enumerate(cohort):
+        expected = scalar_outputs(presentation, guideline_version)
+        row = {name: outputs[name][index] for name in CALCULATED}
+        if expected is None:
+            assert any(np.isnan(value) for value in row.values()), f"{presentation} raises in the scalar calculation but not in the vectorised one"
+        else:
+            for name in CALCULATED:
+                assert row[name] == pytest.approx(expected[name], rel=1e-12, abs=1e-9), f"{name} of {presentation}"
+
+@given(dates, dates)
+def test_age_matches_scalar(birth_date, observation_date):
+    from ..age_calculations import age_to_nearest_year as scalar_age_to_nearest_year
+
+    assert age_to_nearest_year([birth_date], [observation_date])[0] == scalar_age_to_nearest_year(birth_date, observation_date)
+
+@pytest.mark.parametrize("birth_date", [None, "", "12/04/2015", "not a date"])
+def test_unusable_dates_give_nan(birth_date):
+    outputs = calculate(
+        birth_dates=[birth_date, "2015-04-12"],
+        observation_dates=["2022-02-06", "2022-02-06"],
+        sexes=["female", "female"],
+        pH=[6.86, 6.86],
+        shocked=[True, True],
+        insulin_infusion_rates=[0.05, 0.05]
+    )
+    assert np.isnan(outputs["age"][0]) and np.isnan(outputs["weight"][0])
+    assert outputs["age"][1] == 7 and outputs["weight"][1] == 22
@@ -0,0 +1,235 @@
+"""
+This file contains whole-array versions of the calculations for:
+1. age
+2. weight
+3. fluid deficit, bolus and maintenance
+4. insulin
+It is intended for cohort and batch work, where the scalar functions would otherwise be called
+once per presentation. Every function accepts array-likes, returns numpy arrays and produces
+the same numbers as its scalar counterpart in age_calculations.py, weight_calculations.py,
+fluid.py and insulin.py.
+Where a scalar function would raise, the vectorised function returns NaN for that element
+so that one bad presentation does not fail the whole array.
+The pH bands, weight caps and per-kg factors are those of the guideline version, see guidelines.py
+"""
+
+import numpy as np
+
+from .guidelines import DEFAULT_GUIDELINE_VERSION, get_guideline
+from .weight_calculations import derive_weights
+
+# Age
+def to_dates(values) -> np.ndarray:
+    """
+    Returns an array of dates as numpy datetime64 days.
+    Dates can be supplied as date objects, ISO strings or numpy datetime64 values. Missing dates,
+    and any which cannot be parsed, are NaT rather than failing the whole array.
+    """
+    try:
+        return np.asarray(values, dtype="datetime64[D]")
+    except (TypeError, ValueError):
+        pass
+    # something in the array cannot be parsed, so it is converted one date at a time
+    dates = np.empty(len(values), dtype="datetime64[D]")
+    for index, value in enumerate(values):
+        try:
+            dates[index] = np.datetime64(value, "D")
+        except (TypeError, ValueError):
+            dates[index] = np.datetime64("NaT")
+    return dates
+
+def age_to_nearest_year(birth_dates, observation_dates) -> np.ndarray:
+    """
+    Calculates ages rounded to the nearest year from arrays of dates, see to_dates.
+    Missing or unparseable dates return NaN.
+    """
+    days_between = to_dates(observation_dates) - to_dates(birth_dates)
+    # NaT converts to the smallest int64, so it is masked before the division
+    chronological_decimal_age = np.where(
+        np.isnat(days_between),
+        np.nan,
+        days_between.astype(np.int64) / 365.25
+    )
+    return np.round(chronological_decimal_age)
+
+# Weight
+def derive_weight(ages, sexes) -> np.ndarray:
+    """
+    Returns reference weights against age and sex from the lookup table in weight_calculations.py
+    Weight is capped at 75 kg
+    """
+    return derive_weights(ages=ages, sexes=sexes)
+
+# Boluses
+def crystalloid_bolus(weights, volume_per_kilogram) -> np.ndarray:
+    """
+    Returns volumes of crystalloid per kg body weight.
+    volumes/kg are expected as ml/kg
+    weights are expected in kg
+    """
+    return np.asarray(weights, dtype=np.float64) * volume_per_kilogram
+
+# Maintenance
+def holliday_segar_volume(weights, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> np.ndarray:
+    """
+    Returns the daily maintenance volumes for fluids based on weight using the Holliday-Segar equation.
+    Weights are capped as the guideline specifies (75 kg in v1)
+    """
+    return get_guideline(guideline_version).maintenance_volumes(weights)
+
+# deficit
+def dka_severity(pH, bicarbonate=None, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> np.ndarray:
+    """
+    Grades arrays of pH and bicarbonate values in one call, returning the severity names.
+    Each presentation takes the more severe of its pH and bicarbonate grades; missing bicarbonate
+    values are graded on pH alone. pH values at or below the guideline minimum, or missing, return None.
+    """
+    guideline = get_guideline(guideline_version)
+    ranks = guideline.severities(pH, bicarbonate)
+    # the extra None is selected by the rank of -1 given to ungradable presentations
+    names = np.array(guideline.severity_names + (None,), dtype=object)
+    return names[ranks]
+
+def deficit_percentage(pH, bicarbonate=None, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> np.ndarray:
+    """
+    Returns percentage deficits based on pH, or on bicarbonate where it is supplied and more severe,
+    from the bands of the guideline.
+    pH values at or below the guideline minimum (6.5 in v1), or missing, return NaN.
+    """
+    return get_guideline(guideline_version).deficit_percentages_of(pH, bicarbonate)
+
+def deficit_volume(percentage_deficit, weights, guideline_version: str = DEFAULT_GUIDELINE_VERSION) -> np.ndarray:
+    """
+    Returns volume deficits based on percentage deficit and weight (kg)
+    Negative weights or percentages return NaN.
+    """
+    guideline = get_guideline(guideline_version)
+    percentage_deficit = np.asarray(percentage_deficit, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    volume = percentage_deficit * guideline.cap_weights(weights, "deficit") * guideline.deficit_ml_per_kg_per_percent
+    return np.where((weights >= 0) & (percentage_deficit >= 0), volume, np.nan)
+
+# Insulin
+def calculated_insulin_rate(weights, insulin_per_kg) -> np.ndarray:
+    """
+    Returns the actual ml/hr of insulin, based on 50 U of actrapid made up with 50 U dextrose 10%
+    """
+    return np.asarray(insulin_per_kg, dtype=np.float64) * np.asarray(weights, dtype=np.float64)
+
+def calculate(
+    birth_dates,
+    observation_dates,
+    sexes,
+    pH,
+    shocked,
+    insulin_infusion_rates,
+    weights=None,
+    guideline_version: str = DEFAULT_GUIDELINE_VERSION,
+    bicarbonate=None
+) -> dict:
+    """
+    Runs the full calculation over arrays of presentations and returns a dictionary of output arrays,
+    matching the *_output values of the calculation endpoint.
+    Missing weights (NaN, or weights=None) are derived from age and sex.
+    Missing bicarbonate values (NaN, or bicarbonate=None) are graded on pH alone.
+    """
+    guideline = get_guideline(guideline_version)
+    ages = age_to_nearest_year(birth_dates=birth_dates, observation_dates=observation_dates)
+
+    derived_weights = derive_weight(ages=ages, sexes=sexes)
+    if weights is None:
+        weights = derived_weights
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        weights = np.where(np.isnan(weights), derived_weights, weights)
+
+    shocked = np.asarray(shocked, dtype=bool)
+
+    child_deficit_percentage = deficit_percentage(pH=pH, bicarbonate=bicarbonate, guideline_version=guideline_version)
+    child_deficit_volume = deficit_volume(percentage_deficit=child_deficit_percentage, weights=weights, guideline_version=guideline_version)
+    child_bolus_volume = crystalloid_bolus(weights=guideline.cap_weights(weights, "bolus"), volume_per_kilogram=guideline.bolus_ml_per_kg)
+
+    # the bolus is only subtracted from the deficit if shocked
+    child_deficit_volume_less_bolus_volume = child_deficit_volume - child_bolus_volume
+    deficit_replacement_rate = np.where(shocked, child_deficit_volume_less_bolus_volume, child_deficit_volume) / 48
+
+    daily_maintenance_volume = holliday_segar_volume(weights=weights, guideline_version=guideline_version)
+    child_maintenance_rate = daily_maintenance_volume / 24
+
+    return {
+        "age": ages,
+        "weight": weights,
+        "deficit_percentage": child_deficit_percentage,
+        "deficit_volume": child_deficit_volume,
+        "bolus_volume": child_bolus_volume,
+        "deficit_volume_less_bolus_volume": np.where(shocked, child_deficit_volume_less_bolus_volume, 0.0),
+        "daily_maintenance_volume": daily_maintenance_volume,
+        "maintenance_rate": child_maintenance_rate,
+        "starting_fluid_rate": deficit_replacement_rate + child_maintenance_rate,
+        "insulin_infusion_rate": calculated_insulin_rate(weights=guideline.cap_weights(weights, "insulin"), insulin_per_kg=insulin_infusion_rates),
+    }
+
+# Scenario sweeps
+def inclusive_range(start: float, stop: float, step: float) -> np.ndarray:
+    """
+    Returns the values from start to stop inclusive in steps of step.
+    Values are rounded to 10 decimal places, so that values landing on a band threshold
+    (such as a pH of 7.1 reached in steps of 0.1) are graded as the threshold and not just below it.
+    """
+    return np.round(start + step * np.arange(range_length(start, stop, step)), 10)
+
+def range_length(start: float, stop: float, step: float) -> int:
+    """
+    Returns the number of values inclusive_range would return, without building them,
+    so that a range can be checked against a size limit first
+    """
+    if step <= 0:
+        raise Exception("The step must be greater than 0.")
+    return max(int(np.floor((stop - start) / step + 1e-9)) + 1, 0)
+
+def scenario_grid(
+    weights,
+    pH,
+    shocked,
+    insulin_infusion_rates,
+    bicarbonate: float = None,
+    guideline_version: str = DEFAULT_GUIDELINE_VERSION
+) -> dict:
+    """
+    Calculates every combination of the weights, pH values, shocked values and insulin rates
+    of one patient in a single broadcasted calculation, with no loop over the combinations.
+    Returns the deficit percentages, deficit volumes, bolus volumes, daily maintenance volumes,
+    starting fluid rates and insulin infusion rates as arrays of shape
+    (weights, pH values, shocked values, insulin rates).
+    pH values which cannot be graded return NaN.
+    """
+    guideline = get_guideline(guideline_version)
+    # each input lies along its own axis, so numpy broadcasts them into the grid
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, 1, 1, 1)
+    pH = np.asarray(pH, dtype=np.float64).reshape(1, -1, 1, 1)
+    shocked = np.asarray(shocked, dtype=bool).reshape(1, 1, -1, 1)
+    insulin_infusion_rates = np.asarray(insulin_infusion_rates, dtype=np.float64).reshape(1, 1, 1, -1)
+    shape = (weights.shape[0], pH.shape[1], shocked.shape[2], insulin_infusion_rates.shape[3])
+
+    if bicarbonate is not None:
+        bicarbonate = np.full(pH.shape, bicarbonate, dtype=np.float64)
+    child_deficit_percentage = deficit_percentage(pH=pH, bicarbonate=bicarbonate, guideline_version=guideline_version)
+    child_deficit_volume = deficit_volume(percentage_deficit=child_deficit_percentage, weights=weights, guideline_version=guideline_version)
+    child_bolus_volume = crystalloid_bolus(weights=guideline.cap_weights(weights, "bolus"), volume_per_kilogram=guideline.bolus_ml_per_kg)
+
+    # the bolus is only subtracted from the deficit if shocked
+    deficit_replacement_rate = np.where(shocked, child_deficit_volume - child_bolus_volume, child_deficit_volume) / 48
+    daily_maintenance_volume = holliday_segar_volume(weights=weights, guideline_version=guideline_version)
+    child_maintenance_rate = daily_maintenance_volume / 24
+
+    return {
+        "deficit_percentage": np.broadcast_to(child_deficit_percentage, shape),
+        "deficit_volume": np.broadcast_to(child_deficit_volume, shape),
+        "bolus_volume": np.broadcast_to(child_bolus_volume, shape),
+        "daily_maintenance_volume": np.broadcast_to(daily_maintenance_volume, shape),
+        "starting_fluid_rate": np.broadcast_to(deficit_replacement_rate + child_maintenance_rate, shape),
+        "insulin_infusion_rate": np.broadcast_to(
+            calculated_insulin_rate(weights=guideline.cap_weights(weights, "insulin"), insulin_per_kg=insulin_infusion_rates),
+            shape
+        ),
+    }
@@ -1,14 +1,69 @@
+"""
+This file contains the functions for deriving a weight from age and sex when none is supplied.
+Reference weights are held in data/reference_weights.csv at monthly resolution from birth to
+18 years for each sex, and are read once at import into a flat array indexed by sex and month,
+so a lookup on the request path is a single index with no parsing.
+The values in the data file are currently the APLS estimate, (age + 4) x 2 capped at 75 kg,
+until the BSPED lookup table is supplied. Replacing the data file replaces the estimate.
+"""
+
+from array import array
+import csv
+from pathlib import Path
 from typing import Literal
 
-def derive_weight(age: float, sex=Literal['male', 'female']):
-    # Returns weight against age and sex
-    # This function is currently a placeholder which returns an estimated weight
-    # based on the APLS calculation.
-    # BSPED however uses a look up table which need to be implemented
-    # Weight is capped at 75 kg
-    weight =  (age + 4)*2
+REFERENCE_WEIGHTS_FILE = Path(__file__).parent / "data" / "reference_weights.csv"
+SEXES = ("male", "female")
+MAXIMUM_AGE_MONTHS = 216
+
+def load_reference_weights(path: Path = REFERENCE_WEIGHTS_FILE) -> array:
+    """
+    Returns a flat array of reference weights with one row of months per sex,
+    so that the weight for a sex and age in months is at [sex_index * (MAXIMUM_AGE_MONTHS + 1) + month]
+    """
+    months_per_sex = MAXIMUM_AGE_MONTHS + 1
+    weights = array("d", [float("nan")] * (len(SEXES) * months_per_sex))
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            month = int(row["age_months"])
+            if not 0 <= month <= MAXIMUM_AGE_MONTHS:
+                raise Exception(f"Reference weight for age {month} months is outside 0 to {MAXIMUM_AGE_MONTHS} months.")
+            weights[SEXES.index(row["sex"]) * months_per_sex + month] = float(row["weight_kg"])
+    if any(weight != weight for weight in weights):
+        raise Exception(f"{path} does not contain a reference weight for every month and sex.")
+    return weights
+
+REFERENCE_WEIGHTS = load_reference_weights()
+
+def derive_weight(age: float, sex: Literal['male', 'female']):
+    """
+    Returns the reference weight for an age in years and sex.
+    Ages are looked up to the nearest month. Ages outside the table (below birth or beyond 18 years) raise.
+    Weight is capped at 75 kg
+    """
+    if sex not in SEXES:
+        raise Exception(f"Weight cannot be derived for sex {sex}.")
+
+    month = round(age * 12)
+    if not 0 <= month <= MAXIMUM_AGE_MONTHS:
+        raise Exception(f"Weight cannot be derived for an age of {age} years; reference weights run from birth to {MAXIMUM_AGE_MONTHS // 12} years.")
+
+    return REFERENCE_WEIGHTS[SEXES.index(sex) * (MAXIMUM_AGE_MONTHS + 1) + month]
+
+def derive_weights(ages, sexes):
+    """
+    Returns reference weights for arrays of ages in years and sexes, as a numpy array.
+    Unrecognised sexes, and missing ages or ages outside the table, return NaN.
+    """
+    import numpy as np
 
-    if weight > 75:
-        weight = 75
+    table = np.frombuffer(REFERENCE_WEIGHTS, dtype=np.float64).reshape(len(SEXES), MAXIMUM_AGE_MONTHS + 1)
+    months = np.round(np.asarray(ages, dtype=np.float64) * 12)
+    with np.errstate(invalid="ignore"):
+        in_table = (months >= 0) & (months <= MAXIMUM_AGE_MONTHS)
+    sexes = np.asarray(sexes)
+    sex_indices = np.select([sexes == sex for sex in SEXES], list(range(len(SEXES))), default=-1)
 
-    return weight
\ No newline at end of file
+    # out of range and missing ages are looked up at month 0 and then masked
+    weights = table[np.maximum(sex_indices, 0), np.where(in_table, months, 0).astype(np.int64)]
+    return np.where((sex_indices >= 0) & in_table, weights, np.nan)
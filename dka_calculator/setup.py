@@ -28,12 +28,22 @@ setup(
     python_requires='>=3.5',
     install_requires=[
         'pytest',
+        'numpy',
     ],  
     extras_require={  
         'dev': ['check-manifest'],
-        'test': ['coverage'],
+        'test': ['coverage', 'hypothesis'],
+        'parquet': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': [
+            'dka-calc=dka_calculator.cli:main',
+        ],
     },
     include_package_data=True,
+    package_data={
+        'dka_calculator': ['data/*.csv', 'data/guidelines/*.json'],
+    },
     project_urls={  
         'Bug Reports': 'https://github.com/rcpch/digital-growth-charts/issues',
         'API management': 'https://dev.rcpch.ac.uk',
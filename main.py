@@ -1,20 +1,52 @@
 # standard imports
-import json
-from pathlib import Path
+from contextlib import asynccontextmanager
 import os
+from typing import Optional
 
 from routes import dka
+from utilities import metrics, offload, openapi, structured_logging
+from utilities.audit import audit_store
+from utilities.calculation_cache import calculation_cache
+from utilities.single_flight import calculation_flights
 
 # third party imports
-from fastapi import FastAPI
+from fastapi import FastAPI, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.openapi.utils import get_openapi
+from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import PlainTextResponse, Response
 
 version='0.0.1'  # this is set by bump version
 
+# development defaults; the production profile (python -m server) turns debug off
+debug_enabled = os.getenv("DKA_DEBUG", "true").lower() in ("true", "1", "yes")
+# comma separated list of origins allowed to call the API from a browser; the production profile
+# sets none, so a deployment lists its own
+cors_origins = [origin.strip() for origin in os.getenv("DKA_CORS_ORIGINS", "*,http://localhost:8000").split(",") if origin.strip()]
+# credentials are never allowed alongside the wildcard origin, which would let any site send them
+cors_allow_credentials = "*" not in cors_origins
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # log records are written by a background thread for the life of the app
+    structured_logging.start_logging()
+    # as are audit records, if the audit store is enabled
+    if audit_store is not None:
+        audit_store.start()
+    # load (or generate) the API spec now rather than on the first request for it
+    if openapi.precomputed_openapi_enabled:
+        encoded_openapi()
+    yield
+    # the offload pool is started by the first large batch or sweep
+    offload.shutdown()
+    if audit_store is not None:
+        audit_store.stop()
+    structured_logging.stop_logging()
+
 app = FastAPI(
-    debug=True,
-    openapi_url="/",
+    debug=debug_enabled,
+    lifespan=lifespan,
+    # the spec is served by the root endpoint below, and the docs are set up to read it from there
+    openapi_url=None,
         redoc_url=None,
         license_info={
             "name": "GNU Affero General Public License",
@@ -25,55 +57,114 @@ app = FastAPI(
 # Set up CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=['*', 'http://localhost:8000'],
-    allow_credentials=True,
+    allow_origins=cors_origins,
+    allow_credentials=cors_allow_credentials,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Record request counts, latency, validation failures and errors for the /metrics endpoint.
+if metrics.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers for each type of endpoint.
 app.include_router(dka)
 
 # Customise API metadata
-def custom_openapi():
-    if app.openapi_schema:
-        return app.openapi_schema
+def generate_openapi_schema():
+    from fastapi.openapi.utils import get_openapi
 
-    openapi_schema = get_openapi(
+    return get_openapi(
         title="BSPED DKA Calculator API",
         version=version,
         description="Calculates a personalised management plan for children and young people presenting in diabetic ketoacidosis according to the British Society of Paediatric Diabetes and Endocrinology (BSPED) guideline.",
         routes=app.routes,
     )
+
+def custom_openapi():
+    if app.openapi_schema:
+        return app.openapi_schema
+
+    openapi_schema = None
+    if openapi.precomputed_openapi_enabled:
+        # the spec written at build time by python -m utilities.openapi
+        openapi_schema = openapi.load_openapi(version=version)
+    if openapi_schema is None:
+        openapi_schema = generate_openapi_schema()
     app.openapi_schema = openapi_schema
     return app.openapi_schema
 
 app.openapi = custom_openapi
 
+def encoded_openapi() -> openapi.EncodedOpenAPI:
+    """
+    Returns the serialised API spec, encoding it only once
+    """
+    if app.state.encoded_openapi is None:
+        encoded = None
+        if openapi.precomputed_openapi_enabled:
+            encoded = openapi.load_encoded_openapi(version=version)
+        if encoded is None:
+            encoded = openapi.encode_openapi(app.openapi())
+        app.state.encoded_openapi = encoded
+    return app.state.encoded_openapi
+
+app.state.encoded_openapi = None
+
 # Include the root endpoint (so it is _described_ in the APIspec).
 @app.get("/", tags=["openapi3"])
-def root():
+def root(if_none_match: Optional[str] = Header(default=None)):
     """
     # API spec endpoint
     * The root `/` API endpoint returns the openAPI3 specification in JSON format
     * This spec is also available in the root of the server code repository
+    * Responses carry an `ETag`; send it back in `If-None-Match` to receive `304 Not Modified` while the spec is unchanged
     """
-    return
-
-"""
-# Saves openAPI3 spec to file in the project root.
-def write_apispec_to_file():
-    # check if openapi.json is already the same as the autogenerated
-    file = open(r'openapi.json', 'r')
-    if file.read() == json.dumps(app.openapi(), indent=4):
-        print("Generated internal openAPI3 spec and openapi.json have equal file content")
-    else:
-        file = open(r'openapi.json', 'w')
-        file.write(json.dumps(app.openapi(), indent=4))
-    file.close()
-        
-write_apispec_to_file()
-"""
+    encoded = encoded_openapi()
+    headers = {"ETag": encoded.etag, "Cache-Control": openapi.OPENAPI_CACHE_CONTROL}
+    if encoded.matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=encoded.body, media_type="application/json", headers=headers)
+
+@app.get("/docs", include_in_schema=False)
+def docs():
+    return get_swagger_ui_html(openapi_url="/", title="BSPED DKA Calculator API")
+
+# Prometheus metrics, including the calculation cache counters.
+def calculation_cache_metrics():
+    statistics = calculation_cache.statistics()
+    flights = calculation_flights.statistics()
+    return [
+        ("dka_calculation_cache_hits_total", "counter", "Calculation cache hits.", statistics["hits"]),
+        ("dka_calculation_cache_misses_total", "counter", "Calculation cache misses.", statistics["misses"]),
+        ("dka_calculation_cache_evictions_total", "counter", "Calculation cache entries evicted to stay within the size limit.", statistics["evictions"]),
+        ("dka_calculation_cache_expirations_total", "counter", "Calculation cache entries expired by the TTL.", statistics["expirations"]),
+        ("dka_calculation_cache_size", "gauge", "Calculation cache entries currently held.", statistics["size"]),
+        ("dka_calculation_single_flight_enabled", "gauge", "1 if concurrent identical calculations are coalesced, which needs DKA_OFFLOAD_CALCULATIONS=true; 0 if they run inline.", int(flights["enabled"])),
+        ("dka_calculation_flight_leaders_total", "counter", "Offloaded calculations run for a cache miss with no identical calculation in flight. Always 0 when single-flight is disabled.", flights["leaders"]),
+        ("dka_calculation_coalesced_total", "counter", "Requests which shared the result of an identical offloaded calculation in flight. Always 0 when single-flight is disabled.", flights["coalesced"]),
+        ("dka_log_records_dropped_total", "counter", "Log records dropped because the logging queue was full.", structured_logging.dropped_records()),
+    ]
+
+metrics.registry.add_collector(calculation_cache_metrics)
+
+def audit_metrics():
+    statistics = audit_store.statistics()
+    return [
+        ("dka_audit_records_written_total", "counter", "Calculations written to the audit store.", statistics["written"]),
+        ("dka_audit_batches_written_total", "counter", "Batches written to the audit store, one transaction each.", statistics["batches"]),
+        ("dka_audit_records_dropped_total", "counter", "Calculations not audited because the audit queue was full.", statistics["dropped"]),
+        ("dka_audit_records_failed_total", "counter", "Calculations not audited because they could not be encoded or their batch could not be written.", statistics["failed"]),
+        ("dka_audit_batches_failed_total", "counter", "Batches which could not be written to the audit store after every attempt.", statistics["failed_batches"]),
+        ("dka_audit_queue_size", "gauge", "Calculations waiting to be written to the audit store.", statistics["queued"]),
+    ]
+
+if audit_store is not None:
+    metrics.registry.add_collector(audit_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 # label = {
 #     "calculator_version": "0.1",
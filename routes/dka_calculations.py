@@ -2,29 +2,87 @@
 Fluids
 """
 # Standard imports
+import hmac
 import json
-from pathlib import Path
-from typing import List
+import logging
+import os
+from datetime import datetime
+from typing import Any, List, Literal, Optional, Union
 from dka_calculator import dka_calculator
 
-from dka_calculator.dka_calculator.fluid import holliday_segar_volume
-
 # Third party imports
-from schemas.dka_request_schema import ChildStatusRequestParameters
-from schemas.dka_response_schema import DKACalculationResponse
-from fastapi import APIRouter, Body, HTTPException
-
-# local imports to do the calculations - in future this could be put into its own module and imported
+from schemas.dka_request_schema import ChildStatusRequestParameters, DKAPlanRevisionRequest, DKAScenarioSweepRequest
+from schemas.dka_response_schema import DKACalculationResponse, DKACompactCalculationResponse, DKABatchCalculationResponse, DKAPlanRevisionResponse, DKAScenarioSweepResponse, DKAScheduleResponse
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+# local imports
+from utilities import metrics, offload, serialisation
+from utilities.audit import audit_store, audit_token
+from utilities.calculation_cache import calculation_cache
+from utilities.plan_tokens import InvalidPlanToken, decode_plan_token, encode_plan_token
+from utilities.single_flight import calculation_flights
+from utilities.streaming import NDJSONStreamingResponse, ndjson_lines
 
+logger = logging.getLogger("dka.requests")
 
 # set up the API router
 dka = APIRouter(
     prefix="/dka",
 )
 
-@dka.post("/calculation", tags=["dka"], response_model=DKACalculationResponse)
-def dka_calculation_response(child_request_parameters: ChildStatusRequestParameters = Body(
+# the largest grid the scenario sweep endpoint will calculate
+MAXIMUM_SWEEP_POINTS = 250000
+# the most items the batch endpoint will calculate in one request, as the whole body and response are held
+# in memory; larger jobs are streamed
+MAXIMUM_BATCH_ITEMS = int(os.getenv("DKA_MAXIMUM_BATCH_ITEMS", 10000))
+
+# clients can request the compact (numbers only) response either with the response_mode
+# query parameter or by sending this media type in the Accept header
+COMPACT_MEDIA_TYPE = serialisation.COMPACT_MEDIA_TYPE
+
+def select_binary_media_type(accept: Optional[str], plan_record: bool = True) -> str:
+    """
+    Returns the response format the Accept header prefers from those the endpoint can return. Raises a
+    406 if it accepts none of them: MessagePack needs msgpack to be installed, and only single
+    calculations have a plan record.
+    """
+    media_types = [serialisation.JSON_MEDIA_TYPE]
+    if serialisation.msgpack is not None:
+        media_types.append(serialisation.MSGPACK_MEDIA_TYPE)
+    if plan_record:
+        media_types.append(serialisation.PLAN_RECORD_MEDIA_TYPE)
+    media_type = serialisation.select_media_type(accept, media_types=media_types)
+    if media_type is None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"None of the accepted media types can be returned; this endpoint returns {', '.join(media_types)}."
+        )
+    return media_type
+
+def select_response_mode(response_mode: str, accept: Optional[str]) -> str:
+    """
+    Returns 'compact' if requested either by query parameter or Accept header, otherwise 'full'
+    """
+    if response_mode == "compact" or serialisation.is_explicitly_accepted(accept, COMPACT_MEDIA_TYPE):
+        return "compact"
+    return "full"
+
+# the binary formats the calculation endpoints can return, documented alongside the JSON response
+BINARY_RESPONSE_CONTENT = {
+    serialisation.MSGPACK_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+    serialisation.PLAN_RECORD_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+}
+
+@dka.post(
+    "/calculation",
+    tags=["dka"],
+    response_model=Union[DKACalculationResponse, DKACompactCalculationResponse],
+    responses={200: {"content": BINARY_RESPONSE_CONTENT}}
+)
+async def dka_calculation_response(child_request_parameters: ChildStatusRequestParameters = Body(
             ...,
             example={
                 "birth_date": "2015-04-12",
@@ -35,149 +93,756 @@ def dka_calculation_response(child_request_parameters: ChildStatusRequestParamet
                 "shocked": True,
                 "insulin_infusion_rate": 0.05
             }
-        )
+        ),
+        response_mode: Literal['full', 'compact'] = Query(
+            default='full',
+            description="`full` returns the calculated values with their working and formulae, `compact` returns the calculated values only."
+        ),
+        accept: Optional[str] = Header(default=None)
 ):
     """
     This is the main calculation endpoint which receives all the fields from the web form
     and returns the calculated values and working.
+    Machine clients which only need the numbers can request the compact response
+    with `?response_mode=compact` or an `Accept: application/vnd.dka.compact+json` header.
+    Sending `Accept: application/msgpack` returns the same response as MessagePack, and
+    `Accept: application/x-dka-plan` returns the eight calculated values, the severity band and
+    the limit level as a fixed 68 byte binary record (see the README for the layout).
+    Limit errors and validation errors are always returned as JSON.
     """
-    print("hello")
-    print(child_request_parameters)
-    # calculate the age
-    try:
-        age = dka_calculator.age_to_nearest_year(
-            birth_date=child_request_parameters.birth_date,
-            observation_date=child_request_parameters.resuscitation_start_date_time
+    logger.info("DKA calculation requested", extra={"request_parameters": child_request_parameters})
+    response_mode = select_response_mode(response_mode=response_mode, accept=accept)
+    media_type = select_binary_media_type(accept=accept)
+    if media_type == serialisation.PLAN_RECORD_MEDIA_TYPE:
+        # the record holds the calculated values only
+        response_mode = "compact"
+
+    # identical normalised inputs return the pre-rendered body without recalculating
+    cache_key = calculation_cache_key(
+        child_request_parameters=child_request_parameters,
+        response_mode=response_mode
+    )
+    if media_type != serialisation.JSON_MEDIA_TYPE:
+        cache_key += (media_type,)
+    body = calculation_cache.get(cache_key)
+    if body is None:
+        try:
+            body = await calculate_dka_body(
+                child_request_parameters=child_request_parameters,
+                response_mode=response_mode,
+                cache_key=cache_key,
+                media_type=media_type
+            )
+        except dka_calculator.LimitExceeded as error:
+            return limit_exceeded_response(error)
+
+    audit_calculation(
+        child_request_parameters=child_request_parameters,
+        response=body if media_type == serialisation.JSON_MEDIA_TYPE else lambda: serialisation.decode_response(body, media_type),
+        endpoint="calculation",
+        response_mode=response_mode
+    )
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+@dka.post("/calculation/schedule", tags=["dka"], response_model=DKAScheduleResponse)
+async def dka_schedule_response(child_request_parameters: ChildStatusRequestParameters = Body(
+            ...,
+            example={
+                "birth_date": "2015-04-12",
+                "resuscitation_start_date_time": "2022-02-06",
+                "sex": "female",
+                "weight": 23,
+                "pH": 6.86,
+                "shocked": True,
+                "insulin_infusion_rate": 0.05
+            }
+        ),
+        start_hour: int = Query(
+            default=0,
+            ge=0,
+            le=dka_calculator.SCHEDULE_HOURS,
+            description="The first hour to return, where hour 0 is the first hour of treatment."
+        ),
+        end_hour: int = Query(
+            default=dka_calculator.SCHEDULE_HOURS,
+            ge=0,
+            le=dka_calculator.SCHEDULE_HOURS,
+            description="The hour to stop before. Defaults to the end of the 48 hour schedule."
         )
-    except:
-        raise Exception('Unable to calculate age from dates provided')
-
-    # if the weight is not provided, calculate one from the age and the sex
-    if child_request_parameters.weight is None:
-        if child_request_parameters.sex is not None:
-            # derive weight from age and sex
-            try:
-                weight = dka_calculator.derive_weight(
-                    age=age,
-                    sex=child_request_parameters.sex
-                )
-            except Exception as error:
-                raise error
+):
+    """
+    Returns the hour by hour infusion schedule for the 48 hours of treatment: the fluid, maintenance
+    and deficit replacement rates, the cumulative fluid and maintenance volumes, the deficit remaining,
+    and the insulin rate and cumulative insulin for each hour.
+    Pumps and dashboards polling for upcoming hours can ask for just those hours with
+    `start_hour` and `end_hour`; only the hours asked for are calculated.
+    A `start_hour` after the `end_hour` returns 422.
+    """
+    if start_hour > end_hour:
+        raise HTTPException(status_code=422, detail=f"The start_hour ({start_hour}) must not be after the end_hour ({end_hour}).")
+    cache_key = calculation_cache_key(
+        child_request_parameters=child_request_parameters,
+        response_mode="schedule"
+    ) + (start_hour, end_hour)
+    body = calculation_cache.get(cache_key)
+    if body is None:
+        plan = calculate_request_plan(child_request_parameters=child_request_parameters)
+        try:
+            enforce_limits(plan)
+        except dka_calculator.LimitExceeded as error:
+            return limit_exceeded_response(error)
+        schedule = {
+            "start_hour": start_hour,
+            "end_hour": end_hour,
+            "hours": list(dka_calculator.hourly_schedule(plan=plan, start_hour=start_hour, end_hour=end_hour))
+        }
+        if serialisation.fast_json_enabled:
+            body = serialisation.encode_json(schedule)
         else:
-            raise Exception("Weight cannot be derived without knowing the sex of the child or young person.")
+            body = JSONResponse(content=jsonable_encoder(DKAScheduleResponse(**schedule))).body
+        calculation_cache.set(cache_key, body)
+
+    audit_calculation(
+        child_request_parameters=child_request_parameters,
+        response=body,
+        endpoint="schedule",
+        response_mode="schedule"
+    )
+    return Response(content=body, media_type="application/json")
+
+
+@dka.post("/calculation/revision", tags=["dka"], response_model=DKAPlanRevisionResponse)
+async def dka_plan_revision_response(revision: DKAPlanRevisionRequest = Body(
+            ...,
+            example={
+                "previous": {
+                    "birth_date": "2015-04-12",
+                    "resuscitation_start_date_time": "2022-02-06",
+                    "sex": "female",
+                    "weight": 23,
+                    "pH": 6.86,
+                    "shocked": True,
+                    "insulin_infusion_rate": 0.05
+                },
+                "update": {"pH": 7.05}
+            }
+        ),
+        response_mode: Literal['full', 'compact'] = Query(
+            default='full',
+            description="`full` returns the calculated values with their working and formulae, `compact` returns the calculated values only."
+        ),
+        accept: Optional[str] = Header(default=None)
+):
+    """
+    Revises a plan when observations are updated during treatment, for example a corrected weight or a new pH.
+    Send the `plan_id` of a previous revision, or the request parameters of the previous plan in `previous`,
+    with the observations to change in `update`. Only the stages which depend on the changed observations
+    are recalculated: a new pH regrades the deficit, a new weight recalculates every volume and rate.
+    Send `"bicarbonate": null` in `update` to grade on pH alone.
+    Returns the revised plan with a new `plan_id` for the next revision, the stages recalculated,
+    and the previous and revised value of each calculated value which changed.
+    The `plan_id` holds the plan's request parameters and calculated values, signed, so any worker can
+    revise it for 48 hours without recalculating the previous plan; a `plan_id` which was altered,
+    signed with another secret or has expired returns 404. A measurement the guideline treats as
+    implausibly low, such as a pH at or below 6.5 in `v1`, returns 422.
+    """
+    response_mode = select_response_mode(response_mode=response_mode, accept=accept)
+
+    if revision.plan_id is not None:
+        try:
+            request_values, plan_values = decode_plan_token(revision.plan_id)
+        except InvalidPlanToken as error:
+            raise HTTPException(status_code=404, detail=f"{error} Send the previous request parameters instead.")
+        # the token holds the previous plan's values, so it is rebuilt rather than recalculated
+        child_request_parameters = ChildStatusRequestParameters(**request_values)
+        previous_plan = dka_calculator.DKAPlan.from_values(plan_values)
+    elif revision.previous is not None:
+        child_request_parameters = revision.previous
+        previous_plan = None
     else:
-        weight = child_request_parameters.weight
+        raise HTTPException(status_code=422, detail="Either a plan_id or the previous request parameters are required.")
 
-    # derive the deficit based on the pH
-    
+    changes = revision.update.changes()
+    recalculated_stages = []
     try:
-        child_deficit_percentage = dka_calculator.deficit_percentage(
-            pH=child_request_parameters.pH
-        )
-    except Exception as error:
-        raise error
-    
-    # derive the deficit volume from the percentage deficit
+        if previous_plan is None:
+            previous_plan = calculate_request_plan(child_request_parameters=child_request_parameters)
+        plan = dka_calculator.revise_plan(previous_plan, recalculated_stages=recalculated_stages, **changes)
+    except dka_calculator.ImplausibleMeasurement as error:
+        raise HTTPException(status_code=422, detail=str(error))
     try:
-        child_deficit_volume = dka_calculator.deficit_volume(
-            percentage_deficit=child_deficit_percentage,
-            weight=weight
-        )
-    except Exception as error:
-        raise error
-    
-    # calculate the bolus sizes based on weight
-    try: 
-        child_bolus_volume = dka_calculator.crystalloid_bolus(
-            weight=weight,
-            volume_per_kilogram=10
-        )
-    except Exception as error:
-        raise error
-    
-
-    # subtract the bolus from the total deficit if shocked
-    deficit_volume_less_bolus_volume = None
-    if child_request_parameters.shocked:
-        child_deficit_volume_less_bolus_volume = child_deficit_volume - child_bolus_volume
-        deficit_volume_stem = {
-            "deficit_volume_less_bolus_volume_output": child_deficit_volume_less_bolus_volume,
-            "deficit_volume_less_bolus_volume_working": f"[{child_deficit_volume}ml]-[{child_bolus_volume}ml] = {child_deficit_volume_less_bolus_volume}ml",
-            "deficit_volume_less_bolus_volume_formula": "[Deficit volume] - [10mL/kg bolus (only for non-shocked patients)]"
-        }
+        outputs = dka_plan_outputs(plan=plan, response_mode=response_mode)
+    except dka_calculator.LimitExceeded as error:
+        return limit_exceeded_response(error)
+
+    revised_request_parameters = ChildStatusRequestParameters(**dict(dict(child_request_parameters), **changes))
+    plan_id = encode_plan_token(revised_request_parameters, plan.values())
+    audit_calculation(
+        child_request_parameters=revised_request_parameters,
+        response=outputs,
+        endpoint="revision",
+        response_mode=response_mode
+    )
+
+    response = {
+        "plan_id": plan_id,
+        "previous_plan_id": revision.plan_id,
+        "recalculated_stages": recalculated_stages,
+        "changes": dka_calculator.plan_diff(previous=previous_plan, revised=plan),
+        "plan": outputs
+    }
+    if serialisation.fast_json_enabled:
+        body = serialisation.encode_json(response)
     else:
-        deficit_volume_stem = {
-            "deficit_volume_less_bolus_volume_output": 0,
-            "deficit_volume_less_bolus_volume_working": "No subtraction has been made for fluid boluses as the child or young person has not been reported as shocked.",
-            "deficit_volume_less_bolus_volume_formula": "[Deficit volume] - [10mL/kg bolus (only for non-shocked patients)]"
+        body = JSONResponse(content=jsonable_encoder(DKAPlanRevisionResponse(**response))).body
+    return Response(content=body, media_type="application/json")
+
+
+@dka.get("/calculation/cache", tags=["dka"])
+def dka_calculation_cache_statistics():
+    """
+    Returns the size and hit, miss, eviction and expiration counters of the calculation cache,
+    and the leader and coalesced counters of the calculations shared between concurrent identical requests.
+    """
+    return dict(calculation_cache.statistics(), single_flight=calculation_flights.statistics())
+
+
+audit_bearer = HTTPBearer(auto_error=False, description="The token set in DKA_AUDIT_TOKEN.")
+
+
+def require_audit_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(audit_bearer)) -> None:
+    """
+    Raises unless the request carries the audit token. Without a token configured, or an audit
+    store, the endpoint does not exist.
+    """
+    if audit_store is None or audit_token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode("utf-8"), audit_token.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="The audit token is missing or wrong.", headers={"WWW-Authenticate": "Bearer"})
+
+
+@dka.get("/audit", tags=["dka"], dependencies=[Depends(require_audit_token)])
+def dka_audit_records(
+        start: Optional[datetime] = Query(
+            default=None,
+            description="Return calculations recorded at or after this time. Times without a timezone are UTC."
+        ),
+        end: Optional[datetime] = Query(
+            default=None,
+            description="Return calculations recorded before this time. Times without a timezone are UTC."
+        ),
+        limit: int = Query(default=100, ge=1, le=1000, description="The most records to return."),
+        after_id: int = Query(
+            default=0,
+            ge=0,
+            description="Return records after this id, to continue from the last record of the previous page."
+        )
+):
+    """
+    Returns the calculations recorded in the audit store between `start` and `end`, oldest first,
+    with their request parameters, guideline version and response. Identifying fields such as the
+    birth date are redacted.
+    Only available when the audit store is enabled with `DKA_AUDIT_DATABASE` and a token is set in
+    `DKA_AUDIT_TOKEN`; send it as `Authorization: Bearer <token>`. Requests without it return 401.
+    Records are written in batches, so the most recent second or so of calculations may not appear yet.
+    """
+    return {"records": audit_store.query(start=start, end=end, limit=limit, after_id=after_id)}
+
+
+@dka.post(
+    "/calculations:batch",
+    tags=["dka"],
+    response_model=DKABatchCalculationResponse,
+    responses={200: {"content": {serialisation.MSGPACK_MEDIA_TYPE: BINARY_RESPONSE_CONTENT[serialisation.MSGPACK_MEDIA_TYPE]}}},
+    # items are validated one at a time by calculate_batch, so the body is only checked to be a list;
+    # the spec still documents the fields each item takes
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {
+                    "schema": {"items": {"$ref": "#/components/schemas/ChildStatusRequestParameters"}}
+                }
+            }
         }
-    
-    # calculate the maintenance fluid volume
-    daily_maintenance_volume = holliday_segar_volume(
-        weight=weight
+    }
+)
+async def dka_batch_calculation_response(presentations: List[Any] = Body(
+            ...,
+            example=[
+                {
+                    "birth_date": "2015-04-12",
+                    "resuscitation_start_date_time": "2022-02-06",
+                    "sex": "female",
+                    "weight": 23,
+                    "pH": 6.86,
+                    "shocked": True,
+                    "insulin_infusion_rate": 0.05
+                }
+            ]
+        ),
+        response_mode: Literal['full', 'compact'] = Query(
+            default='full',
+            description="`full` returns the calculated values with their working and formulae, `compact` returns the calculated values only."
+        ),
+        accept: Optional[str] = Header(default=None)
+):
+    """
+    Batch calculation endpoint for audit and whole-ward workloads.
+    Receives a list of the same fields as the main calculation endpoint and returns
+    one result per item, in the same order. Items which fail validation or calculation
+    have their error recorded against their index instead of failing the whole batch.
+    Sending `Accept: application/msgpack` returns the same response as MessagePack.
+    Batches of more than 10,000 items (`DKA_MAXIMUM_BATCH_ITEMS`) return 422; send them to
+    `/dka/calculations:stream` instead.
+    """
+    if len(presentations) > MAXIMUM_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"The batch has {len(presentations)} items; it can have at most {MAXIMUM_BATCH_ITEMS}. Send larger jobs to /dka/calculations:stream as newline-delimited JSON."
+        )
+    response_mode = select_response_mode(response_mode=response_mode, accept=accept)
+    media_type = select_binary_media_type(accept=accept, plan_record=False)
+    body, calculated = await offload.run(
+        len(presentations) >= offload.offload_batch_items,
+        render_batch,
+        presentations=presentations,
+        response_mode=response_mode,
+        audited=audit_store is not None,
+        media_type=media_type
     )
+    # audited here rather than in render_batch, which may run in another process
+    for child_request_parameters, result in calculated:
+        audit_calculation(
+            child_request_parameters=child_request_parameters,
+            response=result,
+            endpoint="batch",
+            response_mode=response_mode
+        )
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
 
-    child_maintenance_strings = dka_calculator.holliday_segar_advice(weight=weight)
-    
-    # calculate the maintenance fluid hourly rate
-    child_maintenance_rate = daily_maintenance_volume / 24
-    
-    # calculate the fluid deficit hourly rate
-    if child_request_parameters.shocked:        
-        deficit_replacement_rate = child_deficit_volume_less_bolus_volume / 48
+def render_batch(presentations: List[Any], response_mode: str, audited: bool = False, media_type: str = serialisation.JSON_MEDIA_TYPE) -> tuple:
+    """
+    Calculates a batch and returns the encoded JSON or MessagePack body of its response, rendered here so that
+    large batches are validated and encoded in the offload pool rather than on the event loop.
+    If audited, the validated parameters and result of each item calculated are also returned.
+    """
+    results, calculated = calculate_batch(presentations=presentations, response_mode=response_mode)
+    if media_type == serialisation.MSGPACK_MEDIA_TYPE:
+        body = serialisation.encode_msgpack({"results": results})
+    elif serialisation.fast_json_enabled:
+        # every result was built here, so the response model validation is skipped
+        body = serialisation.encode_json({"results": results})
     else:
-        deficit_replacement_rate = child_deficit_volume / 48
-    
+        body = JSONResponse(content=jsonable_encoder(DKABatchCalculationResponse(results=results))).body
+    return body, (calculated if audited else [])
 
-    starting_fluid_rate = deficit_replacement_rate + child_maintenance_rate
-    
-    try:
-        insulin_infusion_rate = dka_calculator.calculated_insulin_rate(
-            weight=weight,
-            insulin_per_kg=child_request_parameters.insulin_infusion_rate
+
+def calculate_batch(presentations: List[Any], response_mode: str) -> tuple:
+    """
+    Validates and calculates each presentation of a batch, recording any error against its index.
+    Returns the result items, and the validated parameters and result of each item which was calculated.
+    """
+    results = []
+    calculated = []
+    for index, presentation in enumerate(presentations):
+        try:
+            child_request_parameters = validate_request_parameters(presentation)
+            result = calculate_dka_plan(
+                child_request_parameters=child_request_parameters,
+                response_mode=response_mode
+            )
+        except Exception as error:
+            results.append({"index": index, "result": None, "error": str(error)})
+        else:
+            results.append({"index": index, "result": result, "error": None})
+            calculated.append((child_request_parameters, result))
+    return results, calculated
+
+
+@dka.post("/calculations:sweep", tags=["dka"], response_model=DKAScenarioSweepResponse)
+async def dka_scenario_sweep_response(sweep: DKAScenarioSweepRequest = Body(
+            ...,
+            example={
+                "patient": {
+                    "birth_date": "2015-04-12",
+                    "resuscitation_start_date_time": "2022-02-06",
+                    "sex": "female",
+                    "weight": 23,
+                    "pH": 6.86,
+                    "shocked": True,
+                    "insulin_infusion_rate": 0.05
+                },
+                "weights": {"start": 20, "stop": 80, "step": 0.5},
+                "pH": {"start": 6.6, "stop": 7.4, "step": 0.1},
+                "shocked": [True, False],
+                "insulin_infusion_rates": [0.05, 0.1]
+            }
         )
-    except Exception as error:
-        raise error
+):
+    """
+    Scenario sweep endpoint for sensitivity analysis.
+    Takes one patient and ranges of weight and pH and lists of shocked values and insulin rates,
+    and returns the deficit percentages, deficit volumes, starting fluid rates and insulin rates
+    for every combination, calculated as one broadcasted array operation, with the safety limit
+    level of each (0 within limits, 1 warning, 2 error).
+    Results are nested lists indexed [weight][pH][shocked][insulin_infusion_rate].
+    """
+    patient = sweep.patient
+    vectorised = dka_calculator.vectorised
 
-    return  {
-        "deficit_percentage":{
-            "deficit_percentage_output": child_deficit_percentage,
-            "deficit_percentage_working": f"[pH {child_request_parameters.pH}] is in range {dka_calculator.pH_ranges(child_request_parameters.pH)} ==> {child_deficit_percentage}%",
-            "deficit_percentage_formula": "pH range [7.2 to 7.4 = 5%] or [7.1 to 7.2 = 5%] or [6.5 to 7.1 = 10%]"
-        },
-        "deficit_volume":{
-            "deficit_volume_output": child_deficit_volume,
-            "deficit_volume_working": f"[{child_deficit_percentage}%] x [{weight}kg] x 10 = {child_deficit_volume}mL",
-            "deficit_volume_formula": "[Deficit percentage] x [Patient weight (kg)] x 10",
-            "deficit_volume_limit": "7500mL (for 10% deficit)" # @dan-leach can you check this is correct?
-        },
-        "bolus_volume":{
-            "bolus_volume_output": child_bolus_volume,
-            "bolus_volume_working": f"[10mL/kg] x [{weight}kg] = {child_bolus_volume}mL",
-            "bolus_volume_formula": "[10mL/kg] x [Patient weight (kg)]",
-            "bolus_volume_limit": "750mL" # @dan-leach can you check this is correct?
-        },
-        "deficit_volume_less_bolus_volume":deficit_volume_stem,
-        "daily_maintenance_volume":{
-            "daily_maintenance_volume_output": daily_maintenance_volume,
-            "daily_maintenance_volume_working": child_maintenance_strings["advice"],
-            "daily_maintenance_volume_formula": child_maintenance_strings["formula"],
-            "daily_maintenance_volume_limit": "2600" # @dan-leach can you check this is correct?
-        },
-        "maintenance_rate":{
-            "maintenance_rate_output": child_maintenance_rate,
-            "maintenance_rate_working": "[Daily maintenance volume] ÷ [24 hours]",
-            "maintenance_rate_formula": f"[{daily_maintenance_volume}mL] ÷ [24 hours] = {child_maintenance_rate}mL/hour"
-        },
-        "starting_fluid_rate":{
-            "starting_fluid_rate_output": starting_fluid_rate,
-            "starting_fluid_rate_working": f"[{deficit_replacement_rate}mL/hour] + [{child_maintenance_rate}mL/hour] = 112.9mL/hour",
-            "starting_fluid_rate_formula": "[Deficit replacement rate] + [Maintenance rate]"
+    shocked = sweep.shocked if sweep.shocked else [patient.shocked]
+    insulin_infusion_rates = sweep.insulin_infusion_rates if sweep.insulin_infusion_rates else [patient.insulin_infusion_rate]
+    if sweep.pH is None and patient.pH is None:
+        raise HTTPException(status_code=422, detail="Either the patient's pH or a pH range is required.")
+
+    # the size is checked before any range is built, as a tiny step would otherwise allocate an enormous array first
+    points = len(shocked) * len(insulin_infusion_rates)
+    for sweep_range in (sweep.weights, sweep.pH):
+        if sweep_range is not None:
+            points *= vectorised.range_length(sweep_range.start, sweep_range.stop, sweep_range.step)
+    if points == 0 or points > MAXIMUM_SWEEP_POINTS:
+        raise HTTPException(status_code=422, detail=f"The sweep has {points} combinations; it must have between 1 and {MAXIMUM_SWEEP_POINTS}.")
+
+    if sweep.weights is not None:
+        weights = vectorised.inclusive_range(sweep.weights.start, sweep.weights.stop, sweep.weights.step)
+    elif patient.weight is not None:
+        weights = [patient.weight]
+    else:
+        age = dka_calculator.age_to_nearest_year(
+            birth_date=patient.birth_date,
+            observation_date=patient.resuscitation_start_date_time
+        )
+        weights = [dka_calculator.derive_weight(age=age, sex=patient.sex)]
+
+    pH = vectorised.inclusive_range(sweep.pH.start, sweep.pH.stop, sweep.pH.step) if sweep.pH is not None else [patient.pH]
+
+    body = await offload.run(
+        points >= offload.offload_sweep_points,
+        render_scenario_sweep,
+        weights=weights,
+        pH=pH,
+        shocked=shocked,
+        insulin_infusion_rates=insulin_infusion_rates,
+        bicarbonate=patient.bicarbonate,
+        guideline_version=patient.guideline_version
+    )
+    return Response(content=body, media_type="application/json")
+
+
+def render_scenario_sweep(weights, pH, shocked: list, insulin_infusion_rates: list, bicarbonate: Optional[float], guideline_version: str) -> bytes:
+    """
+    Calculates the grid of a scenario sweep and returns the encoded JSON body of its response
+    """
+    grid = dka_calculator.vectorised.scenario_grid(
+        weights=weights,
+        pH=pH,
+        shocked=shocked,
+        insulin_infusion_rates=insulin_infusion_rates,
+        bicarbonate=bicarbonate,
+        guideline_version=guideline_version
+    )
+
+    response = {
+        "axes": {
+            "weight": [float(weight) for weight in weights],
+            "pH": [float(value) for value in pH],
+            "shocked": [bool(value) for value in shocked],
+            "insulin_infusion_rate": [float(rate) for rate in insulin_infusion_rates]
         },
-        "insulin_infusion_rate":{
-            "insulin_infusion_rate_output": insulin_infusion_rate,
-            "insulin_infusion_rate_working": f"{insulin_infusion_rate} Units/hour (for {child_request_parameters.insulin_infusion_rate} Units/kg/hour)",
-            "insulin_infusion_rate_formula": "[Insulin rate (Units/kg/hour)] x [Patient weight]",
-            "insulin_infusion_rate_limit": "3.75 Units/hour (for 0.05 Units/kg/hour)" # @dan-leach can you check this is correct?
+        "shape": list(grid["starting_fluid_rate"].shape)
+    }
+    for name in ("deficit_percentage", "deficit_volume", "starting_fluid_rate", "insulin_infusion_rate"):
+        response[name] = grid_to_lists(grid[name])
+    response["limit_level"] = dka_calculator.limit_level(
+        outputs=grid,
+        guideline_version=guideline_version
+    ).tolist()
+
+    # grids are built here and can be large, so they are encoded directly rather than validated
+    return serialisation.encode_json(response)
+
+
+def grid_to_lists(values) -> list:
+    """
+    Returns a numpy array as nested lists, with NaN (which JSON cannot represent) as None
+    """
+    import numpy as np
+
+    nan = np.isnan(values)
+    if not nan.any():
+        return values.tolist()
+    values = values.astype(object)
+    values[nan] = None
+    return values.tolist()
+
+
+@dka.post(
+    "/calculations:stream",
+    tags=["dka"],
+    response_class=NDJSONStreamingResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/ChildStatusRequestParameters"}
+                }
+            }
         }
-    }
\ No newline at end of file
+    }
+)
+async def dka_stream_calculation_response(
+        request: Request,
+        response_mode: Literal['full', 'compact'] = Query(
+            default='full',
+            description="`full` returns the calculated values with their working and formulae, `compact` returns the calculated values only."
+        ),
+        accept: Optional[str] = Header(default=None)
+):
+    """
+    Streaming calculation endpoint for very large replay jobs.
+    Reads newline-delimited JSON records with the same fields as the main calculation endpoint
+    from the request body and writes one newline-delimited JSON result per record, in the same
+    shape as the items of the batch endpoint, as soon as each is calculated.
+    Memory use does not depend on the size of the upload, and results can be read before it finishes.
+    """
+    response_mode = select_response_mode(response_mode=response_mode, accept=accept)
+
+    async def stream_results():
+        index = 0
+        try:
+            async for line in ndjson_lines(request.stream()):
+                yield calculate_ndjson_record(index=index, line=line, response_mode=response_mode)
+                index += 1
+        except ValueError as error:
+            yield json.dumps({"index": index, "result": None, "error": str(error)}, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    return NDJSONStreamingResponse(stream_results())
+
+
+def calculate_ndjson_record(index: int, line: bytes, response_mode: str) -> bytes:
+    """
+    Calculates a single NDJSON record and returns its encoded result line,
+    recording any validation or calculation error against its index
+    """
+    try:
+        child_request_parameters = validate_request_parameters(json.loads(line))
+        plan = calculate_dka_plan(
+            child_request_parameters=child_request_parameters,
+            response_mode=response_mode
+        )
+        body = render_dka_plan(plan=plan, response_mode=response_mode)
+    except Exception as error:
+        return json.dumps({"index": index, "result": None, "error": str(error)}, separators=(",", ":")).encode("utf-8") + b"\n"
+    audit_calculation(
+        child_request_parameters=child_request_parameters,
+        response=body,
+        endpoint="stream",
+        response_mode=response_mode
+    )
+    return b'{"index":' + str(index).encode("utf-8") + b',"result":' + body + b',"error":null}\n'
+
+
+def validate_request_parameters(item) -> ChildStatusRequestParameters:
+    """
+    Returns the request parameters of one batch item or stream record, raising if it is not an object
+    or fails validation
+    """
+    if not isinstance(item, dict):
+        raise Exception("Each item must be an object with the request parameters.")
+    return ChildStatusRequestParameters(**item)
+
+
+def audit_calculation(child_request_parameters: ChildStatusRequestParameters, response, endpoint: str, response_mode: str) -> None:
+    """
+    Queues the calculation for the audit store, if it is enabled. This only puts the record on
+    the store's queue; it is encoded and written by the store's writer thread.
+    """
+    if audit_store is not None:
+        audit_store.record(
+            request_parameters=child_request_parameters,
+            response=response,
+            guideline_version=child_request_parameters.guideline_version,
+            endpoint=endpoint,
+            response_mode=response_mode
+        )
+
+
+def calculation_cache_key(child_request_parameters: ChildStatusRequestParameters, response_mode: str) -> tuple:
+    """
+    Returns the normalised inputs on which the calculation depends, for use as a cache key.
+    The age is rounded to the nearest year and the pH and bicarbonate are reduced to their
+    combined severity rank under the requested guideline version. The rank determines the deficit
+    percentage, and is kept rather than the percentage because a guideline may give two severities the
+    same percentage while the plan record carries the severity.
+    The exact pH and bicarbonate are only kept for the full response, since they appear in the working.
+    """
+    age = dka_calculator.age_to_nearest_year(
+        birth_date=child_request_parameters.birth_date,
+        observation_date=child_request_parameters.resuscitation_start_date_time
+    )
+    severity = dka_calculator.get_guideline(child_request_parameters.guideline_version).severity(
+        pH=child_request_parameters.pH,
+        bicarbonate=child_request_parameters.bicarbonate
+    )
+    return (
+        response_mode,
+        child_request_parameters.guideline_version,
+        age,
+        child_request_parameters.sex,
+        child_request_parameters.weight,
+        severity,
+        child_request_parameters.pH if response_mode == "full" else None,
+        child_request_parameters.bicarbonate if response_mode == "full" else None,
+        child_request_parameters.shocked,
+        child_request_parameters.insulin_infusion_rate
+    )
+
+
+async def calculate_dka_body(child_request_parameters: ChildStatusRequestParameters, response_mode: str, cache_key: tuple, media_type: str = serialisation.JSON_MEDIA_TYPE) -> bytes:
+    """
+    Calculates and renders the plan for the calculation endpoint and stores the body in the calculation cache.
+    Raises LimitExceeded if any output is above its error ceiling.
+    """
+    if offload.offload_calculations:
+        # offloaded calculations overlap, so concurrent misses for the same inputs share one
+        # calculation and one rendered body
+        body = await calculation_flights.do(
+            cache_key,
+            lambda: offload.run(
+                True,
+                render_calculation,
+                child_request_parameters=child_request_parameters,
+                response_mode=response_mode,
+                media_type=media_type
+            )
+        )
+    else:
+        # inline calculations finish before the event loop runs any other request, so there is
+        # never an identical one in flight to share
+        body = render_calculation(child_request_parameters=child_request_parameters, response_mode=response_mode, media_type=media_type)
+    calculation_cache.set(cache_key, body)
+    return body
+
+
+def render_calculation(child_request_parameters: ChildStatusRequestParameters, response_mode: str, media_type: str = serialisation.JSON_MEDIA_TYPE) -> bytes:
+    """
+    Calculates the plan and returns its body encoded as JSON, MessagePack or a plan record
+    """
+    if media_type == serialisation.PLAN_RECORD_MEDIA_TYPE:
+        plan = calculate_request_plan(child_request_parameters=child_request_parameters)
+        limit_warnings = enforce_limits(plan)
+        return serialisation.encode_plan_record(
+            outputs=plan.outputs(),
+            severity=plan.guideline.severity_names.index(plan.severity),
+            limit_level=1 if limit_warnings else 0
+        )
+
+    plan = calculate_dka_plan(
+        child_request_parameters=child_request_parameters,
+        response_mode=response_mode
+    )
+    if media_type == serialisation.MSGPACK_MEDIA_TYPE:
+        return serialisation.encode_msgpack(plan)
+    return render_dka_plan(plan=plan, response_mode=response_mode)
+
+
+def render_dka_plan(plan: dict, response_mode: str) -> bytes:
+    """
+    Returns the encoded JSON body of the plan. With fast JSON enabled the plan is encoded
+    directly, otherwise it is first validated against its response model.
+    """
+    if serialisation.fast_json_enabled:
+        return serialisation.encode_json(plan)
+    return render_validated_dka_plan(plan=plan, response_mode=response_mode)
+
+
+def render_validated_dka_plan(plan: dict, response_mode: str) -> bytes:
+    """
+    Validates the plan against its response model and returns the encoded JSON body
+    """
+    if response_mode == "compact":
+        response = DKACompactCalculationResponse(**plan)
+    else:
+        response = DKACalculationResponse(**plan)
+    return JSONResponse(content=jsonable_encoder(response)).body
+
+
+class LimitExceededResponse(JSONResponse):
+    """
+    A JSON response which marks the request as refused on its safety limits, for the metrics middleware
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        scope[metrics.LIMIT_REFUSAL_SCOPE_KEY] = True
+        await super().__call__(scope, receive, send)
+
+
+def limit_exceeded_response(error: Exception) -> JSONResponse:
+    """
+    Returns the 422 response for a plan with an output above its error ceiling, listing the breaches
+    """
+    return LimitExceededResponse(status_code=422, content={"detail": error.breaches})
+
+
+def enforce_limits(plan) -> list:
+    """
+    Returns the plan's limit warnings, or raises LimitExceeded if any output is above its error ceiling
+    """
+    breaches = plan.limit_breaches()
+    if any(breach["level"] == "error" for breach in breaches):
+        raise dka_calculator.LimitExceeded(breaches)
+    return breaches
+
+
+def calculate_dka_plan(child_request_parameters: ChildStatusRequestParameters, response_mode: str = "full") -> dict:
+    """
+    Runs the dka_calculator plan over a single validated set of request parameters
+    and returns the calculated values and working, with any limit warnings. This is called directly by the
+    single, batch and streaming endpoints so that no FastAPI request state is built for each item.
+    If response_mode is 'compact' only the calculated values are returned and none of the
+    working or formula strings are built.
+    Raises LimitExceeded if any output is above its error ceiling.
+    """
+    plan = calculate_request_plan(child_request_parameters=child_request_parameters)
+    return dka_plan_outputs(plan=plan, response_mode=response_mode)
+
+
+def dka_plan_outputs(plan, response_mode: str = "full") -> dict:
+    """
+    Returns the calculated values of a plan, with their working unless response_mode is 'compact',
+    and any limit warnings. Raises LimitExceeded if any output is above its error ceiling.
+    """
+    limit_warnings = enforce_limits(plan)
+
+    if response_mode == "compact":
+        outputs = plan.outputs()
+    else:
+        outputs = plan.explained_outputs()
+    outputs["limit_warnings"] = limit_warnings
+    return outputs
+
+
+def calculate_request_plan(child_request_parameters: ChildStatusRequestParameters):
+    """
+    Returns the dka_calculator plan for a single validated set of request parameters,
+    recording the stage timings if they are enabled
+    """
+    stage_timings = {} if metrics.stage_timing_enabled else None
+    plan = dka_calculator.calculate_plan(
+        birth_date=child_request_parameters.birth_date,
+        observation_date=child_request_parameters.resuscitation_start_date_time,
+        sex=child_request_parameters.sex,
+        pH=child_request_parameters.pH,
+        bicarbonate=child_request_parameters.bicarbonate,
+        shocked=child_request_parameters.shocked,
+        insulin_infusion_rate=child_request_parameters.insulin_infusion_rate,
+        weight=child_request_parameters.weight,
+        stage_timings=stage_timings,
+        guideline_version=child_request_parameters.guideline_version
+    )
+    if stage_timings is not None:
+        metrics.observe_stage_timings(stage_timings)
+    return plan
@@ -1,17 +1,24 @@
 # standard imports
-from datetime import date, datetime
-from email import message
-from typing import Optional, Literal, Union, List
+from datetime import date
+from typing import Annotated, List, Optional, Literal
 
 # third party imports
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+# local imports
+from dka_calculator.dka_calculator.age_calculations import age_to_nearest_year
+from dka_calculator.dka_calculator.guidelines import DEFAULT_GUIDELINE_VERSION, GUIDELINE_VERSIONS
+# the accepted ranges of the measurements, shared by the request, sweep and plan update schemas and the command line interface
+from dka_calculator.dka_calculator.plan import BICARBONATE_RANGE, PH_RANGE, WEIGHT_RANGE
+from dka_calculator.dka_calculator.weight_calculations import MAXIMUM_AGE_MONTHS
 
 class ChildStatusRequestParameters(BaseModel):
     """
     This class defines the schema for a python model which will be converted to by FastAPI to openAPI3 schema.
     All validation etc is defined here.
     All fields are essential, except the weight field - if not provided, 
-    an estimated weight can be derived based on the sex and age rounded to the nearest year
+    an estimated weight can be derived based on the sex and age rounded to the nearest year.
+    The bicarbonate field is also optional.
     """
     birth_date: date = Field(
         ..., description="Date of birth of the patient, in the format YYYY-MM-DD")
@@ -23,21 +30,134 @@ class ChildStatusRequestParameters(BaseModel):
     )
     pH: float = Field(
         default=None,
-        ge=6.0, 
-        lt=8.0,
+        ge=PH_RANGE[0],
+        lt=PH_RANGE[1],
         description="The pH of the initial blood gas."
     )
+    bicarbonate: Optional[float] = Field(
+        default=None,
+        ge=BICARBONATE_RANGE[0],
+        lt=BICARBONATE_RANGE[1],
+        description="The bicarbonate of the initial blood gas in mmol/L. Optional: if provided, the DKA severity is graded on the bicarbonate when this is more severe than the grading on pH."
+    )
     shocked: bool = Field(
         default=False,
         description="A boolean value to represent whether the child or young person is shocked at presentation."
     )
     insulin_infusion_rate: float = Field(
         default=0.05,
-        message="The user requested insulin infusion rate. Usually Either 0.05 or 0.1 U/kg/hr but this is not constrained. A bespoke alternative value can be selected.",
+        gt=0,
+        le=1,
+        description="The user requested insulin infusion rate in Units/kg/hour. Usually either 0.05 or 0.1 Units/kg/hour, but a bespoke alternative value greater than 0 and up to 1 can be selected. Rates above the guideline's safety limits are flagged or refused.",
     )
     weight: Optional[float] = Field(
         default=None,
-        ge=0.5, 
-        lt=220,
+        ge=WEIGHT_RANGE[0],
+        lt=WEIGHT_RANGE[1],
         description="The weight of the child in kg. Cannot be >220 kg."
-    )
\ No newline at end of file
+    )
+    guideline_version: Literal[GUIDELINE_VERSIONS] = Field(
+        default=DEFAULT_GUIDELINE_VERSION,
+        description="The version of the guideline whose severity bands, weight caps and per-kg factors are used. `v1` is the current guideline."
+    )
+
+    @model_validator(mode="after")
+    def check_age(self):
+        # a weight can only be derived within the reference weight table, from birth to 18 years
+        if self.birth_date > self.resuscitation_start_date_time:
+            raise ValueError("The birth_date must not be after the resuscitation_start_date_time.")
+        if self.weight is None:
+            age = age_to_nearest_year(birth_date=self.birth_date, observation_date=self.resuscitation_start_date_time)
+            if age * 12 > MAXIMUM_AGE_MONTHS:
+                raise ValueError(f"A weight is required for ages over {MAXIMUM_AGE_MONTHS // 12} years, as none can be derived.")
+        return self
+
+class SweepRange(BaseModel):
+    """
+    A range of values from start to stop inclusive, in steps of step.
+    """
+    start: float
+    stop: float
+    step: float = Field(..., gt=0)
+
+    @model_validator(mode="after")
+    def check_order(self):
+        if self.stop < self.start:
+            raise ValueError(f"The stop ({self.stop}) must not be below the start ({self.start}).")
+        return self
+
+    def check_within(self, name: str, bounds: tuple):
+        """
+        Raises if any value of the range is outside the accepted range of the measurement
+        """
+        minimum, maximum = bounds
+        if self.start < minimum or self.stop >= maximum:
+            raise ValueError(f"The {name} range must be from {minimum} up to but not including {maximum}.")
+
+class DKAScenarioSweepRequest(BaseModel):
+    """
+    One patient and the ranges of inputs to sweep. Any input without a range is held at the patient's value.
+    """
+    patient: ChildStatusRequestParameters = Field(
+        ..., description="The patient whose calculation is swept. Inputs which are not swept are taken from here.")
+    weights: Optional[SweepRange] = Field(
+        default=None, description="The weights in kg to sweep. Defaults to the patient's weight, or the weight derived from their age and sex.")
+    pH: Optional[SweepRange] = Field(
+        default=None, description="The pH values to sweep. Defaults to the patient's pH.")
+    shocked: Optional[List[bool]] = Field(
+        default=None, description="The shocked values to sweep, for example `[true, false]`. Defaults to the patient's value.")
+    insulin_infusion_rates: Optional[List[Annotated[float, Field(gt=0, le=1)]]] = Field(
+        default=None, description="The insulin rates in Units/kg/hour to sweep, for example `[0.05, 0.1]`. Defaults to the patient's rate.")
+
+    @model_validator(mode="after")
+    def check_ranges(self):
+        # the swept values must be ones the calculation endpoint would accept
+        if self.weights is not None:
+            self.weights.check_within("weight", WEIGHT_RANGE)
+        if self.pH is not None:
+            self.pH.check_within("pH", PH_RANGE)
+        return self
+
+class DKAPlanUpdate(BaseModel):
+    """
+    The observations to change in a plan. Fields which are not provided keep their previous value;
+    bicarbonate can be cleared by sending it as null.
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    weight: Optional[float] = Field(
+        default=None, ge=WEIGHT_RANGE[0], lt=WEIGHT_RANGE[1], description="The corrected weight of the child in kg.")
+    pH: Optional[float] = Field(
+        default=None, ge=PH_RANGE[0], lt=PH_RANGE[1], description="The new pH.")
+    bicarbonate: Optional[float] = Field(
+        default=None, ge=BICARBONATE_RANGE[0], lt=BICARBONATE_RANGE[1], description="The new bicarbonate in mmol/L, or null to grade on pH alone.")
+    shocked: Optional[bool] = Field(
+        default=None, description="Whether the child or young person is shocked.")
+    insulin_infusion_rate: Optional[float] = Field(
+        default=None, gt=0, le=1, description="The new insulin infusion rate in Units/kg/hour.")
+
+    @model_validator(mode="after")
+    def check_nulls(self):
+        # only bicarbonate is optional in the request parameters, so only it can be cleared
+        for name in self.model_fields_set - {"bicarbonate"}:
+            if getattr(self, name) is None:
+                raise ValueError(f"The {name} cannot be cleared, only changed.")
+        return self
+
+    def changes(self) -> dict:
+        """
+        Returns the observations sent, including a bicarbonate sent as null
+        """
+        return {name: getattr(self, name) for name in self.model_fields_set}
+
+class DKAPlanRevisionRequest(BaseModel):
+    """
+    A plan to revise, either by the plan_id returned by a previous revision or by its full request
+    parameters in previous, and the observations to change in it.
+    """
+    plan_id: Optional[str] = Field(
+        default=None, description="The plan_id returned by a previous revision, which holds its signed request parameters.")
+    previous: Optional[ChildStatusRequestParameters] = Field(
+        default=None, description="The request parameters of the previous plan, if it has no plan_id.")
+    update: DKAPlanUpdate = Field(
+        default_factory=DKAPlanUpdate, description="The observations to change. With no changes the previous plan is returned with a plan_id.")
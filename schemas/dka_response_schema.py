@@ -1,9 +1,8 @@
 # standard imports
-from datetime import date, datetime
-from typing import Optional, Literal, Union, List
+from typing import Dict, Optional, Union, List
 
 # third party imports
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel
 
 class DeficitPercentage(BaseModel):
     deficit_percentage_output: float
@@ -54,6 +53,16 @@ class InsulinInfusionRate(BaseModel):
     insulin_infusion_rate_formula: str
     insulin_infusion_rate_limit: str
 
+class DKALimitWarning(BaseModel):
+    """
+    A calculated output above its warning ceiling for the guideline version
+    """
+    output: str
+    level: str
+    value: float
+    ceiling: float
+    message: str
+
 class DKACalculationResponse(BaseModel):
     deficit_percentage: DeficitPercentage
     deficit_volume: DeficitVolume
@@ -63,8 +72,81 @@ class DKACalculationResponse(BaseModel):
     maintenance_rate: MaintenanceRate
     starting_fluid_rate: StartingFluidRate
     insulin_infusion_rate: InsulinInfusionRate
-
-
-
-
-
+    limit_warnings: List[DKALimitWarning] = []
+
+class DKACompactCalculationResponse(BaseModel):
+    """
+    The calculated values only, without working or formulae, for machine clients.
+    """
+    deficit_percentage: float
+    deficit_volume: float
+    bolus_volume: float
+    deficit_volume_less_bolus_volume: float
+    daily_maintenance_volume: float
+    maintenance_rate: float
+    starting_fluid_rate: float
+    insulin_infusion_rate: float
+    limit_warnings: List[DKALimitWarning] = []
+
+class DKABatchCalculationItem(BaseModel):
+    index: int
+    result: Optional[Union[DKACalculationResponse, DKACompactCalculationResponse]] = None
+    error: Optional[str] = None
+
+class DKABatchCalculationResponse(BaseModel):
+    results: List[DKABatchCalculationItem]
+
+class DKAScheduleHour(BaseModel):
+    """
+    The infusion for one hour of the schedule. Cumulative volumes and the deficit remaining are at the end of the hour.
+    """
+    hour: int
+    fluid_rate: float
+    maintenance_rate: float
+    deficit_replacement_rate: float
+    cumulative_fluid_volume: float
+    cumulative_maintenance_volume: float
+    deficit_remaining: float
+    insulin_infusion_rate: float
+    cumulative_insulin: float
+
+class DKAScheduleResponse(BaseModel):
+    start_hour: int
+    end_hour: int
+    hours: List[DKAScheduleHour]
+
+class DKAScenarioSweepAxes(BaseModel):
+    weight: List[float]
+    pH: List[float]
+    shocked: List[bool]
+    insulin_infusion_rate: List[float]
+
+class DKAScenarioSweepResponse(BaseModel):
+    """
+    The calculated values for every combination of the swept inputs, as nested lists indexed
+    [weight][pH][shocked][insulin_infusion_rate] in the order of the axes.
+    Values which cannot be calculated are null.
+    """
+    axes: DKAScenarioSweepAxes
+    shape: List[int]
+    deficit_percentage: list
+    deficit_volume: list
+    starting_fluid_rate: list
+    insulin_infusion_rate: list
+    # 0 within limits, 1 above the warning ceiling, 2 above the error ceiling
+    limit_level: list
+
+class DKAOutputChange(BaseModel):
+    previous: float
+    revised: float
+
+class DKAPlanRevisionResponse(BaseModel):
+    """
+    The revised plan, with its plan_id for the next revision, the stages recalculated and the
+    calculated values which changed.
+    """
+    plan_id: str
+    previous_plan_id: Optional[str] = None
+    recalculated_stages: List[str]
+    changes: Dict[str, DKAOutputChange]
+    plan: Union[DKACalculationResponse, DKACompactCalculationResponse]
@@ -0,0 +1 @@
+from .config import ServerConfig, load_config
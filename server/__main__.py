@@ -0,0 +1,38 @@
+"""
+Production server, run from the project root:
+
+    python -m server [--print-config]
+
+Starts one uvicorn worker per available CPU with uvloop and httptools, debug mode off, the fast
+JSON encoder and the precomputed OpenAPI specification. See server/config.py for the settings.
+"""
+# Standard imports
+import os
+import sys
+
+# Third party imports
+import uvicorn
+
+# local imports
+from server.config import PRODUCTION_APP_ENVIRONMENT, apply_production_app_environment, load_config
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+
+    # set before the workers import the app, as the app reads its settings at import time
+    apply_production_app_environment()
+    config = load_config()
+
+    if "--print-config" in argv:
+        print(config)
+        for name in PRODUCTION_APP_ENVIRONMENT:
+            print(f"{name}={os.environ[name]}")
+        return 0
+
+    uvicorn.run("main:app", **config.uvicorn_options())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Production server configuration
+
+Settings are read from environment variables so that the same image can be tuned per deployment:
+
+    DKA_WORKERS             worker processes (default: the CPUs available to this process)
+    DKA_HOST                interface to bind (default 0.0.0.0)
+    DKA_PORT                port to bind (default 8000)
+    DKA_BACKLOG             maximum queued connections (default 2048)
+    DKA_KEEP_ALIVE_SECONDS  seconds an idle keep-alive connection is held open (default 5)
+    DKA_LIMIT_CONCURRENCY   connections per worker before 503 responses (default unlimited)
+    DKA_LIMIT_MAX_REQUESTS  requests a worker serves before it is restarted (default unlimited)
+    DKA_SERVER_LOG_LEVEL    uvicorn's own log level (default warning)
+    DKA_FORWARDED_ALLOW_IPS comma separated proxy addresses trusted to set X-Forwarded-For and
+                            X-Forwarded-Proto (default 127.0.0.1)
+    DKA_CORS_ORIGINS        comma separated origins allowed to call the API from a browser
+                            (default none, unlike the development default of any origin)
+    DKA_PLAN_TOKEN_SECRET   secret signing the plan_id of revised plans (default a random secret
+                            shared by the workers of this server only, so set it when several
+                            servers or pods share the traffic)
+"""
+# Standard imports
+import math
+import os
+import secrets
+from pathlib import Path
+from typing import Optional
+
+# app settings which the production profile changes from their development defaults.
+# Each can still be overridden by setting it in the environment.
+PRODUCTION_APP_ENVIRONMENT = {
+    # browsers may only call the API cross-origin from origins the deployment lists
+    "DKA_CORS_ORIGINS": "",
+    "DKA_DEBUG": "false",
+    "DKA_FAST_JSON": "true",
+    "DKA_PRECOMPUTED_OPENAPI": "true",
+}
+
+CGROUP_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+
+
+def _optional_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def cgroup_cpu_limit(path: Path = CGROUP_CPU_MAX) -> Optional[int]:
+    """
+    Returns the CPU quota of the container (cgroup v2) rounded up to whole CPUs, or None if unlimited
+    """
+    try:
+        quota, period = path.read_text().split()
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return max(1, math.ceil(int(quota) / int(period)))
+
+
+def available_cpus() -> int:
+    """
+    Returns the number of CPUs this process may run on, allowing for CPU affinity and container quotas
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, limit)
+    return cpus
+
+
+class ServerConfig:
+    """
+    uvicorn settings for the production profile
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        backlog: int = 2048,
+        keep_alive_seconds: int = 5,
+        limit_concurrency: Optional[int] = None,
+        limit_max_requests: Optional[int] = None,
+        log_level: str = "warning",
+        forwarded_allow_ips: str = "127.0.0.1",
+    ):
+        if workers < 1:
+            raise Exception(f"At least one worker is required, not {workers}.")
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.keep_alive_seconds = keep_alive_seconds
+        self.limit_concurrency = limit_concurrency
+        self.limit_max_requests = limit_max_requests
+        self.log_level = log_level
+        self.forwarded_allow_ips = forwarded_allow_ips
+
+    def uvicorn_options(self) -> dict:
+        """
+        Returns the keyword arguments for uvicorn.run
+        """
+        return {
+            "host": self.host,
+            "port": self.port,
+            "workers": self.workers,
+            # the C event loop and HTTP parser from uvicorn[standard]
+            "loop": "uvloop",
+            "http": "httptools",
+            "backlog": self.backlog,
+            "timeout_keep_alive": self.keep_alive_seconds,
+            "limit_concurrency": self.limit_concurrency,
+            "limit_max_requests": self.limit_max_requests,
+            "log_level": self.log_level,
+            # requests are logged by the app itself
+            "access_log": False,
+            # X-Forwarded-For is only believed from the proxies listed, so clients cannot spoof their address
+            "proxy_headers": True,
+            "forwarded_allow_ips": self.forwarded_allow_ips,
+        }
+
+    def __repr__(self):
+        options = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"ServerConfig({options})"
+
+
+def load_config() -> ServerConfig:
+    """
+    Returns the server configuration from the environment
+    """
+    return ServerConfig(
+        workers=int(os.getenv("DKA_WORKERS", 0)) or available_cpus(),
+        host=os.getenv("DKA_HOST", "0.0.0.0"),
+        port=int(os.getenv("DKA_PORT", 8000)),
+        backlog=int(os.getenv("DKA_BACKLOG", 2048)),
+        keep_alive_seconds=int(os.getenv("DKA_KEEP_ALIVE_SECONDS", 5)),
+        limit_concurrency=_optional_int("DKA_LIMIT_CONCURRENCY"),
+        limit_max_requests=_optional_int("DKA_LIMIT_MAX_REQUESTS"),
+        log_level=os.getenv("DKA_SERVER_LOG_LEVEL", "warning"),
+        forwarded_allow_ips=os.getenv("DKA_FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    )
+
+
+def apply_production_app_environment():
+    """
+    Sets the production app settings in the environment, which the worker processes inherit,
+    leaving any that are already set unchanged
+    """
+    for name, value in PRODUCTION_APP_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    # every worker must verify the plan_ids the others issue, so they share one secret
+    os.environ.setdefault("DKA_PLAN_TOKEN_SECRET", secrets.token_hex(32))
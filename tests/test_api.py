@@ -0,0 +1,180 @@
+"""
+Checks the API's request handling: Accept header negotiation, NDJSON line limits, signed plan_ids
+and the refusals of the calculation, revision, schedule and sweep endpoints.
+"""
+# Standard imports
+import asyncio
+import time
+
+# Third party imports
+import pytest
+from fastapi.testclient import TestClient
+
+# local imports
+from main import app
+from utilities import plan_tokens, serialisation
+from utilities.streaming import MAXIMUM_NDJSON_LINE_BYTES, ndjson_lines
+
+PRESENTATION = {
+    "birth_date": "2015-04-12",
+    "resuscitation_start_date_time": "2022-02-06",
+    "sex": "female",
+    "weight": 23,
+    "pH": 6.86,
+    "shocked": True,
+    "insulin_infusion_rate": 0.05
+}
+
+client = TestClient(app)
+
+
+# Accept header negotiation
+@pytest.mark.parametrize("accept, media_type", [
+    (None, serialisation.JSON_MEDIA_TYPE),
+    ("", serialisation.JSON_MEDIA_TYPE),
+    ("*/*", serialisation.JSON_MEDIA_TYPE),
+    ("application/json, application/msgpack;q=0.1", serialisation.JSON_MEDIA_TYPE),
+    ("application/msgpack, application/json", serialisation.MSGPACK_MEDIA_TYPE),
+    ("application/json;q=0.5, application/x-msgpack", serialisation.MSGPACK_MEDIA_TYPE),
+    ("application/json;q=0, */*", serialisation.MSGPACK_MEDIA_TYPE),
+    ("application/vnd.dka.compact+json", serialisation.JSON_MEDIA_TYPE),
+    ("application/x-dka-plan;q=0.9, application/json;q=0.8", serialisation.PLAN_RECORD_MEDIA_TYPE),
+    ("application/msgpack;q=0", None),
+    ("application/json;q=2", None),
+    ("text/html", None),
+])
+def test_select_media_type_weighs_quality_values(accept, media_type):
+    assert serialisation.select_media_type(accept, media_types=list(serialisation.MEDIA_TYPE_NAMES)) == media_type
+
+def test_select_media_type_falls_back_to_json_without_msgpack():
+    media_types = [serialisation.JSON_MEDIA_TYPE, serialisation.PLAN_RECORD_MEDIA_TYPE]
+    assert serialisation.select_media_type("application/msgpack, application/json;q=0.5", media_types=media_types) == serialisation.JSON_MEDIA_TYPE
+    assert serialisation.select_media_type("application/msgpack", media_types=media_types) is None
+
+def test_unacceptable_media_type_returns_406():
+    response = client.post("/dka/calculation", json=PRESENTATION, headers={"accept": "text/html"})
+    assert response.status_code == 406
+
+def test_compact_media_type_must_be_named():
+    assert "deficit_percentage" in client.post("/dka/calculation", json=PRESENTATION, headers={"accept": "*/*"}).json()
+    compact = client.post("/dka/calculation", json=PRESENTATION, headers={"accept": "application/vnd.dka.compact+json"}).json()
+    assert compact["deficit_percentage"] == 10
+
+
+# NDJSON line limits
+def read_lines(*chunks) -> list:
+    async def byte_stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [line async for line in ndjson_lines(byte_stream())]
+
+    return asyncio.run(collect())
+
+def test_ndjson_lines_split_across_chunks():
+    assert read_lines(b'{"a": 1}\n{"b"', b': 2}\n\n', b'{"c": 3}') == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+@pytest.mark.parametrize("chunks", [
+    # a long line with no newline
+    (b"x" * (MAXIMUM_NDJSON_LINE_BYTES + 1),),
+    # a long line after a newline in the same chunk
+    (b"{}\n" + b"x" * (MAXIMUM_NDJSON_LINE_BYTES + 1),),
+    # a long line ended in the same chunk
+    (b"x" * (MAXIMUM_NDJSON_LINE_BYTES + 1) + b"\n{}\n",),
+    # a long line built up over several chunks
+    (b"{}\n" + b"x" * MAXIMUM_NDJSON_LINE_BYTES, b"x"),
+])
+def test_ndjson_lines_longer_than_the_maximum_raise(chunks):
+    with pytest.raises(ValueError, match="longer than"):
+        read_lines(*chunks)
+
+
+# signed plan_ids
+PLAN_VALUES = {"guideline": "v1", "age": 7}
+
+def test_plan_token_round_trip():
+    token = plan_tokens.encode_plan_token(PRESENTATION, PLAN_VALUES)
+    assert plan_tokens.decode_plan_token(token) == (PRESENTATION, PLAN_VALUES)
+
+def test_altered_plan_token_is_rejected():
+    payload, _, signature = plan_tokens.encode_plan_token(PRESENTATION, PLAN_VALUES).partition(".")
+    other_payload, _, _ = plan_tokens.encode_plan_token(dict(PRESENTATION, weight=230), PLAN_VALUES).partition(".")
+    for token in (f"{other_payload}.{signature}", f"{payload}.{signature[:-2]}xx", payload, "", "é.ü"):
+        with pytest.raises(plan_tokens.InvalidPlanToken):
+            plan_tokens.decode_plan_token(token)
+
+def test_plan_token_signed_with_another_secret_is_rejected(monkeypatch):
+    token = plan_tokens.encode_plan_token(PRESENTATION, PLAN_VALUES)
+    monkeypatch.setattr(plan_tokens, "plan_token_secret", b"another secret")
+    with pytest.raises(plan_tokens.InvalidPlanToken):
+        plan_tokens.decode_plan_token(token)
+
+def test_expired_plan_token_is_rejected():
+    token = plan_tokens.encode_plan_token(PRESENTATION, PLAN_VALUES, issued=time.time() - plan_tokens.plan_token_ttl_seconds - 1)
+    with pytest.raises(plan_tokens.InvalidPlanToken, match="expired"):
+        plan_tokens.decode_plan_token(token)
+
+
+# refusals
+def test_insulin_rate_above_the_error_ceiling_is_refused():
+    response = client.post("/dka/calculation", json=dict(PRESENTATION, insulin_infusion_rate=1))
+    assert response.status_code == 422
+    assert [breach["output"] for breach in response.json()["detail"]] == ["insulin_infusion_rate"]
+    assert client.post("/dka/calculation", json=dict(PRESENTATION, insulin_infusion_rate=5)).status_code == 422
+
+def test_revision_by_plan_id():
+    first = client.post("/dka/calculation/revision", json={"previous": PRESENTATION, "update": {"pH": 7.15}}).json()
+    revised = client.post("/dka/calculation/revision", json={"plan_id": first["plan_id"], "update": {"insulin_infusion_rate": 0.1}})
+    assert revised.status_code == 200
+    assert revised.json()["recalculated_stages"] == ["insulin"]
+    assert revised.json()["plan"] == client.post("/dka/calculation", json=dict(PRESENTATION, pH=7.15, insulin_infusion_rate=0.1)).json()
+
+@pytest.mark.parametrize("update", [{"sex": "male"}, {"pH": None}, {"pH": 6.3}])
+def test_revision_refuses_bad_updates(update):
+    assert client.post("/dka/calculation/revision", json={"previous": PRESENTATION, "update": update}).status_code == 422
+
+@pytest.mark.parametrize("changes", [{"birth_date": "2023-01-01"}, {"birth_date": "2000-01-01", "weight": None}])
+def test_age_without_a_reference_weight_is_refused(changes):
+    assert client.post("/dka/calculation", json=dict(PRESENTATION, **changes)).status_code == 422
+
+def test_reversed_schedule_window_is_refused():
+    assert client.post("/dka/calculation/schedule?start_hour=12&end_hour=6", json=PRESENTATION).status_code == 422
+
+def test_sweep_size_is_checked_before_the_ranges_are_built():
+    started = time.perf_counter()
+    response = client.post("/dka/calculations:sweep", json={"patient": PRESENTATION, "weights": {"start": 0.5, "stop": 219, "step": 1e-9}})
+    assert response.status_code == 422
+    assert time.perf_counter() - started < 1
+
+@pytest.mark.parametrize("weights", [{"start": -5, "stop": 10, "step": 1}, {"start": 10, "stop": 5, "step": 1}, {"start": 10, "stop": 20, "step": 0}])
+def test_sweep_ranges_are_bounded(weights):
+    assert client.post("/dka/calculations:sweep", json={"patient": PRESENTATION, "weights": weights}).status_code == 422
+
+def test_plan_records_are_cached_by_severity(monkeypatch):
+    # as in guidelines which give mild and moderate DKA the same deficit percentage
+    from dka_calculator import dka_calculator
+    from utilities.calculation_cache import calculation_cache
+
+    monkeypatch.setattr(dka_calculator.get_guideline("v1"), "deficit_percentages", (5, 5, 10))
+    calculation_cache.clear()
+    severities = []
+    try:
+        for pH in (7.15, 7.25):
+            response = client.post("/dka/calculation", json=dict(PRESENTATION, pH=pH), headers={"accept": serialisation.PLAN_RECORD_MEDIA_TYPE})
+            record = serialisation.decode_plan_record(response.content)
+            assert record["deficit_percentage"] == 5
+            severities.append(record["severity"])
+    finally:
+        # the bodies were calculated with the altered guideline
+        calculation_cache.clear()
+    assert severities == [1, 0]
+
+def test_batch_size_is_limited(monkeypatch):
+    from routes import dka_calculations
+
+    monkeypatch.setattr(dka_calculations, "MAXIMUM_BATCH_ITEMS", 2)
+    assert client.post("/dka/calculations:batch", json=[PRESENTATION] * 2).status_code == 200
+    response = client.post("/dka/calculations:batch", json=[PRESENTATION] * 3)
+    assert response.status_code == 422
+    assert "/dka/calculations:stream" in response.json()["detail"]
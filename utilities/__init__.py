@@ -0,0 +1 @@
+from .calculation_cache import CalculationCache, calculation_cache
@@ -0,0 +1,314 @@
+"""
+Calculation audit store
+
+With DKA_AUDIT_DATABASE set to a file path, every plan returned by the calculation endpoints is
+recorded with its request parameters, guideline version and a timestamp in an append-only SQLite
+database in WAL mode. Requests only put the record on a bounded queue, which never blocks: a
+background thread takes records off the queue and writes them in batches of up to
+DKA_AUDIT_BATCH_SIZE (default 500), at least every DKA_AUDIT_FLUSH_SECONDS (default 1), with one
+transaction, and so one sync, per batch. If the queue (DKA_AUDIT_QUEUE_SIZE, default 10000) is
+full the record is dropped and counted, as the logging queue does.
+Identifying fields of the request parameters (DKA_AUDIT_REDACT_FIELDS, comma separated, default
+birth_date) are redacted before they are stored, and again when records are read back.
+GET /dka/audit is only available when DKA_AUDIT_TOKEN is set, to clients sending it as a bearer token.
+A batch which cannot be written, for example while another worker holds the database locked, is
+retried up to DKA_AUDIT_WRITE_ATTEMPTS times (default 3) and then logged and counted as failed,
+and the writer carries on with the next batch.
+"""
+# Standard imports
+from datetime import date, datetime, timezone
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Union
+
+# Third party imports
+from pydantic import BaseModel
+
+# local imports
+from utilities.structured_logging import redact
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calculation_audit (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    response_mode TEXT NOT NULL,
+    guideline_version TEXT NOT NULL,
+    request TEXT NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calculation_audit_recorded_at ON calculation_audit (recorded_at);
+"""
+
+INSERT = """
+INSERT INTO calculation_audit (recorded_at, endpoint, response_mode, guideline_version, request, response)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# put on the queue to stop the writer once it has written everything before it
+_STOP = object()
+
+logger = logging.getLogger("dka.audit")
+
+
+def _timestamp(seconds: float) -> str:
+    # a fixed width UTC format, so the text order of recorded_at is its time order
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return dict(value)
+    return str(value)
+
+
+def _encode(value) -> str:
+    if callable(value):
+        # responses in binary formats are passed as a function which decodes them
+        value = value()
+    if isinstance(value, bytes):
+        # response bodies are already encoded JSON
+        return value.decode("utf-8")
+    if isinstance(value, BaseModel):
+        value = dict(value)
+    return json.dumps(value, default=_json_default, separators=(",", ":"))
+
+
+class AuditStore:
+    """
+    An append-only SQLite store of calculations, written in batches by a background thread
+    """
+
+    def __init__(
+        self,
+        path: str,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_seconds: float = 1.0,
+        write_attempts: int = 3,
+        redact_fields: tuple = ("birth_date",)
+    ):
+        self.path = path
+        self.redact_fields = frozenset(redact_fields)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.write_attempts = max(write_attempts, 1)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed = 0
+        self.failed_batches = 0
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode NORMAL syncs at checkpoints rather than on every commit, and committed
+        # batches still survive an application crash
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._write_batches, name="dka-audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        Writes every queued record and stops the writer. Never blocks on a full queue: the writer
+        also stops once the queue is empty after the stop flag is set.
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            # wakes the writer if it is waiting on an empty queue
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def record(
+        self,
+        request_parameters: Union[BaseModel, dict],
+        response: Union[bytes, dict, Callable],
+        guideline_version: str,
+        endpoint: str,
+        response_mode: str = "full"
+    ) -> None:
+        """
+        Queues a calculation for writing. Encoding happens on the writer thread, so this costs
+        a queue put. If the queue is full the record is dropped and counted.
+        The response is a JSON body, JSON data, or a function returning either, which is called
+        on the writer thread.
+        """
+        try:
+            self._queue.put_nowait((time.time(), endpoint, response_mode, guideline_version, request_parameters, response))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_batches(self) -> None:
+        connection = None
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    break
+                continue
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            connection = self._write_with_retries(connection, batch)
+        if connection is not None:
+            connection.close()
+
+    def _write_with_retries(self, connection: Optional[sqlite3.Connection], batch: list) -> Optional[sqlite3.Connection]:
+        """
+        Writes the batch, reconnecting and retrying if the database cannot be written, and returns
+        the connection to use for the next batch. A batch which still fails is logged and counted,
+        so that one error never stops the writer.
+        """
+        rows = self._encode_rows(batch)
+        if not rows:
+            return connection
+        for attempt in range(1, self.write_attempts + 1):
+            try:
+                if connection is None:
+                    connection = self.connect()
+                self._write(connection, rows)
+                return connection
+            except Exception:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                if attempt == self.write_attempts:
+                    logger.exception("Audit batch of %s records could not be written", len(rows))
+                    self.failed += len(rows)
+                    self.failed_batches += 1
+                    return None
+                # such as another worker holding the database locked
+                time.sleep(0.1 * attempt)
+        return connection
+
+    def _encode_rows(self, batch: list) -> list:
+        rows = []
+        for recorded_at, endpoint, response_mode, guideline_version, request_parameters, response in batch:
+            try:
+                rows.append((
+                    _timestamp(recorded_at),
+                    endpoint,
+                    response_mode,
+                    guideline_version,
+                    _encode(redact(request_parameters, self.redact_fields)),
+                    _encode(response)
+                ))
+            except Exception:
+                # one record which cannot be encoded does not fail the rest of its batch
+                logger.exception("Audit record from the %s endpoint could not be encoded", endpoint)
+                self.failed += 1
+        return rows
+
+    def _write(self, connection: sqlite3.Connection, rows: list) -> None:
+        # one transaction per batch
+        with connection:
+            connection.executemany(INSERT, rows)
+        self.written += len(rows)
+        self.batches += 1
+
+    def query(self, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 100, after_id: int = 0) -> list:
+        """
+        Returns the recorded calculations from start (inclusive) to end (exclusive), in the order they were recorded.
+        Naive datetimes are taken as UTC. after_id continues from the last id of a previous page.
+        """
+        clauses = ["id > ?"]
+        parameters = [after_id]
+        if start is not None:
+            clauses.append("recorded_at >= ?")
+            parameters.append(_timestamp(_as_utc(start).timestamp()))
+        if end is not None:
+            clauses.append("recorded_at < ?")
+            parameters.append(_timestamp(_as_utc(end).timestamp()))
+        parameters.append(limit)
+
+        connection = sqlite3.connect(self.path)
+        try:
+            rows = connection.execute(
+                "SELECT id, recorded_at, endpoint, response_mode, guideline_version, request, response "
+                f"FROM calculation_audit WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+                parameters
+            ).fetchall()
+        finally:
+            connection.close()
+
+        return [
+            {
+                "id": row[0],
+                "recorded_at": row[1],
+                "endpoint": row[2],
+                "response_mode": row[3],
+                "guideline_version": row[4],
+                # records written before a field was redacted are redacted as they are read
+                "request": redact(json.loads(row[5]), self.redact_fields),
+                "response": json.loads(row[6]),
+            }
+            for row in rows
+        ]
+
+    def statistics(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "failed_batches": self.failed_batches,
+        }
+
+
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+_path = os.getenv("DKA_AUDIT_DATABASE")
+# the bearer token GET /dka/audit requires; the records cannot be read over the API without one
+audit_token = os.getenv("DKA_AUDIT_TOKEN") or None
+audit_store = AuditStore(
+    path=_path,
+    queue_size=int(os.getenv("DKA_AUDIT_QUEUE_SIZE", 10000)),
+    batch_size=int(os.getenv("DKA_AUDIT_BATCH_SIZE", 500)),
+    flush_seconds=float(os.getenv("DKA_AUDIT_FLUSH_SECONDS", 1.0)),
+    write_attempts=int(os.getenv("DKA_AUDIT_WRITE_ATTEMPTS", 3)),
+    redact_fields=tuple(field.strip() for field in os.getenv("DKA_AUDIT_REDACT_FIELDS", "birth_date").split(",") if field.strip())
+) if _path else None
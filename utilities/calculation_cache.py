@@ -0,0 +1,89 @@
+"""
+Calculation cache
+"""
+# Standard imports
+from collections import OrderedDict
+import os
+from threading import Lock
+import time
+from typing import Hashable, Optional
+
+
+class CalculationCache:
+    """
+    A bounded LRU cache with a time to live, holding pre-rendered response bodies
+    (JSON, MessagePack or plan records) keyed on normalised clinical inputs and media type.
+    Setting max_size or ttl_seconds to 0 disables the cache.
+    The hit, miss, eviction and expiration counters are exposed through statistics().
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl_seconds > 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """
+        Returns the cached body for this key, or None if absent or expired
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, body = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key: Hashable, body: bytes) -> None:
+        """
+        Stores a body against this key, evicting the least recently used entry if full
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def statistics(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+calculation_cache = CalculationCache(
+    max_size=int(os.getenv("DKA_CACHE_MAX_SIZE", 1024)),
+    ttl_seconds=float(os.getenv("DKA_CACHE_TTL_SECONDS", 300))
+)
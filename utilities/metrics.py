@@ -0,0 +1,189 @@
+"""
+Metrics in the Prometheus text exposition format
+"""
+# Standard imports
+from bisect import bisect_left
+import os
+from threading import Lock
+import time
+
+# Third party imports
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# latency buckets in seconds, from the sub-millisecond calculation stages up to slow requests
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # one count per bucket, plus +Inf, then the sum
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics and any collector functions, which are called at render time
+    and return (name, type, documentation, value) tuples for values owned elsewhere.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, documentation, value in collector():
+                lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+metrics_enabled = os.getenv("DKA_METRICS", "true").lower() in ("true", "1", "yes")
+stage_timing_enabled = os.getenv("DKA_METRICS_STAGE_TIMING", "false").lower() in ("true", "1", "yes")
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "dka_http_requests_total", "HTTP requests by method, route and status code.", ("method", "route", "status")
+)
+http_request_duration = registry.histogram(
+    "dka_http_request_duration_seconds", "HTTP request latency by method and route.", ("method", "route")
+)
+validation_failures = registry.counter(
+    "dka_validation_failures_total", "Requests rejected by request validation, by route.", ("route",)
+)
+limit_refusals = registry.counter(
+    "dka_limit_refusals_total", "Calculations refused because an output was above its safety limit error ceiling, by route.", ("route",)
+)
+unhandled_errors = registry.counter(
+    "dka_unhandled_errors_total", "Unhandled exceptions by route and exception type.", ("route", "exception")
+)
+calculation_stage_duration = registry.histogram(
+    "dka_calculation_stage_duration_seconds", "Time spent in each stage of the calculation.", ("stage",)
+)
+
+# set in the request scope by a response refusing a calculation on its safety limits, so that its 422
+# is counted as a limit refusal rather than a validation failure
+LIMIT_REFUSAL_SCOPE_KEY = "dka.limit_refusal"
+
+
+class MetricsMiddleware:
+    """
+    Records request counts, latency, validation failures, limit refusals and unhandled exceptions for each route.
+    Routes are labelled by their path template so that path parameters do not create new series.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as error:
+            unhandled_errors.inc(self._route(scope), type(error).__name__)
+            raise
+        finally:
+            route = self._route(scope)
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route)
+            http_requests.inc(scope["method"], route, str(status_code))
+            if status_code == 422:
+                if scope.get(LIMIT_REFUSAL_SCOPE_KEY):
+                    limit_refusals.inc(route)
+                else:
+                    validation_failures.inc(route)
+
+    @staticmethod
+    def _route(scope: Scope) -> str:
+        route = scope.get("route")
+        return getattr(route, "path", "unmatched")
+
+
+def observe_stage_timings(stage_timings: dict) -> None:
+    """
+    Records the nanosecond stage timings returned by the calculation
+    """
+    for stage, nanoseconds in stage_timings.items():
+        calculation_stage_duration.observe(nanoseconds / 1e9, stage)
@@ -0,0 +1,66 @@
+"""
+Offload policy
+
+The calculation endpoints are coroutines which calculate inline on the event loop: a single plan is
+microseconds of arithmetic, less than the cost of handing it to a thread. Batches and sweeps large
+enough to hold up the other requests on the loop are sent to a bounded pool instead.
+
+- DKA_OFFLOAD_POOL: `thread` (default), `process`, or `none` to run everything inline
+- DKA_OFFLOAD_WORKERS: the size of the pool (default the number of CPUs, at most 4)
+- DKA_OFFLOAD_BATCH_ITEMS: batches of at least this many items are offloaded (default 100)
+- DKA_OFFLOAD_SWEEP_POINTS: sweeps of at least this many combinations are offloaded (default 10000)
+- DKA_OFFLOAD_CALCULATIONS: also offload single calculations (default false), for comparison
+"""
+# Standard imports
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import os
+from typing import Callable, Optional
+
+OFFLOAD_POOLS = ("thread", "process", "none")
+
+offload_pool = os.getenv("DKA_OFFLOAD_POOL", "thread").lower()
+if offload_pool not in OFFLOAD_POOLS:
+    raise Exception(f"DKA_OFFLOAD_POOL must be one of {', '.join(OFFLOAD_POOLS)}, not {offload_pool!r}.")
+offload_workers = int(os.getenv("DKA_OFFLOAD_WORKERS", min(4, os.cpu_count() or 1)))
+offload_batch_items = int(os.getenv("DKA_OFFLOAD_BATCH_ITEMS", 100))
+offload_sweep_points = int(os.getenv("DKA_OFFLOAD_SWEEP_POINTS", 10000))
+offload_calculations = os.getenv("DKA_OFFLOAD_CALCULATIONS", "false").lower() in ("true", "1", "yes")
+
+_executor = None
+
+
+def executor() -> Optional[Executor]:
+    """
+    Returns the offload pool, starting it on first use, or None if offloading is turned off
+    """
+    global _executor
+    if _executor is None and offload_pool != "none":
+        if offload_pool == "process":
+            _executor = ProcessPoolExecutor(max_workers=offload_workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=offload_workers, thread_name_prefix="dka-offload")
+    return _executor
+
+
+async def run(offload: bool, function: Callable, *args, **kwargs):
+    """
+    Returns function(*args, **kwargs), run in the offload pool if offload is true and there is one,
+    otherwise inline. Work sent to a process pool must be a module level function whose arguments
+    and result can be pickled, and any module state it changes is changed in the worker process.
+    """
+    pool = executor() if offload else None
+    if pool is None:
+        return function(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(pool, functools.partial(function, *args, **kwargs))
+
+
+def shutdown() -> None:
+    """
+    Waits for offloaded work to finish and stops the pool
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,115 @@
+"""
+Precomputed OpenAPI specification
+
+The specification is generated at build time and saved as openapi.json in the project root:
+
+    python -m utilities.openapi          writes openapi.json if it has changed
+    python -m utilities.openapi --check  exits non-zero if openapi.json is out of date
+
+With DKA_PRECOMPUTED_OPENAPI=true the app loads this file at startup instead of generating
+the specification from its routes when it is first requested.
+Either way the specification is served as pre-encoded bytes with a strong ETag, so repeated
+requests cost neither serialisation nor, with If-None-Match, the body.
+"""
+# Standard imports
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
+from typing import Optional
+
+OPENAPI_FILE = Path(os.getenv("DKA_OPENAPI_FILE", Path(__file__).resolve().parent.parent / "openapi.json"))
+
+precomputed_openapi_enabled = os.getenv("DKA_PRECOMPUTED_OPENAPI", "false").lower() in ("true", "1", "yes")
+
+OPENAPI_CACHE_CONTROL = f"public, max-age={int(os.getenv('DKA_OPENAPI_MAX_AGE', 300))}"
+
+
+class EncodedOpenAPI:
+    """
+    The serialised specification and its strong ETag
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        Returns True if an If-None-Match header value matches this ETag
+        """
+        if if_none_match is None:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+            if tag == "*" or tag.removeprefix("W/") == self.etag:
+                return True
+        return False
+
+
+def serialise_openapi(openapi_schema: dict) -> str:
+    return json.dumps(openapi_schema, indent=4) + "\n"
+
+
+def load_openapi(version: str, path: Path = OPENAPI_FILE) -> Optional[dict]:
+    """
+    Returns the precomputed specification, or None if there is no file or it was built for another version
+    """
+    if not path.exists():
+        return None
+    openapi_schema = json.loads(path.read_text(encoding="utf-8"))
+    if openapi_schema.get("info", {}).get("version") != version:
+        return None
+    return openapi_schema
+
+
+def encode_openapi(openapi_schema: dict) -> EncodedOpenAPI:
+    return EncodedOpenAPI(serialise_openapi(openapi_schema).encode("utf-8"))
+
+
+def load_encoded_openapi(version: str, path: Path = OPENAPI_FILE) -> Optional[EncodedOpenAPI]:
+    """
+    Returns the precomputed specification file's bytes unchanged, or None if there is no file
+    or it was built for another version
+    """
+    if load_openapi(version=version, path=path) is None:
+        return None
+    return EncodedOpenAPI(path.read_bytes())
+
+
+def write_openapi(openapi_schema: dict, path: Path = OPENAPI_FILE) -> bool:
+    """
+    Writes the specification to file if it differs from the file's content. Returns True if written.
+    """
+    serialised = serialise_openapi(openapi_schema)
+    if path.exists() and path.read_text(encoding="utf-8") == serialised:
+        return False
+    path.write_text(serialised, encoding="utf-8")
+    return True
+
+
+def main(argv=None) -> int:
+    # imported here so that importing this module from the app does not import the app
+    from main import generate_openapi_schema
+
+    argv = sys.argv[1:] if argv is None else argv
+    openapi_schema = generate_openapi_schema()
+
+    if "--check" in argv:
+        if not OPENAPI_FILE.exists() or OPENAPI_FILE.read_text(encoding="utf-8") != serialise_openapi(openapi_schema):
+            print(f"{OPENAPI_FILE} is out of date: run python -m utilities.openapi", file=sys.stderr)
+            return 1
+        print(f"{OPENAPI_FILE} is up to date")
+        return 0
+
+    if write_openapi(openapi_schema):
+        print(f"Wrote {OPENAPI_FILE}")
+    else:
+        print(f"Generated internal openAPI3 spec and {OPENAPI_FILE} have equal file content")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Plan tokens
+
+The plan_id returned by the revision endpoint is the plan itself: its request parameters, its
+calculated values and the time it was issued, signed with HMAC-SHA256. Any worker holding the same
+secret can rebuild the plan from it without recalculating it, so revisions need no shared store and
+survive restarts and several workers or pods.
+
+- DKA_PLAN_TOKEN_SECRET: the signing secret. Every worker and pod serving the API must share it.
+  If it is not set, a random secret is generated; the production profile (python -m server) does
+  this once before starting its workers, so they share it, and a process started any other way
+  only accepts the tokens it issued itself.
+- DKA_PLAN_TOKEN_TTL_SECONDS: how long a token can be revised, long enough for the 48 hours of
+  treatment (default 172800)
+
+Tokens are signed, not encrypted: they hold the request parameters the client sent, including
+the birth date, and the plan's values, which the client can read back.
+"""
+# Standard imports
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+# Third party imports
+from fastapi.encoders import jsonable_encoder
+
+PLAN_TOKEN_VERSION = 2
+
+plan_token_secret = (os.getenv("DKA_PLAN_TOKEN_SECRET") or secrets.token_hex(32)).encode("utf-8")
+plan_token_ttl_seconds = float(os.getenv("DKA_PLAN_TOKEN_TTL_SECONDS", 172800))
+
+
+class InvalidPlanToken(Exception):
+    """
+    Raised for a plan token which was not issued with this secret, has been altered or has expired
+    """
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(payload: str) -> str:
+    return _encode(hmac.new(plan_token_secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def encode_plan_token(request_parameters, plan_values: dict, issued: float = None) -> str:
+    """
+    Returns the signed token of a plan's request parameters and its values(), see DKAPlan
+    """
+    content = {
+        "version": PLAN_TOKEN_VERSION,
+        "issued": int(time.time() if issued is None else issued),
+        "request": jsonable_encoder(request_parameters),
+        "plan": plan_values,
+    }
+    payload = _encode(json.dumps(content, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_signature(payload)}"
+
+
+def decode_plan_token(token: str) -> tuple:
+    """
+    Returns the request parameters and plan values of a plan token, raising InvalidPlanToken if it is not genuine or has expired
+    """
+    payload, _, signature = token.partition(".")
+    if not (payload.isascii() and signature.isascii()) or not hmac.compare_digest(signature, _signature(payload)):
+        raise InvalidPlanToken("The plan_id was not issued by this service or has been altered.")
+    content = json.loads(_decode(payload))
+    if content.get("version") != PLAN_TOKEN_VERSION:
+        raise InvalidPlanToken("The plan_id was issued by an incompatible version of this service.")
+    if time.time() - content["issued"] > plan_token_ttl_seconds:
+        raise InvalidPlanToken("The plan_id has expired.")
+    return content["request"], content["plan"]
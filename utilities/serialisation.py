@@ -0,0 +1,181 @@
+"""
+Fast JSON serialisation, and the MessagePack and binary record formats
+"""
+# Standard imports
+import json
+from operator import itemgetter
+import os
+import struct
+from typing import Any
+
+# Third party imports
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+# the compact (numbers only) response is JSON too, so accepting it accepts a JSON body
+COMPACT_MEDIA_TYPE = "application/vnd.dka.compact+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# the older unregistered name, which many MessagePack clients still send
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+PLAN_RECORD_MEDIA_TYPE = "application/x-dka-plan"
+# the names each response format is accepted under, in order of preference when the client has none
+MEDIA_TYPE_NAMES = {
+    JSON_MEDIA_TYPE: (JSON_MEDIA_TYPE, COMPACT_MEDIA_TYPE),
+    MSGPACK_MEDIA_TYPE: MSGPACK_MEDIA_TYPES,
+    PLAN_RECORD_MEDIA_TYPE: (PLAN_RECORD_MEDIA_TYPE,),
+}
+
+# The application/x-dka-plan record: 68 bytes, little-endian, with no field names.
+#   offset 0  uint8    record format version, 1
+#   offset 1  uint8    severity band: 0 mild, 1 moderate, 2 severe
+#   offset 2  uint8    limit level: 0 within limits, 1 above a warning ceiling
+#   offset 3  pad byte
+#   offset 4  float64 x 8, the outputs in the order of PLAN_RECORD_OUTPUTS
+PLAN_RECORD = struct.Struct("<BBBx8d")
+PLAN_RECORD_VERSION = 1
+PLAN_RECORD_OUTPUTS = (
+    "deficit_percentage",
+    "deficit_volume",
+    "bolus_volume",
+    "deficit_volume_less_bolus_volume",
+    "daily_maintenance_volume",
+    "maintenance_rate",
+    "starting_fluid_rate",
+    "insulin_infusion_rate",
+)
+_plan_record_values = itemgetter(*PLAN_RECORD_OUTPUTS)
+
+# With DKA_FAST_JSON=true, responses the handlers build themselves are encoded directly, without
+# validating them against their response model first. orjson is used if it is installed.
+fast_json_enabled = os.getenv("DKA_FAST_JSON", "false").lower() in ("true", "1", "yes")
+
+
+def encode_json(content: Any) -> bytes:
+    """
+    Encodes plain JSON data (dicts, lists, strings, numbers, booleans and None)
+    in the same compact UTF-8 form as FastAPI's JSONResponse
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def encode_msgpack(content: Any) -> bytes:
+    """
+    Encodes the same data as encode_json as MessagePack. Needs msgpack to be installed.
+    """
+    if msgpack is None:
+        raise Exception("MessagePack responses need msgpack to be installed.")
+    return msgpack.packb(content)
+
+
+def encode_plan_record(outputs: dict, severity: int, limit_level: int) -> bytes:
+    """
+    Packs the calculated values of a plan into an application/x-dka-plan record
+    """
+    return PLAN_RECORD.pack(PLAN_RECORD_VERSION, severity, limit_level, *_plan_record_values(outputs))
+
+
+def decode_plan_record(record: bytes) -> dict:
+    """
+    Unpacks an application/x-dka-plan record into its calculated values, severity and limit level
+    """
+    version, severity, limit_level, *values = PLAN_RECORD.unpack(record)
+    if version != PLAN_RECORD_VERSION:
+        raise Exception(f"Unknown DKA plan record version {version}.")
+    return dict(zip(PLAN_RECORD_OUTPUTS, values), severity=severity, limit_level=limit_level)
+
+
+def decode_response(body: bytes, media_type: str) -> Any:
+    """
+    Decodes a response body encoded in any of the response formats
+    """
+    if media_type == PLAN_RECORD_MEDIA_TYPE:
+        return decode_plan_record(body)
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def parse_accept(accept: str) -> list:
+    """
+    Returns the media ranges of an Accept header as (media range, quality) pairs, in the order sent.
+    A range with a quality which is not a number from 0 to 1 is given quality 0, so is not accepted.
+    """
+    ranges = []
+    for part in accept.split(","):
+        media_range, *parameters = (item.strip() for item in part.split(";"))
+        if not media_range:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+                if not 0 <= quality <= 1:
+                    quality = 0.0
+        ranges.append((media_range.lower(), quality))
+    return ranges
+
+
+def _specificity(media_range: str, media_type: str) -> int:
+    if media_range == media_type:
+        return 3
+    if media_range == media_type.split("/")[0] + "/*":
+        return 2
+    if media_range == "*/*":
+        return 1
+    return 0
+
+
+def accepted_quality(ranges: list, names: tuple) -> tuple:
+    """
+    Returns the quality the most specific media range gives any of the names, and that range's
+    position in the header, or quality 0 if no range matches
+    """
+    specificity, quality, position = 0, 0.0, len(ranges)
+    for index, (media_range, range_quality) in enumerate(ranges):
+        range_specificity = max(_specificity(media_range, name) for name in names)
+        if range_specificity > specificity:
+            specificity, quality, position = range_specificity, range_quality, index
+    return quality, position
+
+
+def is_explicitly_accepted(accept: str, media_type: str) -> bool:
+    """
+    Returns whether the Accept header names the media type itself, rather than through a wildcard, with a quality above 0
+    """
+    if accept is None:
+        return False
+    return any(media_range == media_type and quality > 0 for media_range, quality in parse_accept(accept))
+
+
+def select_media_type(accept: str = None, media_types=None) -> str:
+    """
+    Returns the response format the Accept header prefers, from the media types the endpoint can
+    return (by default every format, MessagePack only if msgpack is installed): the highest quality,
+    then the one the client listed first, then the order of MEDIA_TYPE_NAMES.
+    Returns None if the header accepts none of them, and JSON if there is no header.
+    """
+    if media_types is None:
+        media_types = [media_type for media_type in MEDIA_TYPE_NAMES if media_type != MSGPACK_MEDIA_TYPE or msgpack is not None]
+    if accept is None or not accept.strip():
+        return JSON_MEDIA_TYPE if JSON_MEDIA_TYPE in media_types else media_types[0]
+    ranges = parse_accept(accept)
+    selected, selected_preference = None, None
+    for media_type in media_types:
+        quality, position = accepted_quality(ranges, MEDIA_TYPE_NAMES[media_type])
+        if quality > 0 and (selected is None or (quality, -position) > selected_preference):
+            selected, selected_preference = media_type, (quality, -position)
+    return selected
@@ -0,0 +1,58 @@
+"""
+Single-flight request coalescing
+"""
+# Standard imports
+import asyncio
+import os
+from typing import Awaitable, Callable, Hashable
+
+# local imports
+from utilities import offload
+
+
+class SingleFlight:
+    """
+    Runs one call at a time for each key. Callers arriving while a call for the same key is in
+    flight await it and share its result (or its exception) instead of making their own call.
+    The first caller for a key is its leader; the callers who wait are counted as coalesced.
+    Each call runs as its own task, so a caller which is cancelled does not cancel the call
+    the others are waiting for.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable]):
+        """
+        Returns the result of awaiting function(), or of the call already in flight for this key
+        """
+        if not self.enabled:
+            return await function()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(function())
+            # later callers start a new flight, and find the result in the calculation cache
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(flight)
+
+    def statistics(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+
+# only offloaded calculations overlap: inline ones finish before the next request starts, so there
+# is never one in flight to share, and coalescing is reported as disabled
+calculation_flights = SingleFlight(
+    enabled=offload.offload_calculations and os.getenv("DKA_SINGLE_FLIGHT", "true").lower() in ("true", "1", "yes")
+)
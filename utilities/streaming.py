@@ -0,0 +1,48 @@
+"""
+Streaming responses
+"""
+# Third party imports
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# the longest single NDJSON record accepted, so that a body without newlines cannot grow the buffer without limit
+MAXIMUM_NDJSON_LINE_BYTES = 65536
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streams newline-delimited JSON while the request body is still being read.
+    The Starlette StreamingResponse listens for client disconnection on the same receive
+    channel the request body arrives on, which would swallow the body of a streaming upload.
+    This response only sends, so a disconnection surfaces as an error reading the request or
+    writing the response instead. Each record is written before the next is read, so the
+    server's flow control on both the upload and the download applies backpressure.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def ndjson_lines(byte_stream):
+    """
+    Yields each non-empty line from an asynchronous stream of byte chunks,
+    holding no more than one partial line in memory.
+    """
+    buffer = b""
+    async for chunk in byte_stream:
+        buffer += chunk
+        if b"\n" in chunk:
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if len(line) > MAXIMUM_NDJSON_LINE_BYTES:
+                    raise ValueError(f"NDJSON record longer than {MAXIMUM_NDJSON_LINE_BYTES} bytes.")
+                if line.strip():
+                    yield line
+        # checked after every chunk, whether or not it ended a line, so the partial line stays bounded
+        if len(buffer) > MAXIMUM_NDJSON_LINE_BYTES:
+            raise ValueError(f"NDJSON record longer than {MAXIMUM_NDJSON_LINE_BYTES} bytes.")
+    if buffer.strip():
+        yield buffer
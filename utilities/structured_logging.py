@@ -0,0 +1,166 @@
+"""
+Structured, non-blocking logging
+"""
+# Standard imports
+from datetime import datetime, timezone
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import random
+import sys
+
+# Third party imports
+from pydantic import BaseModel
+
+REDACTED = "[REDACTED]"
+
+# attributes every LogRecord has, so anything else was passed with extra=
+_STANDARD_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without formatting them and without waiting.
+    Formatting and redaction happen on the listener thread, and if the queue is full the record
+    is dropped and counted rather than slowing the request down.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a random fraction of records below WARNING, and every record at WARNING or above
+    """
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.sample_rate >= 1 or random.random() < self.sample_rate
+
+
+def redact(value, redact_fields: frozenset):
+    """
+    Returns the value as plain data with any redacted fields replaced.
+    Pydantic models are converted to dictionaries here, off the request path.
+    """
+    if isinstance(value, BaseModel):
+        value = dict(value)
+    if isinstance(value, dict):
+        return {key: REDACTED if key in redact_fields else redact(item, redact_fields) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, redact_fields) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record and its extra fields as a JSON object, or as text with key=value pairs,
+    replacing the value of any redacted field wherever it appears
+    """
+
+    def __init__(self, output_format: str = "json", redact_fields: tuple = ("birth_date",)):
+        super().__init__()
+        self.output_format = output_format
+        self.redact_fields = frozenset(redact_fields)
+
+    def fields(self, record: logging.LogRecord) -> dict:
+        fields = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES:
+                fields[key] = REDACTED if key in self.redact_fields else redact(value, self.redact_fields)
+        if record.exc_info:
+            fields["exception"] = self.formatException(record.exc_info)
+        return fields
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = self.fields(record)
+        if self.output_format == "json":
+            return json.dumps(fields, default=str)
+        return " ".join(f"{key}={json.dumps(value, default=str) if not isinstance(value, str) else value}" for key, value in fields.items())
+
+
+logger = logging.getLogger("dka")
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+_listener = None
+_queue_handler = None
+
+
+def start_logging(
+    level: str = None,
+    output_format: str = None,
+    sample_rate: float = None,
+    redact_fields: tuple = None,
+    queue_size: int = None,
+    stream=None
+) -> QueueListener:
+    """
+    Attaches the queue handler to the dka logger and starts the background listener thread
+    which formats and writes the records. Unset arguments are read from the environment:
+    DKA_LOG_LEVEL, DKA_LOG_FORMAT (json or text), DKA_LOG_SAMPLE_RATE, DKA_LOG_REDACT_FIELDS
+    (comma separated) and DKA_LOG_QUEUE_SIZE.
+    """
+    global _listener, _queue_handler
+    stop_logging()
+
+    level = level or os.getenv("DKA_LOG_LEVEL", "INFO")
+    output_format = output_format or os.getenv("DKA_LOG_FORMAT", "json")
+    sample_rate = sample_rate if sample_rate is not None else float(os.getenv("DKA_LOG_SAMPLE_RATE", 1.0))
+    if redact_fields is None:
+        redact_fields = tuple(field.strip() for field in os.getenv("DKA_LOG_REDACT_FIELDS", "birth_date").split(",") if field.strip())
+    queue_size = queue_size or int(os.getenv("DKA_LOG_QUEUE_SIZE", 10000))
+
+    output_handler = logging.StreamHandler(stream or sys.stdout)
+    output_handler.setFormatter(StructuredFormatter(output_format=output_format, redact_fields=redact_fields))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    logger.setLevel(level)
+    logger.addHandler(_queue_handler)
+
+    _listener = QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Writes any queued records, then stops the listener thread and detaches the queue handler
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        logger.removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0